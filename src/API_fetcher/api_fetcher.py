@@ -1,7 +1,156 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
 import openmeteo_requests
 import requests_cache
+import numpy as np
 import pandas as pd
 from retry_requests import retry
+from http_cache import CACHE_EXPIRY_RULES, MAX_CACHE_ENTRIES, cache_stats, \
+    get_cache_tracker
+from metrics import locations_shared, upstream_duration, upstream_responses, \
+    upstream_retries
+
+# Open-Meteo accepts comma separated coordinate lists. Budget for the
+# encoded latitude + longitude values of one batched request, which keeps the
+# whole query string well below the 8 KiB request line limit of most servers.
+MAX_COORDINATE_CHARS = 4000
+# Coordinates are sent rounded, the model grids are kilometres wide anyway.
+COORDINATE_PRECISION = 4
+# Locations whose grid cell is remembered, the least recently used are forgotten
+MAX_GRID_CELL_LOCATIONS = 10000
+# Sustained rate and burst of Open-Meteo location calls of the whole process
+OPEN_METEO_CALLS_PER_SECOND = float(os.environ.get('OPEN_METEO_CALLS_PER_SECOND', 5))
+OPEN_METEO_BURST = float(os.environ.get('OPEN_METEO_BURST', 100))
+
+# Variables requested from Open-Meteo and the columns they are stored in,
+# per process method: (response section, [(API variable, column name)])
+VARIABLE_CATALOG = {
+    "process_daily_data": ("Daily", [
+        ("temperature_2m_mean", "temperature_2m_cels"),
+        ("rain_sum", "rain_mm"),
+        ("wind_speed_10m_max", "wind_speed_kmh"),
+    ]),
+    "process_forecast_weather_data": ("Hourly", [
+        ("temperature_2m", "temperature_2m_cels"),
+        ("rain", "rain_mm"),
+        ("wind_speed_10m", "wind_speed_kmh"),
+    ]),
+    "process_air_quality_data": ("Hourly", [
+        ("pm10", "pm10"),
+        ("pm2_5", "pm2_5"),
+        ("carbon_dioxide", "carbon_dioxide"),
+        ("nitrogen_dioxide", "nitrogen_dioxide"),
+        ("sulphur_dioxide", "sulphur_dioxide"),
+        ("ozone", "ozone"),
+    ]),
+}
+
+
+def catalog_variables(process_method: str):
+    """
+    :param process_method: Name of the WeatherDataProcessor method.
+    :return: The Open-Meteo variables the process method expects, in order.
+    """
+    return [variable for variable, _ in VARIABLE_CATALOG[process_method][1]]
+
+
+class GridCellIndex:
+    """
+    Remembers the model grid cell Open-Meteo resolved every location to, per
+    fetch method: the coordinates a response reports are the ones of the grid
+    cell the data comes from. Locations known to share a cell are fetched once.
+    At most max_entries locations are kept, the least recently used are forgotten.
+    """
+
+    def __init__(self, max_entries: int = MAX_GRID_CELL_LOCATIONS):
+        self.cells = OrderedDict()
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+    def cell(self, fetch_method: str, latitude: float, longitude: float):
+        """
+        :return: (latitude, longitude) of the grid cell of the location, None if unknown.
+        """
+        key = (fetch_method, latitude, longitude)
+        with self.lock:
+            if key not in self.cells:
+                return None
+            self.cells.move_to_end(key)
+            return self.cells[key]
+
+    def record(self, fetch_method: str, latitude: float, longitude: float, response):
+        """
+        Remember the grid cell a response of the location reports.
+        :param response: Open-Meteo response of the location.
+        """
+        cell = (round(float(response.Latitude()), COORDINATE_PRECISION),
+                round(float(response.Longitude()), COORDINATE_PRECISION))
+        key = (fetch_method, latitude, longitude)
+        with self.lock:
+            self.cells[key] = cell
+            self.cells.move_to_end(key)
+            while len(self.cells) > self.max_entries:
+                self.cells.popitem(last=False)
+
+    def clear(self):
+        """
+        Forget every location, e.g. when the upstream models changed.
+        """
+        with self.lock:
+            self.cells.clear()
+
+
+grid_cells = GridCellIndex()
+
+
+def endpoint_name(url: str):
+    """
+    :param url: URL of an Open-Meteo request.
+    :return: Last segment of the URL path, e.g. "archive" or "forecast".
+    """
+    return urlparse(url).path.rstrip("/").rsplit("/", 1)[-1]
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket limiting the rate of upstream API calls.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        :param rate: Tokens added per second.
+        :param capacity: Maximum number of tokens, the allowed burst.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1):
+        """
+        Block until the tokens are available and take them.
+        :param tokens: Number of tokens to take, capped at the capacity.
+        """
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Every fetcher of the process shares it unless it is given its own
+upstream_rate_limiter = TokenBucket(OPEN_METEO_CALLS_PER_SECOND, OPEN_METEO_BURST)
 
 
 class WeatherDataFetcher:
@@ -10,37 +159,115 @@ class WeatherDataFetcher:
     """
 
     def __init__(self, cache_path: str = ".cache",
-                 cache_expiry: int = -1, retries: int = 5, backoff_factor: float = 0.2):
+                 cache_expiry: int = -1, retries: int = 5, backoff_factor: float = 0.2,
+                 rate_limiter: TokenBucket = None, urls_expire_after: dict = None,
+                 max_cache_entries: int = MAX_CACHE_ENTRIES):
         """
         Initialize the WeatherDataFetcher with caching and retry mechanisms.
         :param cache_path: Path for caching API responses.
-        :param cache_expiry: Expiration time for cache (default: no expiration).
+        :param cache_expiry: Expiration time for cache of URLs without an expiry rule
+                             (default: no expiration).
         :param retries: Number of retries on request failures.
         :param backoff_factor: Factor for exponential backoff in retries.
+        :param rate_limiter: Token bucket shared by fetchers, one token per location
+                             (default: the process wide upstream_rate_limiter).
+        :param urls_expire_after: Expiration time per URL pattern (default: CACHE_EXPIRY_RULES).
+        :param max_cache_entries: Number of cached responses kept, the least recently
+                                  used ones are evicted above it.
         """
         self.session = self._setup_session(
-            cache_path, cache_expiry, retries, backoff_factor)
+            cache_path, cache_expiry, retries, backoff_factor,
+            CACHE_EXPIRY_RULES if urls_expire_after is None else urls_expire_after)
+        self.cache = self.session.cache
+        self.cache_tracker = get_cache_tracker(self.cache, max_cache_entries)
+        self.session.hooks["response"].append(self._record_cache_use)
         self.client = openmeteo_requests.Client(session=self.session)
+        self.rate_limiter = upstream_rate_limiter if rate_limiter is None else rate_limiter
+        self.api_calls = 0
 
     @staticmethod
-    def _setup_session(cache_path: str, cache_expiry: int, retries: int = 5, backoff_factor: float = 0.2):
+    def _setup_session(cache_path: str, cache_expiry: int, retries: int = 5,
+                       backoff_factor: float = 0.2, urls_expire_after: dict = None):
         """
         Set up a cached and retry-enabled session.
         :param cache_path: Path for caching API responses.
         :param cache_expiry: Expiration time for cache.
         :param retries: Number of retries on request failures.
         :param backoff_factor: Factor for exponential backoff in retries.
+        :param urls_expire_after: Expiration time per URL pattern.
         :return: Configured requests session.
         """
         cache_session = requests_cache.CachedSession(
-            cache_path, expire_after=cache_expiry)
-        retry_session = retry(cache_session, retries, backoff_factor=0.2)
+            cache_path, expire_after=cache_expiry,
+            urls_expire_after=urls_expire_after)
+        retry_session = retry(cache_session, retries, backoff_factor=backoff_factor)
 
         return retry_session
 
+    def _record_cache_use(self, response, *args, **kwargs):
+        """
+        Response hook counting cache hits and misses and keeping the cache
+        within its size limit.
+        :param response: Response returned by the cached session.
+        :return: The response unchanged.
+        """
+        # On a miss the hooks also run on the plain response inside
+        # requests.Session.send, before the cached session wraps it. Only the
+        # wrapped response, which has from_cache, is counted.
+        if not hasattr(response, "from_cache"):
+            return response
+        from_cache = response.from_cache
+        cache_stats.record(from_cache)
+        endpoint = endpoint_name(response.url)
+        upstream_responses.inc(endpoint=endpoint, cache="hit" if from_cache else "miss")
+        retries = getattr(getattr(response, "raw", None), "retries", None)
+        if retries is not None and retries.history:
+            upstream_retries.inc(len(retries.history), endpoint=endpoint)
+        cache_key = getattr(response, "cache_key", None)
+        if cache_key:
+            self.cache_tracker.record(cache_key, from_cache)
+        return response
+
+    def cache_stats(self):
+        """
+        :return: Process-wide hit and miss counters and the size of this cache.
+        """
+        return {**cache_stats.snapshot(), **self.cache_tracker.size()}
+
+    @staticmethod
+    def _normalize_params(params: dict):
+        """
+        Normalize request parameters so equal requests share one cache key. The
+        cache sorts the parameters itself; variable lists are sent comma joined
+        so their order, which the responses are indexed by, stays part of the
+        key, and single coordinates are rounded like batched ones.
+        :param params: Request parameters.
+        :return: Normalized copy of params.
+        """
+        params = dict(params)
+        for key, value in params.items():
+            if isinstance(value, (list, tuple)):
+                params[key] = ",".join(str(item) for item in value)
+            elif key in ("latitude", "longitude") and isinstance(value, (int, float)):
+                params[key] = round(float(value), COORDINATE_PRECISION)
+        return params
+
+    def _weather_api(self, url: str, params: dict):
+        """
+        Call the Open-Meteo API, waiting for the rate limiter first.
+        :param url: Endpoint URL.
+        :param params: Request parameters.
+        :return: List of responses, one per location.
+        """
+        self.rate_limiter.acquire(str(params["latitude"]).count(",") + 1)
+        self.api_calls += 1
+        with upstream_duration.time(endpoint=endpoint_name(url)):
+            return self.client.weather_api(url, params=self._normalize_params(params))
+
     def fetch_daily_weather_data(self, latitude: float, longitude: float,
                                  start_date: str, end_date: str,
-                                 timezone: str = "Europe/Berlin"):
+                                 timezone: str = "Europe/Berlin",
+                                 all_locations: bool = False):
         """
         Fetch weather data for a specific location and time period.
         :param latitude: Latitude of the location.
@@ -49,6 +276,7 @@ class WeatherDataFetcher:
         :param end_date: End date for weather data.
         :param daily_variables: List of daily variables to fetch.
         :param timezone: Timezone for data (default: Europe/Berlin).
+        :param all_locations: Return every response of a multi-location request.
         :return: Response object from the API.
         """
 
@@ -58,17 +286,17 @@ class WeatherDataFetcher:
             "longitude": longitude,
             "start_date": start_date,
             "end_date": end_date,
-            "daily": ["temperature_2m_mean", "rain_sum",
-                      "wind_speed_10m_max", "shortwave_radiation_sum"],
+            "daily": catalog_variables("process_daily_data"),
             "timezone": timezone,
         }
-        responses = self.client.weather_api(url, params=params)
-        return responses[0]  # Assuming single location response for now
+        responses = self._weather_api(url, params)
+        return responses if all_locations else responses[0]
 
     def fetch_forecast_weather_data(self, latitude: float, longitude: float,
                                     start_date: str, end_date: str,
                                     temporal_resolution: str = 'hourly_6',
-                                    timezone: str = "Europe/Berlin"):
+                                    timezone: str = "Europe/Berlin",
+                                    all_locations: bool = False):
         """
         Fetch weather data for a specific location and time period.
         :param latitude: Latitude of the location.
@@ -77,6 +305,7 @@ class WeatherDataFetcher:
         :param end_date: End date for weather data.
         :param daily_variables: List of daily variables to fetch.
         :param timezone: Timezone for data (default: Europe/Berlin).
+        :param all_locations: Return every response of a multi-location request.
         :return: Response object from the API.
         """
 
@@ -86,18 +315,18 @@ class WeatherDataFetcher:
             "longitude": longitude,
             "start_date": start_date,
             "end_date": end_date,
-            "hourly": ["temperature_2m", "rain", "wind_speed_10m", "shortwave_radiation"],
+            "hourly": catalog_variables("process_forecast_weather_data"),
             "temporal_resolution": temporal_resolution,
             "timezone": timezone,
         }
-        responses = self.client.weather_api(url, params=params)
-        return responses[0]  # Assuming single location response for now
+        responses = self._weather_api(url, params)
+        return responses if all_locations else responses[0]
 
     def fetch_air_quality_data(self, latitude: float, longitude: float,
                                start_date: str, end_date: str,
                                temporal_resolution: str = 'hourly_6',
-                               timezone: str = "Europe/Berlin"
-                               ):
+                               timezone: str = "Europe/Berlin",
+                               all_locations: bool = False):
         """
         Fetch weather data for a specific location and time period.
         :param latitude: Latitude of the location.
@@ -106,6 +335,7 @@ class WeatherDataFetcher:
         :param end_date: End date for weather data.
         :param hourly_variables: List of daily variables to fetch.
         :param timezone: Timezone for data (default: Europe/Berlin).
+        :param all_locations: Return every response of a multi-location request.
         :return: Response object from the API.
         """
 
@@ -113,138 +343,191 @@ class WeatherDataFetcher:
         params = {
             "latitude": latitude,
             "longitude": longitude,
-            "hourly": [
-                "pm10", "pm2_5", "carbon_dioxide",
-                "nitrogen_dioxide", "sulphur_dioxide",
-                "ozone"],
+            "hourly": catalog_variables("process_air_quality_data"),
             "temporal_resolution": temporal_resolution,
             "start_date": start_date,
             "end_date": end_date,
             "timezone": timezone,
         }
-        responses = self.client.weather_api(url, params=params)
-        return responses[0]
+        responses = self._weather_api(url, params)
+        return responses if all_locations else responses[0]
+
+    @staticmethod
+    def batch_locations(locations, max_coordinate_chars: int = MAX_COORDINATE_CHARS):
+        """
+        Split locations into batches whose coordinate lists fit in one request.
+        :param locations: Iterable of (place, latitude, longitude) tuples, place identifies
+                          the location (e.g. its place_id).
+        :param max_coordinate_chars: Maximum encoded length of the coordinate lists.
+        :return: List of batches, each a list of (place, latitude, longitude).
+        """
+        batches = []
+        batch = []
+        batch_chars = 0
+        for place, latitude, longitude in locations:
+            latitude = round(float(latitude), COORDINATE_PRECISION)
+            longitude = round(float(longitude), COORDINATE_PRECISION)
+            # The separating comma is URL encoded as %2C
+            chars = len(str(latitude)) + len(str(longitude)) + 6
+            if batch and batch_chars + chars > max_coordinate_chars:
+                batches.append(batch)
+                batch = []
+                batch_chars = 0
+            batch.append((place, latitude, longitude))
+            batch_chars += chars
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def fetch_many(self, fetch_method: str, locations,
+                   start_date: str, end_date: str,
+                   timezone: str = "Europe/Berlin",
+                   max_coordinate_chars: int = MAX_COORDINATE_CHARS,
+                   dedup_cells: bool = True):
+        """
+        Fetch data for many locations, packing as many of them into one request
+        as the URL length allows. Locations with the same coordinates, or in a
+        grid cell already fetched for another location, share one response.
+        :param fetch_method: Name of the fetch method to use (e.g. "fetch_daily_weather_data").
+        :param locations: Iterable of (place, latitude, longitude) tuples.
+        :param start_date: Start date for weather data.
+        :param end_date: End date for weather data.
+        :param timezone: Timezone for data (default: Europe/Berlin).
+        :param max_coordinate_chars: Maximum encoded length of the coordinate lists.
+        :param dedup_cells: Fetch every known model grid cell once. The data of a
+                            cell is then the one downscaled to the elevation of
+                            the location fetched for it.
+        :return: List of (place, response) tuples in the order of locations.
+        """
+        # Every distinct cell (or unknown location) is fetched for its first location
+        to_fetch = {}
+        places = []
+        for place, latitude, longitude in locations:
+            latitude = round(float(latitude), COORDINATE_PRECISION)
+            longitude = round(float(longitude), COORDINATE_PRECISION)
+            cell = grid_cells.cell(fetch_method, latitude, longitude) \
+                if dedup_cells else None
+            key = ("cell", cell) if cell is not None else ("location", latitude, longitude)
+            to_fetch.setdefault(key, (key, latitude, longitude))
+            places.append((place, key))
+
+        responses = {}
+        for batch in self.batch_locations(to_fetch.values(), max_coordinate_chars):
+            batch_responses = getattr(self, fetch_method)(
+                latitude=",".join(str(lat) for _, lat, _ in batch),
+                longitude=",".join(str(lon) for _, _, lon in batch),
+                start_date=start_date,
+                end_date=end_date,
+                timezone=timezone,
+                all_locations=True
+            )
+            if len(batch_responses) != len(batch):
+                raise ValueError(
+                    f"Expected {len(batch)} responses, got {len(batch_responses)}.")
+            for (key, latitude, longitude), response in zip(batch, batch_responses):
+                grid_cells.record(fetch_method, latitude, longitude, response)
+                responses[key] = response
+
+        shared = len(places) - len(to_fetch)
+        if shared:
+            locations_shared.inc(shared, endpoint=fetch_method)
+            print(f"{shared} of {len(places)} locations shared a response of another location.")
+        return [(place, responses[key]) for place, key in places]
 
 
 class WeatherDataProcessor:
     """
-    Class that processes the Weather data returned by the WeatherDataFetcher class
-    In the functions variables are defined inside the function 
-    becaouse they are static for database use
+    Class that processes the Weather data returned by the WeatherDataFetcher class.
+    The variables and columns of every process method come from VARIABLE_CATALOG,
+    the same catalog the fetcher builds its requests from.
     """
 
-    def __init__(self, response, place_name: str):
+    def __init__(self, response, place_id: int):
         """
         Initialize the processor with the API response.
         :param response: API response object containing weather data.
+        :param place_id: Id of the place in places_data the response belongs to.
         """
         self.response = response
-        self.place_name = place_name
+        self.place_id = place_id
 
-    def process_daily_data(self) -> pd.DataFrame:
+    @staticmethod
+    def process_many(responses, process_method: str) -> pd.DataFrame:
         """
-        Process daily weather data from the API response.
-        :return: Pandas DataFrame of daily weather data.
+        Process the responses of many places into one DataFrame. Every column is
+        allocated once for all places and filled straight from the response arrays.
+        :param responses: List of (place_id, response) tuples.
+        :param process_method: Name of the process method defining the variables.
+        :return: Pandas DataFrame with place_id, date_id and one float32 column per variable.
         """
-        daily_variables = ["temperature_2m_cels", "rain_mm",
-                           "wind_speed_kmh"]
-
-        daily = self.response.Daily()
-        variables = [daily.Variables(i).ValuesAsNumpy()
-                     for i in range(len(daily_variables))]
-
-        daily_data = {
-            "date_id": pd.date_range(
-                start=pd.to_datetime(daily.Time(), unit="s", utc=True),
-                end=pd.to_datetime(daily.TimeEnd(), unit="s", utc=True),
-                freq=pd.Timedelta(seconds=daily.Interval()),
-                inclusive="right",
-            )
+        section_name, variables = VARIABLE_CATALOG[process_method]
+        # Places sharing a grid cell share its response, which is decoded once
+        sections = {}
+        for _, response in responses:
+            if id(response) not in sections:
+                sections[id(response)] = getattr(response, section_name)()
+        # Timestamps are the right edges of the intervals between Time and TimeEnd
+        lengths = {key: (section.TimeEnd() - section.Time()) // section.Interval()
+                   for key, section in sections.items()}
+        total = sum(lengths[id(response)] for _, response in responses)
+
+        place_ids = np.empty(total, dtype="int32")
+        timestamps = np.empty(total, dtype="int64")
+        values = {column: np.empty(total, dtype="float32")
+                  for _, column in variables}
+
+        offset = 0
+        # id of a decoded response -> the rows it was decoded into
+        decoded = {}
+        for place_id, response in responses:
+            key = id(response)
+            rows = slice(offset, offset + lengths[key])
+            place_ids[rows] = place_id
+            if key in decoded:
+                timestamps[rows] = timestamps[decoded[key]]
+                for _, column in variables:
+                    values[column][rows] = values[column][decoded[key]]
+            else:
+                section = sections[key]
+                timestamps[rows] = section.Time() + section.Interval() * \
+                    np.arange(1, lengths[key] + 1, dtype="int64")
+                for index, (_, column) in enumerate(variables):
+                    values[column][rows] = section.Variables(index).ValuesAsNumpy()
+                decoded[key] = rows
+            offset += lengths[key]
+
+        data = {
+            "place_id": place_ids,
+            "date_id": pd.to_datetime(timestamps, unit="s", utc=True),
+            **values,
         }
+        return pd.DataFrame(data, copy=False)
 
-        for idx, var in enumerate(variables):
-            # Use variable names dynamically
-            daily_data[daily_variables[idx]] = var
-
-        daily_dataframe = pd.DataFrame(data=daily_data)
-
-        daily_dataframe['place_name'] = self.place_name
-        daily_dataframe = daily_dataframe[['place_name',
-                                           'date_id',
-                                           "temperature_2m_cels",
-                                           "rain_mm",
-                                           "wind_speed_kmh"
-                                           ]]
-
-        return daily_dataframe
+    def process(self, process_method: str) -> pd.DataFrame:
+        """
+        Process the API response with the variables of a process method.
+        :param process_method: Name of the process method defining the variables.
+        :return: Pandas DataFrame of the response.
+        """
+        return self.process_many([(self.place_id, self.response)], process_method)
 
-    def process_forecast_weather_data(self) -> pd.DataFrame:
+    def process_daily_data(self) -> pd.DataFrame:
         """
         Process daily weather data from the API response.
         :return: Pandas DataFrame of daily weather data.
         """
-        hourly_variables = ["temperature_2m_cels", "rain_mm",
-                            "wind_speed_kmh"]
-        hourly = self.response.Hourly()
-        variables = [hourly.Variables(i).ValuesAsNumpy()
-                     for i in range(len(hourly_variables))]
-
-        hourly_data = {
-            "date_id": pd.date_range(
-                start=pd.to_datetime(hourly.Time(), unit="s", utc=True),
-                end=pd.to_datetime(hourly.TimeEnd(), unit="s", utc=True),
-                freq=pd.Timedelta(seconds=hourly.Interval()),
-                inclusive="right",
-            )
-        }
-
-        for idx, var in enumerate(variables):
-            # Use variable names dynamically
-            hourly_data[hourly_variables[idx]] = var
+        return self.process("process_daily_data")
 
-        forecast_dataframe = pd.DataFrame(data=hourly_data)
-
-        forecast_dataframe['place_name'] = self.place_name
-        forecast_dataframe = forecast_dataframe[['place_name',
-                                                 'date_id',
-                                                 "temperature_2m_cels",
-                                                 "rain_mm",
-                                                 "wind_speed_kmh"
-                                                 ]]
-        return forecast_dataframe
+    def process_forecast_weather_data(self) -> pd.DataFrame:
+        """
+        Process hourly forecast weather data from the API response.
+        :return: Pandas DataFrame of forecast weather data.
+        """
+        return self.process("process_forecast_weather_data")
 
     def process_air_quality_data(self) -> pd.DataFrame:
-        hourly_variables = [
-            "pm10", "pm2_5", "carbon_dioxide",
-            "nitrogen_dioxide", "sulphur_dioxide",
-            "ozone"]
-        hourly = self.response.Hourly()
-        variables = [hourly.Variables(i).ValuesAsNumpy()
-                     for i in range(len(hourly_variables))]
-
-        hourly_data = {
-            "date_id": pd.date_range(
-                start=pd.to_datetime(hourly.Time(), unit="s", utc=True),
-                end=pd.to_datetime(hourly.TimeEnd(), unit="s", utc=True),
-                freq=pd.Timedelta(seconds=hourly.Interval()),
-                inclusive="right",
-            )
-        }
-
-        for idx, var in enumerate(variables):
-            # Use variable names dynamically
-            hourly_data[hourly_variables[idx]] = var
-
-        air_q_dataframe = pd.DataFrame(data=hourly_data)
-
-        air_q_dataframe['place_name'] = self.place_name
-        air_q_dataframe = air_q_dataframe[['place_name',
-                                           'date_id',
-                                           'pm10',
-                                           'pm2_5',
-                                           'carbon_dioxide',
-                                           'nitrogen_dioxide',
-                                           'sulphur_dioxide',
-                                           'ozone']]
-
-        return air_q_dataframe
+        """
+        Process hourly air quality data from the API response.
+        :return: Pandas DataFrame of air quality data.
+        """
+        return self.process("process_air_quality_data")
@@ -1,38 +1,93 @@
-from fastapi import FastAPI, Query, HTTPException
-import pandas as pd
-from sqlalchemy import create_engine
+from fastapi import FastAPI, Query, HTTPException, Request
+from fastapi.responses import FileResponse, PlainTextResponse
+from pydantic import BaseModel
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import asyncio
+import functools
 from api_fetcher import WeatherDataFetcher  # Import your classes
 from api_fetcher import WeatherDataProcessor
-from data_access.data_write import save_to_postgres
-from utility import fetch_and_process_multiple
+from common.engine import pool_stats
+from http_cache import cache_report
+from data_access.data_versions import get_data_versions
+from jobs import IngestJobManager
+from metrics import registry, CONTENT_TYPE
+from common.profiling import PROFILE_HEADER, ProfileSession, is_requested, \
+    profile_store, should_profile
+from scheduler import RefreshSchedule, RefreshScheduler
+from utility import fetch_and_process_multiple, build_fetch_process_pairs, \
+    HISTORY_START_DATE
+import logging
 import os
-import datetime
 
-app = FastAPI()
+# Shared modules (e.g. common.profiling) log through the root logger
+logging.basicConfig(level=logging.INFO)
 
 # Database configuration
 DB_URL = os.environ['DB_URL']
 TABLE_NAME = "daily_weather_data"
 
-# Seting the time for dynamic DB insertion
-today = datetime.date.today()
-today_str = today.strftime("%Y-%m-%d")
+# Background refresh of every tracked place
+SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true'
+# The first refresh waits, so a restart does not refetch every place right away
+SCHEDULER_START_DELAY_SECONDS = float(os.environ.get('SCHEDULER_START_DELAY_SECONDS', 600))
+scheduler = RefreshScheduler(
+    DB_URL,
+    schedules=[
+        RefreshSchedule("forecast",
+                        float(os.environ.get('FORECAST_REFRESH_SECONDS', 3600)),
+                        ['forecast_weather_data']),
+        RefreshSchedule("archive",
+                        float(os.environ.get('ARCHIVE_REFRESH_SECONDS', 86400)),
+                        ['daily_weather_data', 'air_quality_data']),
+    ],
+    max_workers=int(os.environ.get('SCHEDULER_WORKERS', 4)))
 
-future_date = today + datetime.timedelta(days=7)
-future_date_str = future_date.strftime("%Y-%m-%d")
 
-past_3_days = today - datetime.timedelta(days=3)
-past_3_days_str = past_3_days.strftime("%Y-%m-%d")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start the refresh scheduler with the service and stop it on shutdown.
+    """
+    if SCHEDULER_ENABLED:
+        scheduler.start(delay=SCHEDULER_START_DELAY_SECONDS)
+    yield
+    scheduler.stop(timeout=5)
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Fetching and saving uses blocking requests and SQLAlchemy calls, so they run
+# on a bounded thread pool to keep the event loop free for other requests.
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 6))
+ingest_executor = ThreadPoolExecutor(
+    max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+
+# Background ingest jobs submitted through /jobs
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+job_manager = IngestJobManager(DB_URL, max_workers=JOB_WORKERS)
+
+
+class IngestJobRequest(BaseModel):
+    """
+    Body of an ingest job submission.
+    """
+    lat: float
+    lon: float
+    place_name: str
+    timezone: str = "Europe/Berlin"
 
 
 @app.get("/weather")
 async def fetch_and_save_weather(
+    request: Request,
     lat: float = Query(...),
     lon: float = Query(...),
     place_name: str = Query(...),
-    start_date: str = Query(default="2024-06-03"),
-    end_date: str = Query(default=future_date_str),
-    timezone: str = Query(default="Europe/Berlin")
+    start_date: str = Query(default=HISTORY_START_DATE),
+    end_date: str = Query(default=None),
+    timezone: str = Query(default="Europe/Berlin"),
+    profile: str = Query(default=None)
 ):
     """
     Fetch, process, and save weather data to the database.
@@ -42,43 +97,152 @@ async def fetch_and_save_weather(
     :param start_date: Start date for weather data (YYYY-MM-DD)
     :param end_date: End date for weather data (YYYY-MM-DD)
     :param timezone: Timezone for the weather data (default: Europe/Berlin)
+    :param profile: Profile the request (also requested by the X-Profile header),
+                    when profiling is enabled for the service
     """
+    requested = is_requested(profile) or is_requested(request.headers.get(PROFILE_HEADER))
+    session = ProfileSession() if should_profile(requested) else None
     try:
-
-        fetch_process_pairs = [
-            ("fetch_daily_weather_data", "process_daily_data",
-             'daily_weather_data', "2024-06-03", past_3_days_str),
-            ("fetch_air_quality_data", "process_air_quality_data",
-             'air_quality_data', "2024-06-03", today),
-            ("fetch_forecast_weather_data", "process_forecast_weather_data",
-             'forecast_weather_data', past_3_days_str, future_date),
-        ]
-        # Instantiate the WeatherDataFetcher
-        fetcher = WeatherDataFetcher()
+        # Archive and air quality data is only fetched after the stored data
+        fetch_process_pairs = build_fetch_process_pairs()
+        loop = asyncio.get_running_loop()
         processor_class = WeatherDataProcessor
 
-        for fetch_method, process_method, \
-                table_name, start_timestamp, end_timestamp in fetch_process_pairs:
-            fetch_and_process_multiple(
-                fetcher=fetcher,
-                processor_class=processor_class,
-                fetch_method=fetch_method,
-                process_method=process_method,
-                latitude=lat,
-                longitude=lon,
-                start_date=start_timestamp,
-                end_date=end_timestamp,
-                timezone=timezone,
-                place_name=place_name,
-                connection_url=os.environ['DB_URL'], table_name=table_name)
-
-        return {"message": "Weather data successfully saved to the database."}
+        # Each branch gets its own fetcher, the cached sessions are not shared
+        # between threads
+        results = await asyncio.gather(*[
+            loop.run_in_executor(
+                ingest_executor,
+                functools.partial(
+                    fetch_and_process_multiple if session is None
+                    else session.wrap(fetch_and_process_multiple),
+                    fetcher=WeatherDataFetcher(),
+                    processor_class=processor_class,
+                    fetch_method=fetch_method,
+                    process_method=process_method,
+                    latitude=lat,
+                    longitude=lon,
+                    start_date=start_timestamp,
+                    end_date=end_timestamp,
+                    timezone=timezone,
+                    place_name=place_name,
+                    connection_url=os.environ['DB_URL'], table_name=table_name,
+                    incremental=incremental))
+            for fetch_method, process_method, table_name,
+            start_timestamp, end_timestamp, incremental in fetch_process_pairs
+        ])
+
+        # fetch_and_process_multiple returns None when a branch failed
+        tables = {table_name: "failed" if rows is None else "saved"
+                  for (_, _, table_name, *_), rows in zip(fetch_process_pairs, results)}
+        if "failed" in tables.values():
+            raise HTTPException(status_code=500, detail={
+                "message": "Weather data could not be saved for every table.",
+                "tables": tables})
+
+        result = {"message": "Weather data successfully saved to the database.",
+                  "tables": tables}
+        if session is not None:
+            result["profile_id"] = profile_store.save(session, f"weather-{place_name}")
+        return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"An error occurred: {str(e)}"
         )
 
 
+@app.post("/jobs", status_code=202)
+async def submit_ingest_job(job_request: IngestJobRequest):
+    """
+    Queue a fetch-process-save job for a place and return its id right away.
+    A job for a place that already has one in flight returns the running job.
+    :param job_request: Coordinates, name and timezone of the place.
+    """
+    job, created = job_manager.submit(
+        latitude=job_request.lat,
+        longitude=job_request.lon,
+        place_name=job_request.place_name,
+        timezone=job_request.timezone)
+    return {**job, "deduplicated": not created}
+
+
+@app.get("/jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    """
+    Report the status and progress of an ingest job.
+    :param job_id: Id returned by POST /jobs.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+
+@app.get("/scheduler/runs")
+async def scheduler_runs():
+    """
+    Report the statistics of the latest scheduled refresh runs.
+    """
+    return list(scheduler.runs)
+
+
+@app.get("/data-versions")
+async def data_versions():
+    """
+    Report the version of the stored data of every place changed by this
+    service, used by the UI to invalidate its cached query results.
+    """
+    return get_data_versions()
+
+
+@app.get("/cache/http")
+async def http_cache_stats():
+    """
+    Report the hit ratio and size of the Open-Meteo response cache.
+    """
+    return cache_report()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Expose the ingest stage latencies and the row, cache, retry and failure
+    counters in the Prometheus text format.
+    """
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/profiles")
+async def list_profiles():
+    """
+    List the stored request profiles, newest first.
+    """
+    return profile_store.list()
+
+
+@app.get("/profiles/{profile_id}")
+async def download_profile(profile_id: str):
+    """
+    Download a stored profile in pstats format.
+    :param profile_id: Id from GET /profiles or the profiled response.
+    """
+    path = profile_store.path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Unknown profile: {profile_id}")
+    return FileResponse(path, media_type="application/octet-stream",
+                        filename=os.path.basename(path))
+
+
+@app.get("/db/pool")
+async def database_pool_stats():
+    """
+    Report the connection pool usage of the shared database engines.
+    """
+    return pool_stats()
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=5000)
@@ -0,0 +1,389 @@
+"""
+End-to-end benchmark of the ingest and read paths: processing synthetic
+Open-Meteo responses, saving them with save_to_postgres and reading them back,
+against a temporary SQLite database standing in for PostgreSQL (or the
+database of --db-url).
+
+Run from src/API_fetcher:
+    python -m benchmarks.benchmark --places 100 --days 365 --output results.json
+    python -m benchmarks.benchmark --baseline results.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, String, \
+    Table, UniqueConstraint, create_engine, inspect, text
+from api_fetcher import VARIABLE_CATALOG, WeatherDataProcessor
+from common.schema import ROLLUPS
+from data_access.data_read import get_watermarks
+from data_access.data_write import save_to_postgres
+from common.engine import dispose_engines, get_engine
+from data_access.storage import PostgresStorage, get_tracked_places
+
+# Tables and process methods benchmarked, with the step of their timestamps
+BENCHMARK_TABLES = {
+    "daily_weather_data": ("process_daily_data", 86400),
+    "forecast_weather_data": ("process_forecast_weather_data", 3600),
+    "air_quality_data": ("process_air_quality_data", 3600),
+}
+START_DATE = "2024-06-03"
+
+
+class SyntheticVariable:
+    """
+    Stand-in of the VariableWithValues flatbuffer of the Open-Meteo SDK.
+    """
+
+    def __init__(self, values):
+        self.values = values
+
+    def ValuesAsNumpy(self):
+        return self.values
+
+
+class SyntheticSection:
+    """
+    Stand-in of the VariablesWithTime flatbuffer (the Daily or Hourly section).
+    """
+
+    def __init__(self, start, interval, variables):
+        self.start = start
+        self.interval = interval
+        self.variables = variables
+
+    def Time(self):
+        return self.start
+
+    def TimeEnd(self):
+        return self.start + self.interval * len(self.variables[0].values)
+
+    def Interval(self):
+        return self.interval
+
+    def Variables(self, index):
+        return self.variables[index]
+
+    def VariablesLength(self):
+        return len(self.variables)
+
+
+class SyntheticResponse:
+    """
+    Stand-in of the WeatherApiResponse of one location.
+    """
+
+    def __init__(self, latitude, longitude, section_name, section):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.sections = {section_name: section}
+
+    def Latitude(self):
+        return self.latitude
+
+    def Longitude(self):
+        return self.longitude
+
+    def Daily(self):
+        return self.sections.get("Daily")
+
+    def Hourly(self):
+        return self.sections.get("Hourly")
+
+
+def synthetic_values(column, length, interval, rng):
+    """
+    Generate a plausible series of a measure: a yearly (and for hourly data a
+    daily) cycle with noise for temperatures, sparse showers for rain and
+    skewed positive values for everything else.
+    :param column: Name of the stored column.
+    :param length: Number of values.
+    :param interval: Seconds between the values.
+    :param rng: numpy random Generator.
+    :return: float32 numpy array.
+    """
+    hours = np.arange(length) * interval / 3600
+    if column.startswith("temperature"):
+        values = 11 + 12 * np.sin(2 * np.pi * hours / 8766) + \
+            4 * np.sin(2 * np.pi * hours / 24) + rng.normal(0, 2, length)
+    elif column.startswith("rain"):
+        values = np.where(rng.random(length) < 0.2, rng.gamma(0.8, 3, length), 0)
+    else:
+        values = rng.gamma(2, 8, length)
+    return values.astype("float32")
+
+
+def synthetic_responses(process_method, places, days, interval, seed=0):
+    """
+    Build synthetic responses of many places for a process method.
+    :param process_method: Name of the WeatherDataProcessor method.
+    :param places: Number of places, their place_ids are 1..places.
+    :param days: Number of days per place.
+    :param interval: Seconds between the timestamps.
+    :param seed: Seed of the random values.
+    :return: List of (place_id, response) tuples.
+    """
+    rng = np.random.default_rng(seed)
+    section_name, variables = VARIABLE_CATALOG[process_method]
+    length = days * 86400 // interval
+    start = int(pd.Timestamp(START_DATE, tz="UTC").timestamp()) - interval
+    responses = []
+    for place_id in range(1, places + 1):
+        section = SyntheticSection(start, interval, [
+            SyntheticVariable(synthetic_values(column, length, interval, rng))
+            for _, column in variables])
+        responses.append((place_id, SyntheticResponse(
+            45.8 + rng.random() * 2.7, 16.1 + rng.random() * 6.8,
+            section_name, section)))
+    return responses
+
+
+def create_schema(connection_url, places):
+    """
+    Create the fact tables, their rollups and places_data with registered places.
+    The database must not hold any of them yet, so a benchmark never touches
+    real data; drop_schema removes them again.
+    :param connection_url: Database URL (SQLAlchemy format).
+    :param places: Number of places to register.
+    :return: SQLAlchemy metadata of the created tables.
+    """
+    metadata = MetaData()
+    places_data = Table("places_data", metadata,
+                        Column("place_id", Integer, primary_key=True),
+                        Column("place_name", String, unique=True),
+                        Column("longitude", Float),
+                        Column("latitude", Float))
+    for table_name, (process_method, _) in BENCHMARK_TABLES.items():
+        Table(table_name, metadata,
+              Column("place_id", Integer, nullable=False),
+              Column("date_id", DateTime, nullable=False),
+              *[Column(column, Float) for _, column
+                in VARIABLE_CATALOG[process_method][1]],
+              UniqueConstraint("place_id", "date_id"))
+    # Saves to PostgreSQL keep the rollups up-to-date, as in production
+    for rollup_name, measures, _ in ROLLUPS.values():
+        Table(rollup_name, metadata,
+              Column("place_id", Integer, nullable=False),
+              Column("granularity", String, nullable=False),
+              Column("bucket_start", DateTime, nullable=False),
+              Column("sample_count", Integer),
+              *[Column(f"{measure}_{aggregate}", Float) for measure in measures
+                for aggregate in ("mean", "min", "max")],
+              UniqueConstraint("place_id", "granularity", "bucket_start"))
+
+    engine = create_engine(connection_url)
+    existing = sorted(name for name in metadata.tables
+                      if inspect(engine).has_table(name))
+    if existing:
+        engine.dispose()
+        raise ValueError(f"The benchmark database already has the tables {existing}, "
+                         "benchmark against an empty database")
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(places_data.insert(), [
+            {"place_id": place_id, "place_name": f"Place {place_id}",
+             "latitude": 47.0, "longitude": 19.0}
+            for place_id in range(1, places + 1)])
+    engine.dispose()
+    return metadata
+
+
+def drop_schema(connection_url, metadata):
+    """
+    Drop the tables created by create_schema.
+    :param connection_url: Database URL (SQLAlchemy format).
+    :param metadata: SQLAlchemy metadata returned by create_schema.
+    """
+    engine = create_engine(connection_url)
+    metadata.drop_all(engine)
+    engine.dispose()
+
+
+def measure(function, repeat, setup=None):
+    """
+    Time a function, after an untimed setup before every run.
+    :param function: Function called with the result of setup.
+    :param repeat: Number of timed runs.
+    :param setup: Optional function preparing the argument of a run.
+    :return: Tuple of the run times in seconds and the result of the last run.
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        result = function(argument)
+        times.append(time.perf_counter() - start)
+    return times, result
+
+
+def summarize(times, rows):
+    """
+    :param times: Run times in seconds.
+    :param rows: Rows handled by one run.
+    :return: Result entry of a benchmark case.
+    """
+    median = statistics.median(times)
+    return {
+        "rows": int(rows),
+        "runs": len(times),
+        "seconds_min": min(times),
+        "seconds_median": median,
+        "rows_per_second": rows / median if median else None,
+    }
+
+
+def run_benchmarks(places, days, repeat, connection_url=None):
+    """
+    Run every benchmark case.
+    :param places: Number of synthetic places.
+    :param days: Number of days per place.
+    :param repeat: Number of timed runs per case.
+    :param connection_url: Database to benchmark against, a temporary SQLite
+                           database by default. It must not hold the benchmark
+                           tables, they are created and dropped again.
+    :return: Dictionary of case name -> result entry.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        url = connection_url or "sqlite:///" + os.path.join(directory, "benchmark.db")
+
+        frames = {}
+        for table_name, (process_method, interval) in BENCHMARK_TABLES.items():
+            responses = synthetic_responses(process_method, places, days, interval)
+            times, frame = measure(
+                lambda _: WeatherDataProcessor.process_many(responses, process_method),
+                repeat)
+            frames[table_name] = frame
+            results[f"process.{table_name}"] = summarize(times, len(frame))
+            print(f"Processed {len(frame)} rows of {table_name}")
+
+        metadata = create_schema(url, places)
+        try:
+            results.update(run_database_benchmarks(url, frames, places, days, repeat))
+        finally:
+            dispose_engines()
+            drop_schema(url, metadata)
+    return results
+
+
+def run_database_benchmarks(url, frames, places, days, repeat):
+    """
+    Run the save and read cases against a database prepared by create_schema.
+    :param url: Database URL (SQLAlchemy format).
+    :param frames: Dictionary of table name -> processed DataFrame to save.
+    :param places: Number of synthetic places.
+    :param days: Number of days per place.
+    :param repeat: Number of timed runs per case.
+    :return: Dictionary of case name -> result entry.
+    """
+    results = {}
+    for table_name, frame in frames.items():
+        def empty_table():
+            with get_engine(url).begin() as connection:
+                connection.execute(text(f"DELETE FROM {table_name}"))
+
+        times, saved = measure(
+            lambda _: save_to_postgres(frame, url, table_name), repeat, empty_table)
+        results[f"save.{table_name}"] = summarize(times, saved)
+        # The second save of the same rows is all duplicates to skip
+        times, _ = measure(lambda _: save_to_postgres(frame, url, table_name), repeat)
+        results[f"save_duplicates.{table_name}"] = summarize(times, len(frame))
+
+    place_ids = list(range(1, places + 1))
+    storage = PostgresStorage(url)
+    end_date = (pd.Timestamp(START_DATE) + pd.Timedelta(days=days)).isoformat()
+    read_cases = {
+        "read.watermarks": lambda _: len(get_watermarks(
+            url, "forecast_weather_data", place_ids)),
+        "read.tracked_places": lambda _: len(get_tracked_places(url)),
+        "read.one_place_range": lambda _: len(storage.read(
+            "forecast_weather_data", place_ids=[1], start_date=START_DATE,
+            end_date=end_date)),
+        "read.all_places_range": lambda _: len(storage.read(
+            "daily_weather_data", start_date=START_DATE, end_date=end_date)),
+    }
+    for name, read in read_cases.items():
+        times, rows = measure(read, repeat)
+        results[name] = summarize(times, rows)
+    return results
+
+
+def compare(results, baseline, max_regression):
+    """
+    Compare the median times with a baseline run.
+    :param results: Results of this run.
+    :param baseline: Results of the baseline run.
+    :param max_regression: Allowed relative slowdown (0.2 is 20% slower).
+    :return: Dictionary of case name -> comparison, for the cases of both runs.
+    """
+    comparison = {}
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        baseline_seconds = baseline[name]["seconds_median"]
+        change = result["seconds_median"] / baseline_seconds - 1 \
+            if baseline_seconds else None
+        comparison[name] = {
+            "baseline_seconds_median": baseline_seconds,
+            "seconds_median": result["seconds_median"],
+            "change": change,
+            "regression": change is not None and change > max_regression,
+        }
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--places", type=int, default=50, help="Number of synthetic places.")
+    parser.add_argument("--days", type=int, default=90, help="Number of days per place.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case.")
+    parser.add_argument("--db-url", default=None,
+                        help="Empty database to benchmark against, the benchmark "
+                             "tables are created and dropped again.")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file.")
+    parser.add_argument("--baseline", default=None, help="JSON report to compare with.")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Relative slowdown against the baseline failing the run.")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.places, args.days, args.repeat, args.db_url)
+    report = {
+        "meta": {
+            "places": args.places,
+            "days": args.days,
+            "repeat": args.repeat,
+            "database": "sqlite" if args.db_url is None else args.db_url.split(":")[0],
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        },
+        "results": results,
+    }
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+        report["comparison"] = compare(results, baseline, args.max_regression)
+        regressions = [name for name, entry in report["comparison"].items()
+                       if entry["regression"]]
+        report["regressions"] = regressions
+
+    output = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import threading
+from sqlalchemy import bindparam, text
+from common.engine import get_engine
+
+# place_name -> place_id per database, ids never change once issued
+_place_ids = {}
+_place_ids_lock = threading.Lock()
+
+
+def get_place_ids(connection_url, place_names):
+    """
+    Resolves place names to their place_id, through a process wide cache.
+    :param connection_url: Database URL (SQLAlchemy format).
+    :param place_names: Names of the places to look up.
+    :return: Dictionary of place_name -> place_id, unknown places are missing.
+    """
+    cache = _place_ids.setdefault(connection_url, {})
+    missing = [place_name for place_name in place_names if place_name not in cache]
+    if missing:
+        query = text("""
+            SELECT place_name, place_id FROM places_data
+            WHERE place_name IN :place_names
+        """).bindparams(bindparam('place_names', expanding=True))
+        with get_engine(connection_url).connect() as connection:
+            rows = connection.execute(query, {'place_names': missing}).all()
+        with _place_ids_lock:
+            cache.update(rows)
+    return {place_name: cache[place_name]
+            for place_name in place_names if place_name in cache}
+
+
+def get_watermarks(connection_url, table_name, place_ids):
+    """
+    Reads the latest stored date_id of every place in a table.
+    :param connection_url: Database URL (SQLAlchemy format).
+    :param table_name: Name of the database table.
+    :param place_ids: Ids of the places to look up.
+    :return: Dictionary of place_id -> latest date_id, places without data are missing.
+    """
+    place_ids = list(place_ids)
+    if not place_ids:
+        return {}
+
+    query = text(f"""
+        SELECT place_id, MAX(date_id) AS date_id
+        FROM {table_name}
+        WHERE place_id IN :place_ids
+        GROUP BY place_id
+    """).bindparams(bindparam('place_ids', expanding=True))
+
+    with get_engine(connection_url).connect() as connection:
+        rows = connection.execute(query, {'place_ids': place_ids})
+        return {place_id: date_id for place_id, date_id in rows}
+
+
+def get_places(connection_url, place_ids):
+    """
+    Reads the coordinates of places.
+    :param connection_url: Database URL (SQLAlchemy format).
+    :param place_ids: Ids of the places to read.
+    :return: List of (place_id, latitude, longitude) tuples, ordered by place_name.
+    """
+    place_ids = [int(place_id) for place_id in place_ids]
+    if not place_ids:
+        return []
+
+    query = text("""
+        SELECT place_id, latitude, longitude
+        FROM places_data
+        WHERE place_id IN :place_ids
+        ORDER BY place_name
+    """).bindparams(bindparam('place_ids', expanding=True))
+
+    with get_engine(connection_url).connect() as connection:
+        return [tuple(row) for row in connection.execute(query, {'place_ids': place_ids})]
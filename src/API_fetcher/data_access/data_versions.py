@@ -0,0 +1,28 @@
+import threading
+import uuid
+
+# Identifies this process, counters start again from zero after a restart
+BOOT_ID = uuid.uuid4().hex
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def bump_data_versions(place_ids):
+    """
+    Marks the stored data of places as changed.
+    :param place_ids: Ids of the places that got new rows.
+    """
+    with _versions_lock:
+        for place_id in place_ids:
+            _versions[int(place_id)] = _versions.get(int(place_id), 0) + 1
+
+
+def get_data_versions():
+    """
+    Reports the data version of every place changed since the process started.
+    Readers caching query results compare these to decide what is stale.
+    :return: Dictionary with the boot_id of the process and place_id -> version.
+    """
+    with _versions_lock:
+        return {'boot_id': BOOT_ID, 'versions': dict(_versions)}
@@ -1,50 +1,186 @@
-from sqlalchemy import create_engine
+import csv
+import io
+from sqlalchemy import or_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 import pandas as pd
+from common.engine import get_engine
+from data_access.data_versions import bump_data_versions
+from data_access.partitions import ensure_partitions
+from data_access.rollups import refresh_rollups
+from common.schema import UPSERT_TABLES
 
+# Dialect specific INSERT constructs that support ON CONFLICT clauses
+DIALECT_INSERTS = {
+    'postgresql': postgresql_insert,
+    'sqlite': sqlite_insert,
+}
 
-def data_exists(engine, table_name, dataframe, unique_columns=['place_name', 'date_id']) -> pd.DataFrame:
+# Rows per INSERT statement, keeps the bind parameters below the PostgreSQL limit
+INSERT_CHUNKSIZE = 1000
+
+# Load method used per table when save_to_postgres is not told otherwise.
+# 'copy' streams the frame through COPY FROM STDIN, 'insert' uses multi-row INSERTs.
+TABLE_LOAD_METHODS = {
+    'daily_weather_data': 'insert',
+    'air_quality_data': 'copy',
+    'forecast_weather_data': 'copy',
+}
+
+
+
+def on_conflict_method(unique_columns, update=False):
     """
-    Check if data already exists in the database.
-    :param engine: SQLAlchemy engine object.
-    :param table_name: Name of the database table.
-    :param unique_columns: List of column names to check for duplicates.
-    :param dataframe: DataFrame with data to check.
-    :return: DataFrame with new data that doesn't exist in the database.
+    Creates a pandas `to_sql` insertion method that lets the database drop
+    (or update) rows that collide with the unique constraint on unique_columns.
+    :param unique_columns: Columns of the unique constraint backing the dedup.
+    :param update: Update the existing rows instead of keeping them.
+    :return: Callable usable as the `method` argument of `DataFrame.to_sql`.
     """
-    with engine.connect() as connection:
-        existing_data = pd.read_sql_table(
-            table_name, con=engine, columns=unique_columns)
-        if 'date_id' in unique_columns:
-            dataframe['date_id'] = pd.to_datetime(
-                dataframe['date_id']).dt.tz_convert('UTC')
-            existing_data['date_id'] = pd.to_datetime(
-                existing_data['date_id']).dt.tz_localize('UTC')
-        merged = pd.merge(dataframe, existing_data,
-                          on=unique_columns, how='left', indicator=True)
-        new_data = merged[merged['_merge'] ==
-                          'left_only'].drop('_merge', axis=1)
-        return new_data
+    def insert_on_conflict(pd_table, connection, keys, data_iter):
+        insert = DIALECT_INSERTS[connection.dialect.name]
+        rows = [dict(zip(keys, row)) for row in data_iter]
+        statement = insert(pd_table.table).values(rows)
+        update_columns = [key for key in keys if key not in unique_columns]
+        if update and update_columns:
+            # Rows whose values did not change are not rewritten nor counted
+            statement = statement.on_conflict_do_update(
+                index_elements=unique_columns,
+                set_={key: statement.excluded[key] for key in update_columns},
+                where=or_(*[pd_table.table.c[key].is_distinct_from(statement.excluded[key])
+                            for key in update_columns]))
+        else:
+            statement = statement.on_conflict_do_nothing(
+                index_elements=unique_columns)
+        return connection.execute(statement).rowcount
 
+    return insert_on_conflict
 
-def save_to_postgres(dataframe, connection_url, table_name, unique_columns=['place_name', 'date_id']):
+
+def copy_method(unique_columns, update=False):
+    """
+    Creates a pandas `to_sql` insertion method that streams the rows as CSV through
+    `COPY FROM STDIN` into a temporary staging table and moves them into the target
+    table with `INSERT ... ON CONFLICT`. Non PostgreSQL connections fall back to
+    the method of on_conflict_method.
+    :param unique_columns: Columns of the unique constraint backing the dedup.
+    :param update: Update the existing rows instead of keeping them.
+    :return: Callable usable as the `method` argument of `DataFrame.to_sql`.
     """
-    Save a Pandas DataFrame to a PostgreSQL table with a check for duplicates.
+    fallback = on_conflict_method(unique_columns, update)
+
+    def copy_on_conflict(pd_table, connection, keys, data_iter):
+        if connection.dialect.name != 'postgresql':
+            return fallback(pd_table, connection, keys, data_iter)
+
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(data_iter)
+        buffer.seek(0)
+
+        table = f'"{pd_table.name}"'
+        staging = f'"staging_{pd_table.name}"'
+        columns = ', '.join(f'"{key}"' for key in keys)
+        conflict_columns = ', '.join(f'"{key}"' for key in unique_columns)
+        update_columns = [key for key in keys if key not in unique_columns]
+        if update and update_columns:
+            conflict_action = 'DO UPDATE SET ' + ', '.join(
+                f'"{key}" = EXCLUDED."{key}"' for key in update_columns) + \
+                ' WHERE ' + ' OR '.join(
+                    f'{table}."{key}" IS DISTINCT FROM EXCLUDED."{key}"'
+                    for key in update_columns)
+        else:
+            conflict_action = 'DO NOTHING'
+
+        with connection.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMP TABLE IF NOT EXISTS {staging} '
+                f'(LIKE {table} INCLUDING DEFAULTS)')
+            cursor.execute(f'TRUNCATE {staging}')
+            cursor.copy_expert(
+                f'COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+            # DISTINCT ON keeps one row per key, a batch may not update a row twice.
+            # Ordered by date_id first, the rows reach one monthly partition after
+            # the other and each partition's unique index is probed in one run.
+            order_columns = ', '.join(f'"{key}"' for key in sorted(
+                unique_columns, key=lambda key: key != 'date_id'))
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) '
+                f'SELECT DISTINCT ON ({order_columns}) {columns} FROM {staging} '
+                f'ORDER BY {order_columns} '
+                f'ON CONFLICT ({conflict_columns}) {conflict_action}')
+            return cursor.rowcount
+
+    return copy_on_conflict
+
+
+LOAD_METHODS = {
+    'insert': on_conflict_method,
+    'copy': copy_method,
+}
+
+
+def save_to_postgres(dataframe, connection_url, table_name,
+                     unique_columns=['place_id', 'date_id'], update=None,
+                     load_method=None, chunksize=None):
+    """
+    Save a Pandas DataFrame to a PostgreSQL table, duplicates are resolved by the
+    database through the unique constraint on unique_columns.
     :param dataframe: DataFrame to save.
     :param connection_url: Database URL (SQLAlchemy format).
     :param table_name: Name of the PostgreSQL table.
-    :param unique_columns: List of column names to check for duplicates.
+    :param unique_columns: Columns of the table's unique constraint.
+    :param update: Overwrite already stored rows instead of skipping them,
+                   defaults to whether the table is one of UPSERT_TABLES.
+    :param load_method: 'insert' or 'copy', defaults to the table's entry in TABLE_LOAD_METHODS.
+    :param chunksize: Rows written per statement, COPY sends the whole frame at once by default.
+    :return: Number of rows inserted or changed.
     """
-    engine = create_engine(connection_url)
+    engine = get_engine(connection_url)
+
+    if dataframe.empty:
+        print(
+            f"No new data to save. Table '{table_name}' is up-to-date.")
+        return 0
+
+    if 'date_id' in dataframe.columns:
+        # The tables store naive UTC timestamps
+        dataframe = dataframe.assign(date_id=pd.to_datetime(
+            dataframe['date_id'], utc=True).dt.tz_localize(None))
+        ensure_partitions(engine, table_name, dataframe['date_id'])
+
+    if update is None:
+        update = table_name in UPSERT_TABLES
+    load_method = load_method or TABLE_LOAD_METHODS.get(table_name, 'insert')
+    if chunksize is None and load_method == 'insert':
+        chunksize = INSERT_CHUNKSIZE
 
-    # If table exists, check for duplicates based on unique columns
-    new_data = data_exists(
-        engine, table_name, dataframe, unique_columns)
+    saved_rows = dataframe.to_sql(table_name, con=engine, if_exists='append',
+                                  index=False, chunksize=chunksize,
+                                  method=LOAD_METHODS[load_method](unique_columns, update))
 
-    # Save only the new, non-duplicate data to the database
-    if not new_data.empty:
-        new_data.to_sql(table_name, con=engine,
-                        if_exists='append', index=False)
-        print(f"New data successfully saved to table '{table_name}'.")
+    if saved_rows:
+        if 'place_id' in dataframe.columns:
+            refresh_rollups(engine, table_name, dataframe)
+            bump_data_versions(dataframe['place_id'].unique())
+        print(
+            f"{saved_rows} new rows successfully saved to table '{table_name}'.")
     else:
         print(
             f"No new data to save. Table '{table_name}' is up-to-date.")
+    return saved_rows
+
+
+def register_place(connection_url, place_name, latitude, longitude):
+    """
+    Adds a place to places_data unless a place with the same name exists.
+    :param connection_url: Database URL (SQLAlchemy format).
+    :param place_name: Name of the place.
+    :param latitude: Latitude of the place.
+    :param longitude: Longitude of the place.
+    """
+    engine = get_engine(connection_url)
+    place = pd.DataFrame({'place_name': [place_name],
+                          'latitude': [latitude],
+                          'longitude': [longitude]})
+    place.to_sql('places_data', con=engine, if_exists='append', index=False,
+                 method=on_conflict_method(['place_name']))
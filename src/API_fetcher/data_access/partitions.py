@@ -0,0 +1,47 @@
+import threading
+import pandas as pd
+from common.partitions import create_partitions
+from common.schema import PARTITIONED_TABLES
+
+# (database, table, month) of the partitions known to exist
+_known_partitions = set()
+# (database, table) of the tables known not to be partitioned
+_unpartitioned_tables = set()
+_partitions_lock = threading.Lock()
+
+
+def ensure_partitions(engine, table_name, date_ids):
+    """
+    Makes sure the monthly partitions of the given dates exist before a write.
+    Known partitions are remembered, so only the first write of a month asks
+    the database. Tables that are not partitioned and non PostgreSQL databases
+    are skipped.
+    :param engine: SQLAlchemy engine object.
+    :param table_name: Name of the table written to.
+    :param date_ids: Series of the date_id values to write.
+    :return: Number of partitions created.
+    """
+    if table_name not in PARTITIONED_TABLES or engine.dialect.name != 'postgresql' \
+            or len(date_ids) == 0:
+        return 0
+
+    database = str(engine.url)
+    months = pd.to_datetime(date_ids).dt.to_period('M').unique()
+    with _partitions_lock:
+        if (database, table_name) in _unpartitioned_tables:
+            return 0
+        missing = [month for month in months
+                   if (database, table_name, month) not in _known_partitions]
+    if not missing:
+        return 0
+
+    with engine.begin() as connection:
+        created = create_partitions(connection, table_name, missing)
+    partitioned = created is not None
+
+    with _partitions_lock:
+        if partitioned:
+            _known_partitions.update((database, table_name, month) for month in missing)
+        else:
+            _unpartitioned_tables.add((database, table_name))
+    return created or 0
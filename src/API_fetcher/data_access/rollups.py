@@ -0,0 +1,52 @@
+import pandas as pd
+from sqlalchemy import bindparam, text
+from common.schema import ROLLUPS
+
+
+def refresh_rollups(engine, table_name, dataframe):
+    """
+    Recomputes the rollup buckets touched by freshly saved rows, only for the
+    places and the time span of the saved frame. Rollups are maintained on
+    PostgreSQL, other databases are skipped.
+    :param engine: SQLAlchemy engine object.
+    :param table_name: Name of the source table the frame was saved to.
+    :param dataframe: The saved DataFrame, with place_id and date_id columns.
+    :return: Number of rollup rows written.
+    """
+    if table_name not in ROLLUPS or engine.dialect.name != 'postgresql' \
+            or dataframe.empty:
+        return 0
+
+    rollup_name, measures, granularities = ROLLUPS[table_name]
+    aggregates = ', '.join(f'AVG({measure}), MIN({measure}), MAX({measure})'
+                           for measure in measures)
+    columns = [f'{measure}_{aggregate}' for measure in measures
+               for aggregate in ('mean', 'min', 'max')]
+    updates = ', '.join(f'{column} = EXCLUDED.{column}'
+                        for column in ['sample_count', *columns])
+    params = {
+        'place_ids': [int(place_id) for place_id in dataframe['place_id'].unique()],
+        'first_date': pd.Timestamp(dataframe['date_id'].min()).to_pydatetime(),
+        'last_date': pd.Timestamp(dataframe['date_id'].max()).to_pydatetime(),
+    }
+
+    written = 0
+    with engine.begin() as connection:
+        for granularity in granularities:
+            # Whole buckets are recomputed from the source, from the start of the
+            # first touched bucket to the end of the last one
+            query = text(f"""
+                INSERT INTO {rollup_name}
+                    (place_id, granularity, bucket_start, sample_count, {', '.join(columns)})
+                SELECT place_id, '{granularity}', date_trunc('{granularity}', date_id),
+                       COUNT(*), {aggregates}
+                FROM {table_name}
+                WHERE place_id IN :place_ids
+                  AND date_id >= date_trunc('{granularity}', CAST(:first_date AS timestamp))
+                  AND date_id < date_trunc('{granularity}', CAST(:last_date AS timestamp))
+                                + INTERVAL '1 {granularity}'
+                GROUP BY place_id, date_trunc('{granularity}', date_id)
+                ON CONFLICT (place_id, granularity, bucket_start) DO UPDATE SET {updates}
+            """).bindparams(bindparam('place_ids', expanding=True))
+            written += connection.execute(query, params).rowcount
+    return written
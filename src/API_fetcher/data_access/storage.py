@@ -0,0 +1,91 @@
+import threading
+import pandas as pd
+from sqlalchemy import bindparam, text
+from common.storage import PARQUET_ROOT, STORAGE_BACKEND, ParquetStorage, StorageBackend
+from data_access.data_read import get_places, get_watermarks
+from data_access.data_versions import bump_data_versions
+from data_access.data_write import save_to_postgres
+from common.engine import get_engine
+
+
+class PostgresStorage(StorageBackend):
+    """
+    Stores the tables in the PostgreSQL database.
+    """
+
+    def __init__(self, connection_url):
+        """
+        :param connection_url: Database URL (SQLAlchemy format).
+        """
+        self.connection_url = connection_url
+
+    def save(self, dataframe, table_name, update=None):
+        return save_to_postgres(dataframe, self.connection_url, table_name,
+                                update=update)
+
+    def read(self, table_name, place_ids=None, columns=None,
+             start_date=None, end_date=None):
+        selected = ['place_id', 'date_id', *(columns or [])]
+        conditions = ['TRUE']
+        params = {}
+        if place_ids is not None:
+            conditions.append('place_id IN :place_ids')
+            params['place_ids'] = [int(place_id) for place_id in place_ids]
+        if start_date is not None:
+            conditions.append('date_id >= :start_date')
+            params['start_date'] = pd.Timestamp(start_date).to_pydatetime()
+        if end_date is not None:
+            conditions.append('date_id < :end_date')
+            params['end_date'] = pd.Timestamp(end_date).to_pydatetime()
+        query = text(f"""
+            SELECT {'*' if columns is None else ', '.join(selected)}
+            FROM {table_name}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY place_id, date_id
+        """)
+        if place_ids is not None:
+            query = query.bindparams(bindparam('place_ids', expanding=True))
+        return pd.read_sql(query, get_engine(self.connection_url), params=params)
+
+    def watermarks(self, table_name, place_ids):
+        return get_watermarks(self.connection_url, table_name, place_ids)
+
+    def place_ids(self, table_name):
+        with get_engine(self.connection_url).connect() as connection:
+            return set(connection.execute(
+                text(f"SELECT DISTINCT place_id FROM {table_name}")).scalars())
+
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def get_storage(connection_url, backend=None):
+    """
+    Returns the shared storage backend of the process.
+    :param connection_url: Database URL (SQLAlchemy format), used by the PostgreSQL backend.
+    :param backend: 'postgres' or 'parquet', defaults to the STORAGE_BACKEND setting.
+    :return: StorageBackend object.
+    """
+    backend = backend or STORAGE_BACKEND
+    key = (backend, connection_url if backend == 'postgres' else PARQUET_ROOT)
+    with _storages_lock:
+        if key not in _storages:
+            if backend == 'postgres':
+                _storages[key] = PostgresStorage(connection_url)
+            elif backend == 'parquet':
+                _storages[key] = ParquetStorage(PARQUET_ROOT,
+                                                on_saved=bump_data_versions)
+            else:
+                raise ValueError(f"Unknown storage backend: {backend}")
+        return _storages[key]
+
+
+def get_tracked_places(connection_url):
+    """
+    Reads the places which already have data in the storage backend, with their coordinates.
+    :param connection_url: Database URL (SQLAlchemy format).
+    :return: List of (place_id, latitude, longitude) tuples.
+    """
+    return get_places(connection_url,
+                      get_storage(connection_url).place_ids('daily_weather_data'))
@@ -0,0 +1,231 @@
+import sqlite3
+import threading
+import time
+
+# Expiry of cached Open-Meteo responses per endpoint, in seconds. The archive
+# is immutable once published, forecasts and air quality are recomputed by the
+# models every hour so a stale answer is only reused for a few minutes.
+NEVER_EXPIRE = -1
+CACHE_EXPIRY_RULES = {
+    "archive-api.open-meteo.com": NEVER_EXPIRE,
+    "api.open-meteo.com/v1/forecast": 15 * 60,
+    "air-quality-api.open-meteo.com": 30 * 60,
+}
+# Upper bound of the cached responses, the least recently used ones are evicted
+MAX_CACHE_ENTRIES = 5000
+# Access times of the cached responses are written in batches, when this many
+# are pending or this many seconds passed since the last write
+ACCESS_FLUSH_SIZE = 200
+ACCESS_FLUSH_SECONDS = 30
+
+ACCESS_TABLE = "cache_access"
+
+
+class ResponseCacheStats:
+    """
+    Thread safe hit and miss counters of the HTTP response cache, shared by
+    every fetcher of the process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def record(self, from_cache: bool):
+        """
+        :param from_cache: Whether the response was served from the cache.
+        """
+        with self.lock:
+            if from_cache:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def record_evictions(self, count: int):
+        """
+        :param count: Number of responses evicted from the cache.
+        """
+        with self.lock:
+            self.evictions += count
+
+    def snapshot(self):
+        """
+        :return: The counters and the hit ratio as a dict.
+        """
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / requests if requests else None,
+            }
+
+
+cache_stats = ResponseCacheStats()
+
+
+def _connect(db_path: str):
+    """
+    Open the cache database and make sure the access table exists.
+    :param db_path: Path of the SQLite file of the requests_cache backend.
+    :return: sqlite3 connection.
+    """
+    connection = sqlite3.connect(db_path, timeout=30)
+    connection.execute(
+        f"CREATE TABLE IF NOT EXISTS {ACCESS_TABLE} "
+        "(key TEXT PRIMARY KEY, last_used REAL)")
+    return connection
+
+
+def evict(cache, max_entries: int):
+    """
+    Drop expired responses, then the least recently used ones until at most
+    max_entries responses remain. Responses never used since the access table
+    was introduced count as the oldest.
+    :param cache: SQLite backend of the requests_cache session.
+    :param max_entries: Maximum number of responses to keep.
+    :return: Number of evicted responses.
+    """
+    before = cache.responses.count(expired=True)
+    if before <= max_entries:
+        return 0
+    cache.delete(expired=True)
+    excess = cache.responses.count(expired=True) - max_entries
+    if excess > 0:
+        connection = _connect(cache.db_path)
+        with connection:
+            keys = [row[0] for row in connection.execute(
+                f"SELECT r.key FROM {cache.responses.table_name} r "
+                f"LEFT JOIN {ACCESS_TABLE} a ON a.key = r.key "
+                "ORDER BY COALESCE(a.last_used, 0) LIMIT ?", (excess,))]
+            connection.executemany(
+                f"DELETE FROM {ACCESS_TABLE} WHERE key = ?", [(key,) for key in keys])
+        connection.close()
+        cache.delete(*keys)
+    evicted = before - cache.responses.count(expired=True)
+    cache_stats.record_evictions(evicted)
+    print(f"Evicted {evicted} responses from the HTTP cache")
+    return evicted
+
+
+class CacheTracker:
+    """
+    Tracks the use of the responses of one cache database for its LRU eviction.
+    Access times are kept in memory and written in batches. The number of
+    cached responses is counted once and then kept up to date from the misses,
+    the cache is only evicted when a write finds it above its limit.
+    """
+
+    def __init__(self, cache, max_entries: int = MAX_CACHE_ENTRIES,
+                 flush_size: int = ACCESS_FLUSH_SIZE,
+                 flush_seconds: float = ACCESS_FLUSH_SECONDS):
+        """
+        :param cache: SQLite backend of the requests_cache session.
+        :param max_entries: Maximum number of responses to keep.
+        :param flush_size: Number of pending access times that triggers a write.
+        :param flush_seconds: Seconds after which pending access times are written.
+        """
+        self.cache = cache
+        self.max_entries = max_entries
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = {}
+        self.entries = None
+        self.flushed_at = time.monotonic()
+        _connect(cache.db_path).close()
+
+    def _count(self):
+        """
+        :return: The number of cached responses, counted on first use.
+        """
+        if self.entries is None:
+            self.entries = self.cache.responses.count(expired=True)
+        return self.entries
+
+    def record(self, cache_key: str, from_cache: bool):
+        """
+        Record the use of a cached response, the recency LRU eviction orders by.
+        :param cache_key: Key of the response in the cache.
+        :param from_cache: Whether the response was served from the cache,
+                           otherwise it was just added to it.
+        """
+        with self.lock:
+            self.pending[cache_key] = time.time()
+            if self.entries is None:
+                # Counted after the session stored the response
+                self._count()
+            elif not from_cache:
+                self.entries += 1
+            due = len(self.pending) >= self.flush_size or \
+                time.monotonic() - self.flushed_at >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the pending access times, then evict if the cache is above its limit.
+        :return: Number of evicted responses.
+        """
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+                self.flushed_at = time.monotonic()
+                over_limit = self._count() > self.max_entries
+            if pending:
+                connection = sqlite3.connect(self.cache.db_path, timeout=30)
+                with connection:
+                    connection.executemany(
+                        f"INSERT OR REPLACE INTO {ACCESS_TABLE} (key, last_used) VALUES (?, ?)",
+                        pending.items())
+                connection.close()
+            if not over_limit:
+                return 0
+            evicted = evict(self.cache, self.max_entries)
+            # Refetched keys were counted twice, the count starts over from the database
+            with self.lock:
+                self.entries = None
+            return evicted
+
+    def size(self):
+        """
+        :return: Number of cached responses and the size of the cache file in bytes.
+        """
+        with self.lock:
+            entries = self._count()
+        return {"entries": entries, "bytes": self.cache.responses.size()}
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def get_cache_tracker(cache, max_entries: int = MAX_CACHE_ENTRIES):
+    """
+    Returns the tracker of a cache database, shared by every fetcher of the process.
+    :param cache: SQLite backend of the requests_cache session.
+    :param max_entries: Maximum number of responses to keep.
+    :return: CacheTracker object.
+    """
+    with _trackers_lock:
+        if cache.db_path not in _trackers:
+            _trackers[cache.db_path] = CacheTracker(cache, max_entries)
+        return _trackers[cache.db_path]
+
+
+def cache_report():
+    """
+    :return: Process-wide hit and miss counters and the size of the caches in use.
+    """
+    with _trackers_lock:
+        trackers = list(_trackers.values())
+    sizes = [tracker.size() for tracker in trackers]
+    return {
+        **cache_stats.snapshot(),
+        "entries": sum(size["entries"] for size in sizes),
+        "bytes": sum(size["bytes"] for size in sizes),
+    }
@@ -0,0 +1,125 @@
+import datetime
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from api_fetcher import WeatherDataFetcher, WeatherDataProcessor
+from utility import fetch_and_process_multiple, build_fetch_process_pairs
+
+
+class IngestJobManager:
+    """
+    Runs fetch-process-save jobs for places on a bounded worker pool.
+    A job submitted for a place that already has a job in flight is coalesced
+    into the running one.
+    """
+
+    def __init__(self, connection_url: str, max_workers: int = 2,
+                 max_finished_jobs: int = 500):
+        """
+        :param connection_url: Database URL (SQLAlchemy format).
+        :param max_workers: Number of jobs running at the same time.
+        :param max_finished_jobs: Number of finished jobs kept for status polling.
+        """
+        self.connection_url = connection_url
+        self.max_finished_jobs = max_finished_jobs
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="ingest-job")
+        self.jobs = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def submit(self, latitude: float, longitude: float, place_name: str,
+               timezone: str = "Europe/Berlin"):
+        """
+        Queue a refresh of a place, or join the job already in flight for it.
+        :param latitude: Latitude of the location.
+        :param longitude: Longitude of the location.
+        :param place_name: Name of the location.
+        :param timezone: Timezone for the weather data.
+        :return: Tuple of the job status and whether a new job was created.
+        """
+        with self.lock:
+            job_id = self.in_flight.get(place_name)
+            if job_id is not None:
+                return dict(self.jobs[job_id]), False
+
+            job_id = uuid.uuid4().hex
+            steps = build_fetch_process_pairs()
+            self.jobs[job_id] = {
+                "job_id": job_id,
+                "place_name": place_name,
+                "status": "queued",
+                "steps_total": len(steps),
+                "steps_done": 0,
+                "rows_saved": 0,
+                "failed_steps": [],
+                "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "finished_at": None,
+            }
+            self.in_flight[place_name] = job_id
+            self._evict_finished_jobs()
+            job = dict(self.jobs[job_id])
+
+        self.executor.submit(self._run, job_id, steps,
+                             latitude, longitude, place_name, timezone)
+        return job, True
+
+    def get(self, job_id: str):
+        """
+        :param job_id: Id returned by submit.
+        :return: Copy of the job status, None for unknown jobs.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def _update(self, job_id: str, **changes):
+        with self.lock:
+            self.jobs[job_id].update(changes)
+
+    def _evict_finished_jobs(self):
+        # Jobs are kept in submission order, the oldest finished ones go first
+        finished = [job_id for job_id, job in self.jobs.items()
+                    if job["finished_at"] is not None]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
+
+    def _run(self, job_id: str, steps, latitude: float, longitude: float,
+             place_name: str, timezone: str):
+        self._update(job_id, status="running")
+        fetcher = WeatherDataFetcher()
+        rows_saved = 0
+        failed_steps = []
+        try:
+            for steps_done, (fetch_method, process_method, table_name,
+                             start_date, end_date, incremental) in enumerate(steps, 1):
+                rows = fetch_and_process_multiple(
+                    fetcher=fetcher,
+                    processor_class=WeatherDataProcessor,
+                    fetch_method=fetch_method,
+                    process_method=process_method,
+                    latitude=latitude,
+                    longitude=longitude,
+                    start_date=start_date,
+                    end_date=end_date,
+                    timezone=timezone,
+                    place_name=place_name,
+                    connection_url=self.connection_url,
+                    table_name=table_name,
+                    incremental=incremental)
+                if rows is None:
+                    failed_steps.append(table_name)
+                else:
+                    rows_saved += rows
+                self._update(job_id, steps_done=steps_done, rows_saved=rows_saved,
+                             failed_steps=list(failed_steps))
+            status = "failed" if failed_steps else "done"
+        except Exception as e:
+            print(f"Ingest job {job_id} failed: {e}")
+            status = "failed"
+        finally:
+            with self.lock:
+                self.in_flight.pop(place_name, None)
+        self._update(job_id, status=status,
+                     finished_at=datetime.datetime.now(datetime.timezone.utc).isoformat())
@@ -0,0 +1,205 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = [*zip(label_names, label_values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    """
+    Monotonically increasing value per label combination.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names=()):
+        """
+        :param name: Metric name, counters end in _total.
+        :param documentation: Help text of the metric.
+        :param label_names: Names of the labels every sample is keyed by.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def inc(self, amount: float = 1, **labels):
+        """
+        :param amount: Non-negative amount to add.
+        :param labels: Value of every label of the metric.
+        """
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        """
+        :return: Lines of the samples in the text exposition format.
+        """
+        with self.lock:
+            return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                    for key, value in sorted(self.values.items())]
+
+
+class Histogram:
+    """
+    Distribution of observed values per label combination, in cumulative buckets.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names=(),
+                 buckets=DEFAULT_BUCKETS):
+        """
+        :param name: Metric name.
+        :param documentation: Help text of the metric.
+        :param label_names: Names of the labels every sample is keyed by.
+        :param buckets: Sorted upper bounds of the buckets, +Inf is added.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = (*buckets, float("inf"))
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        """
+        :param value: Observed value, e.g. a duration in seconds.
+        :param labels: Value of every label of the metric.
+        """
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of the with block in seconds, also when it raises.
+        :param labels: Value of every label of the metric.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        """
+        :return: Lines of the samples in the text exposition format.
+        """
+        lines = []
+        with self.lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    labels = _format_labels(self.label_names, key,
+                                            [("le", _format_value(bound))])
+                    lines.append(f"{self.name}_bucket{labels} {_format_value(count)}")
+                labels = _format_labels(self.label_names, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {_format_value(counts[-1])}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    The metrics of the process, rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        """
+        :param metric: Counter or Histogram to expose.
+        :return: The metric.
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        :return: Every registered metric in the text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Duration of the steps of a fetch-process-save call: the place_id resolution,
+# the watermark lookup deciding which days are already stored, the upstream
+# fetch, the flatbuffer processing and the database write resolving conflicting rows
+stage_duration = registry.register(Histogram(
+    "ingest_stage_duration_seconds",
+    "Duration of the ingest stages (resolve, watermark, fetch, process, write) per table.",
+    ["stage", "table"]))
+rows_fetched = registry.register(Counter(
+    "ingest_rows_fetched_total",
+    "Rows processed from Open-Meteo responses per table.", ["table"]))
+rows_inserted = registry.register(Counter(
+    "ingest_rows_inserted_total",
+    "Rows inserted into the database per table, duplicates excluded.", ["table"]))
+ingest_failures = registry.register(Counter(
+    "ingest_failures_total",
+    "Failed fetch-process-save calls per table and the stage they failed in.",
+    ["table", "stage"]))
+upstream_duration = registry.register(Histogram(
+    "open_meteo_request_duration_seconds",
+    "Duration of the Open-Meteo calls per endpoint, cache hits included.",
+    ["endpoint"]))
+upstream_responses = registry.register(Counter(
+    "open_meteo_responses_total",
+    "Open-Meteo responses per endpoint, served from the HTTP cache or not.",
+    ["endpoint", "cache"]))
+upstream_retries = registry.register(Counter(
+    "open_meteo_retries_total",
+    "Retried Open-Meteo requests per endpoint.", ["endpoint"]))
+locations_shared = registry.register(Counter(
+    "open_meteo_locations_shared_total",
+    "Locations served by the response of another location in the same grid cell.",
+    ["endpoint"]))
+
+
+@contextmanager
+def ingest_stage(stage: str, table: str, state: dict = None):
+    """
+    Time an ingest stage and remember it as the current stage of the call, so
+    a failure can be attributed to it.
+    :param stage: Name of the stage: resolve, watermark, fetch, process or write.
+    :param table: Name of the table the call saves to.
+    :param state: Optional dictionary whose 'stage' key is set to stage.
+    """
+    if state is not None:
+        state["stage"] = stage
+    with stage_duration.time(stage=stage, table=table):
+        yield
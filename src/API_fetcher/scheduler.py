@@ -0,0 +1,156 @@
+import datetime
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from api_fetcher import TokenBucket, WeatherDataFetcher, WeatherDataProcessor, \
+    upstream_rate_limiter
+from data_access.storage import get_tracked_places
+from utility import fetch_and_process_many, build_fetch_process_pairs
+
+
+class RefreshSchedule:
+    """
+    A set of tables refreshed for every tracked place on a fixed cadence.
+    """
+
+    def __init__(self, name: str, interval_seconds: float, table_names):
+        """
+        :param name: Name of the schedule, used in the run statistics.
+        :param interval_seconds: Seconds between the start of two runs.
+        :param table_names: Tables refreshed by the schedule.
+        """
+        self.name = name
+        self.interval_seconds = interval_seconds
+        self.table_names = list(table_names)
+        self.next_run = time.monotonic()
+
+
+class RefreshScheduler:
+    """
+    Refreshes every tracked place in the background. The places are split into
+    chunks fetched on a thread pool, the Open-Meteo calls of all workers share
+    the token bucket of the process.
+    """
+
+    def __init__(self, connection_url: str, schedules, max_workers: int = 4,
+                 chunk_size: int = 100, rate_limiter: TokenBucket = None,
+                 timezone: str = "Europe/Berlin", history_size: int = 100):
+        """
+        :param connection_url: Database URL (SQLAlchemy format).
+        :param schedules: List of RefreshSchedule objects.
+        :param max_workers: Number of chunks fetched at the same time.
+        :param chunk_size: Number of places fetched and saved together.
+        :param rate_limiter: Token bucket of the Open-Meteo location calls
+                             (default: the process wide upstream_rate_limiter).
+        :param timezone: Timezone for the weather data.
+        :param history_size: Number of run statistics kept.
+        """
+        self.connection_url = connection_url
+        self.schedules = schedules
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.timezone = timezone
+        self.rate_limiter = upstream_rate_limiter if rate_limiter is None else rate_limiter
+        self.runs = deque(maxlen=history_size)
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self, delay: float = 0):
+        """
+        Start the scheduler loop in a daemon thread.
+        :param delay: Seconds before the first run of every schedule.
+        """
+        if self.thread is None or not self.thread.is_alive():
+            first_run = time.monotonic() + delay
+            for schedule in self.schedules:
+                schedule.next_run = max(schedule.next_run, first_run)
+            self.stop_event.clear()
+            self.thread = threading.Thread(
+                target=self._loop, name="refresh-scheduler", daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout: float = None):
+        """
+        Stop the scheduler loop after the running refresh.
+        :param timeout: Seconds to wait for the loop to finish.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def _loop(self):
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            for schedule in self.schedules:
+                if schedule.next_run <= now:
+                    schedule.next_run = now + schedule.interval_seconds
+                    try:
+                        self.run(schedule)
+                    except Exception as e:
+                        print(f"Scheduled refresh '{schedule.name}' failed: {e}")
+            next_run = min(schedule.next_run for schedule in self.schedules)
+            self.stop_event.wait(max(0, next_run - time.monotonic()))
+
+    def _refresh_chunk(self, steps, places):
+        fetcher = WeatherDataFetcher(rate_limiter=self.rate_limiter)
+        rows = 0
+        failures = 0
+        for fetch_method, process_method, table_name, \
+                start_date, end_date, incremental in steps:
+            saved = fetch_and_process_many(
+                fetcher=fetcher,
+                processor_class=WeatherDataProcessor,
+                fetch_method=fetch_method,
+                process_method=process_method,
+                locations=places,
+                start_date=start_date,
+                end_date=end_date,
+                timezone=self.timezone,
+                connection_url=self.connection_url,
+                table_name=table_name,
+                incremental=incremental)
+            if saved is None:
+                failures += 1
+            else:
+                rows += saved
+        return rows, failures, fetcher.api_calls
+
+    def run(self, schedule: RefreshSchedule):
+        """
+        Refresh the tables of a schedule for every tracked place.
+        :param schedule: The schedule to run.
+        :return: Statistics of the run.
+        """
+        started_at = datetime.datetime.now(datetime.timezone.utc)
+        started = time.monotonic()
+
+        places = get_tracked_places(self.connection_url)
+        steps = [step for step in build_fetch_process_pairs()
+                 if step[2] in schedule.table_names]
+        chunks = [places[i:i + self.chunk_size]
+                  for i in range(0, len(places), self.chunk_size)]
+
+        rows = failures = api_calls = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers,
+                                thread_name_prefix=f"refresh-{schedule.name}") as executor:
+            for chunk_rows, chunk_failures, chunk_calls in executor.map(
+                    lambda chunk: self._refresh_chunk(steps, chunk), chunks):
+                rows += chunk_rows
+                failures += chunk_failures
+                api_calls += chunk_calls
+
+        duration = time.monotonic() - started
+        stats = {
+            "schedule": schedule.name,
+            "started_at": started_at.isoformat(),
+            "duration_seconds": round(duration, 3),
+            "places": len(places),
+            "api_calls": api_calls,
+            "rows_processed": rows,
+            "failed_steps": failures,
+            "places_per_second": round(len(places) / duration, 3) if duration else None,
+        }
+        self.runs.append(stats)
+        print(f"Scheduled refresh '{schedule.name}' finished: {stats}")
+        return stats
@@ -0,0 +1,58 @@
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the
+    function, callers arriving while it is in flight wait for and share its
+    result (or exception) instead of running it again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Run function once for all concurrent callers passing the same key.
+        :param key: Hashable identity of the call.
+        :param function: Function to call.
+        :param args: Positional arguments of function.
+        :param kwargs: Keyword arguments of function.
+        :return: The result of the shared call.
+        """
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.in_flight[key] = future
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+    def stats(self):
+        """
+        :return: Number of executed calls, coalesced calls and calls in flight.
+        """
+        with self.lock:
+            return {"calls": self.calls, "coalesced": self.coalesced,
+                    "in_flight": len(self.in_flight)}
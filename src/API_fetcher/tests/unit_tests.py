@@ -1,7 +1,71 @@
 import unittest
 from unittest.mock import MagicMock, patch
+import functools
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import time
 import pandas as pd
-from api_fetcher import WeatherDataFetcher, WeatherDataProcessor
+from sqlalchemy import create_engine, Column, Float, DateTime, Index, Integer, \
+    MetaData, String, Table, UniqueConstraint, make_url, text
+from requests.adapters import HTTPAdapter
+from requests_cache import CachedResponse
+from urllib3 import HTTPResponse
+from urllib3.util.retry import RequestHistory, Retry
+from api_fetcher import GridCellIndex, TokenBucket, WeatherDataFetcher, \
+    WeatherDataProcessor, grid_cells, upstream_rate_limiter
+from http_cache import CacheTracker, cache_stats
+from data_access.data_write import save_to_postgres
+from common.engine import get_engine, pool_stats, dispose_engines
+from data_access.data_read import get_watermarks
+from data_access.data_versions import get_data_versions
+from data_access.storage import ParquetStorage, StorageBackend, get_tracked_places
+from data_access.partitions import ensure_partitions
+from common.partitions import create_partitions, drop_partitions_before, \
+    existing_partitions, migrate_to_partitions, partition_name
+from utility import incremental_start_date, resolve_place_id, \
+    fetch_and_process_multiple, ingest_flights
+from jobs import IngestJobManager
+from scheduler import RefreshSchedule, RefreshScheduler
+from benchmarks.benchmark import compare, create_schema, run_benchmarks
+from common.profiling import ProfileSession, ProfileStore, should_profile
+from metrics import Counter, Histogram, MetricsRegistry, ingest_failures, \
+    upstream_responses, upstream_retries
+
+
+# PostgreSQL database of the integration tests, they are skipped without it
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+
+def mock_grid_response(latitude, longitude):
+    """
+    Response reporting the coordinates of the grid cell it belongs to.
+    """
+    response = MagicMock()
+    response.Latitude.return_value = latitude
+    response.Longitude.return_value = longitude
+    return response
+
+
+class StaticAdapter(HTTPAdapter):
+    """
+    Transport adapter answering every request with an empty JSON body,
+    after the given number of retries.
+    """
+
+    def __init__(self, retries=0):
+        super().__init__()
+        self.retries = retries
+
+    def send(self, request, **kwargs):
+        history = tuple(RequestHistory(request.method, request.url, None, 503, None)
+                        for _ in range(self.retries))
+        return self.build_response(request, HTTPResponse(
+            body=io.BytesIO(b"{}"), status=200, preload_content=False,
+            headers={"Content-Type": "application/json"},
+            retries=Retry(total=5, history=history)))
 
 
 class TestWeatherDataFetcher(unittest.TestCase):
@@ -36,13 +100,163 @@ class TestWeatherDataFetcher(unittest.TestCase):
                 "longitude": 13.405,
                 "start_date": "2024-06-01",
                 "end_date": "2024-06-10",
-                "daily": ["temperature_2m_mean", "rain_sum",
-                          "wind_speed_10m_max", "shortwave_radiation_sum"],
+                "daily": "temperature_2m_mean,rain_sum,wind_speed_10m_max",
                 "timezone": "Europe/Berlin",
             }
         )
         self.assertEqual(result, mock_client.weather_api.return_value[0])
 
+    @patch('openmeteo_requests.Client')
+    def test_fetch_many_batches_locations(self, MockClient):
+        """
+        Test that fetch_many packs locations into batched requests
+        and pairs every response with its place name.
+        """
+        # Arrange
+        mock_client = MockClient.return_value
+        mock_client.weather_api.side_effect = \
+            lambda url, params: [mock_grid_response(float(latitude), 19.0) for latitude
+                                 in params["latitude"].split(",")]
+
+        fetcher = WeatherDataFetcher()
+        fetcher.client = mock_client
+        locations = [("A", 47.1, 19.1), ("B", 47.2, 19.2), ("C", 47.3, 19.3)]
+
+        # Act
+        result = fetcher.fetch_many(
+            "fetch_daily_weather_data", locations,
+            start_date="2024-06-01", end_date="2024-06-10",
+            max_coordinate_chars=30, dedup_cells=False)
+
+        # Assert
+        self.assertEqual(mock_client.weather_api.call_count, 2)
+        first_params = mock_client.weather_api.call_args_list[0].kwargs["params"]
+        self.assertEqual(first_params["latitude"], "47.1,47.2")
+        self.assertEqual(first_params["longitude"], "19.1,19.2")
+        self.assertEqual([(place, response.Latitude()) for place, response in result],
+                         [("A", 47.1), ("B", 47.2), ("C", 47.3)])
+
+    @patch('openmeteo_requests.Client')
+    def test_fetch_many_shares_grid_cells(self, MockClient):
+        """
+        Test that places known to fall in the same model grid cell are fetched once
+        and share the response.
+        """
+        # Arrange: the model grid is 0.1 degrees wide
+        mock_client = MockClient.return_value
+        mock_client.weather_api.side_effect = lambda url, params: [
+            mock_grid_response(round(float(latitude), 1), round(float(longitude), 1))
+            for latitude, longitude in zip(params["latitude"].split(","),
+                                           params["longitude"].split(","))]
+        grid_cells.clear()
+        fetcher = WeatherDataFetcher()
+        fetcher.client = mock_client
+        fetch = functools.partial(
+            fetcher.fetch_many, "fetch_air_quality_data",
+            start_date="2024-06-01", end_date="2024-06-10")
+
+        # Act: the first fetch learns the cells, the second one uses them
+        fetch([("A", 46.01, 18.01), ("B", 46.02, 18.02), ("C", 46.51, 18.51)])
+        first_coordinates = mock_client.weather_api.call_args.kwargs["params"]["latitude"]
+        result = fetch([("A", 46.01, 18.01), ("B", 46.02, 18.02),
+                        ("C", 46.51, 18.51), ("D", 46.51, 18.51)])
+
+        # Assert
+        self.assertEqual(first_coordinates, "46.01,46.02,46.51")
+        self.assertEqual(
+            mock_client.weather_api.call_args.kwargs["params"]["latitude"], "46.01,46.51")
+        self.assertEqual([place for place, _ in result], ["A", "B", "C", "D"])
+        self.assertIs(result[0][1], result[1][1])
+        self.assertIs(result[2][1], result[3][1])
+        self.assertEqual(result[2][1].Latitude(), 46.5)
+
+    def test_grid_cell_index_forgets_least_recently_used(self):
+        """
+        Test that the grid cell index keeps at most its limit of locations.
+        """
+        index = GridCellIndex(max_entries=2)
+        for latitude in [46.0, 47.0]:
+            index.record("fetch_daily_weather_data", latitude, 19.0,
+                         mock_grid_response(latitude, 19.0))
+        index.cell("fetch_daily_weather_data", 46.0, 19.0)
+        index.record("fetch_daily_weather_data", 48.0, 19.0,
+                     mock_grid_response(48.0, 19.0))
+
+        self.assertEqual(index.cell("fetch_daily_weather_data", 46.0, 19.0), (46.0, 19.0))
+        self.assertIsNone(index.cell("fetch_daily_weather_data", 47.0, 19.0))
+        index.clear()
+        self.assertIsNone(index.cell("fetch_daily_weather_data", 48.0, 19.0))
+
+    def test_cache_policy_per_endpoint(self):
+        """
+        Test that archive responses never expire while forecast and air quality
+        responses expire after minutes.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            fetcher = WeatherDataFetcher(cache_path=os.path.join(directory, "cache"))
+            rules = fetcher.session.settings.urls_expire_after
+
+            self.assertEqual(rules["archive-api.open-meteo.com"], -1)
+            self.assertGreater(rules["api.open-meteo.com/v1/forecast"], 0)
+            self.assertGreater(rules["air-quality-api.open-meteo.com"], 0)
+
+    def test_cache_evicts_least_recently_used(self):
+        """
+        Test that the cache drops the least recently used responses above its limit.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            fetcher = WeatherDataFetcher(cache_path=os.path.join(directory, "cache"))
+            tracker = CacheTracker(fetcher.cache, max_entries=2)
+            for key in ["b", "a", "c"]:
+                fetcher.cache.responses[key] = CachedResponse(status_code=200)
+                tracker.record(key, from_cache=False)
+
+            evicted = tracker.flush()
+
+            self.assertEqual(evicted, 1)
+            self.assertEqual(sorted(fetcher.cache.responses.keys()), ["a", "c"])
+            self.assertEqual(tracker.size()["entries"], 2)
+
+    def test_cache_miss_and_hit_are_counted_once(self):
+        """
+        Test that a request answered upstream and its repeat served from the
+        cache count as one miss and one hit.
+        """
+        url = "https://archive-api.open-meteo.com/v1/cache_test?latitude=47.5"
+        with tempfile.TemporaryDirectory() as directory:
+            fetcher = WeatherDataFetcher(cache_path=os.path.join(directory, "cache"))
+            fetcher.session.mount("https://", StaticAdapter())
+            before = cache_stats.snapshot()
+
+            first = fetcher.session.get(url)
+            second = fetcher.session.get(url)
+
+            after = cache_stats.snapshot()
+            self.assertFalse(first.from_cache)
+            self.assertTrue(second.from_cache)
+            self.assertEqual(after["misses"], before["misses"] + 1)
+            self.assertEqual(after["hits"], before["hits"] + 1)
+            self.assertEqual(fetcher.cache_tracker.size()["entries"], 1)
+
+    def test_cache_access_times_are_written_in_batches(self):
+        """
+        Test that cache uses are written once per batch and the responses are
+        only counted once.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            fetcher = WeatherDataFetcher(cache_path=os.path.join(directory, "cache"))
+            tracker = CacheTracker(fetcher.cache, max_entries=10, flush_size=3)
+            with patch("http_cache.sqlite3.connect", wraps=sqlite3.connect) as connect, \
+                    patch.object(type(fetcher.cache.responses), "count",
+                                 return_value=0) as count:
+                for key in ["a", "b", "a", "c", "d"]:
+                    tracker.record(key, from_cache=key == "a")
+
+            self.assertEqual(connect.call_count, 1)
+            self.assertEqual(count.call_count, 1)
+            self.assertEqual(tracker.pending.keys(), {"d"})
+            self.assertEqual(tracker.size()["entries"], 3)
+
 
 class TestWeatherDataProcessor(unittest.TestCase):
     """
@@ -60,7 +274,6 @@ class TestWeatherDataProcessor(unittest.TestCase):
             [15.0, 16.0],  # temperature_2m_mean
             [0.0, 0.1],     # rain_sum
             [3.0, 4.0],     # wind_speed_10m_max
-            [100.0, 200.0]  # shortwave_radiation_sum
         ]
         mock_response.Daily.return_value = mock_daily
         mock_daily.Time.return_value = 1690000000  # Mock timestamps
@@ -68,28 +281,866 @@ class TestWeatherDataProcessor(unittest.TestCase):
         mock_daily.Interval.return_value = 3600
 
         processor = WeatherDataProcessor(
-            response=mock_response, place_name="Berlin")
+            response=mock_response, place_id=1)
 
-        print(mock_response)
         # Act
         result = processor.process_daily_data()
 
         # Assert
         expected_data = {
-            "place_name": ["Berlin", "Berlin"],
+            "place_id": pd.Series([1, 1], dtype="int32"),
             "date_id": pd.date_range(
                 start=pd.to_datetime(1690000000, unit="s", utc=True),
                 end=pd.to_datetime(1690007200, unit="s", utc=True),
-                freq="1H",  # Equivalent to 3600 seconds
+                freq="1h",  # Equivalent to 3600 seconds
                 inclusive="right"
             ),
-            "temperature_2m_mean": [15.0, 16.0],
-            "rain_sum": [0.0, 0.1],
-            "wind_speed_10m_max": [3.0, 4.0],
-            "shortwave_radiation_sum": [100.0, 200.0]
+            "temperature_2m_cels": pd.Series([15.0, 16.0], dtype="float32"),
+            "rain_mm": pd.Series([0.0, 0.1], dtype="float32"),
+            "wind_speed_kmh": pd.Series([3.0, 4.0], dtype="float32"),
         }
         expected_df = pd.DataFrame(expected_data)
-        pd.testing.assert_frame_equal(result, expected_df)
+        pd.testing.assert_frame_equal(result, expected_df, check_freq=False)
+
+    def test_process_many_concatenates_places(self):
+        """
+        Test that process_many stacks the responses of many places in order.
+        """
+        # Arrange
+        def mock_response(start, values):
+            response = MagicMock()
+            hourly = response.Hourly.return_value
+            hourly.Time.return_value = start
+            hourly.TimeEnd.return_value = start + 3600 * len(values)
+            hourly.Interval.return_value = 3600
+            hourly.Variables.return_value.ValuesAsNumpy.return_value = values
+            return response
+
+        responses = [(1, mock_response(1690000000, [1.0, 2.0])),
+                     (2, mock_response(1690003600, [3.0]))]
+
+        # Act
+        result = WeatherDataProcessor.process_many(
+            responses, "process_forecast_weather_data")
+
+        # Assert
+        self.assertEqual(result["place_id"].tolist(), [1, 1, 2])
+        self.assertEqual(result["rain_mm"].tolist(), [1.0, 2.0, 3.0])
+        self.assertEqual(list(result.columns), [
+            "place_id", "date_id", "temperature_2m_cels", "rain_mm", "wind_speed_kmh"])
+        self.assertEqual(result["date_id"].iloc[2],
+                         pd.Timestamp(1690007200, unit="s", tz="UTC"))
+
+    def test_process_many_decodes_a_shared_response_once(self):
+        """
+        Test that places sharing a grid cell response get its rows, decoded once.
+        """
+        # Arrange
+        response = MagicMock()
+        hourly = response.Hourly.return_value
+        hourly.Time.return_value = 1690000000
+        hourly.TimeEnd.return_value = 1690007200
+        hourly.Interval.return_value = 3600
+        hourly.Variables.return_value.ValuesAsNumpy.return_value = [1.0, 2.0]
+
+        # Act
+        result = WeatherDataProcessor.process_many(
+            [(1, response), (2, response), (3, response)], "process_forecast_weather_data")
+
+        # Assert
+        self.assertEqual(response.Hourly.call_count, 1)
+        self.assertEqual(hourly.Variables.call_count, 3)
+        self.assertEqual(result["place_id"].tolist(), [1, 1, 2, 2, 3, 3])
+        self.assertEqual(result["rain_mm"].tolist(), [1.0, 2.0] * 3)
+        self.assertEqual(result["date_id"].tolist(),
+                         result["date_id"].iloc[:2].tolist() * 3)
+
+
+class TestSaveToPostgres(unittest.TestCase):
+    """
+    Unit tests for the save_to_postgres function, run against SQLite.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.connection_url = "sqlite:///" + \
+            os.path.join(self.tmp_dir.name, "weather.db")
+        metadata = MetaData()
+        Table(
+            'daily_weather_data', metadata,
+            Column('place_id', Integer, nullable=False),
+            Column('date_id', DateTime, nullable=False),
+            Column('temperature_2m_cels', Float),
+            UniqueConstraint('place_id', 'date_id')
+        )
+        Table(
+            'forecast_weather_data', metadata,
+            Column('place_id', Integer, nullable=False),
+            Column('date_id', DateTime, nullable=False),
+            Column('temperature_2m_cels', Float),
+            Column('rain_mm', Float),
+            Column('wind_speed_kmh', Float),
+            UniqueConstraint('place_id', 'date_id')
+        )
+        Table(
+            'places_data', metadata,
+            Column('place_id', Integer, primary_key=True, autoincrement=True),
+            Column('place_name', String, unique=True),
+            Column('longitude', Float),
+            Column('latitude', Float)
+        )
+        self.engine = create_engine(self.connection_url)
+        metadata.create_all(self.engine)
+
+    def tearDown(self):
+        self.engine.dispose()
+        dispose_engines()
+        self.tmp_dir.cleanup()
+
+    def frame(self, periods, temperature):
+        return pd.DataFrame({
+            "place_id": 1,
+            "date_id": pd.date_range("2024-06-03", periods=periods,
+                                     freq="D", tz="UTC"),
+            "temperature_2m_cels": temperature,
+        })
+
+    def read_table(self):
+        return pd.read_sql("SELECT * FROM daily_weather_data ORDER BY date_id",
+                           self.engine)
+
+    def test_duplicates_are_skipped(self):
+        """
+        Rows already stored are dropped by the unique constraint.
+        """
+        self.assertEqual(save_to_postgres(
+            self.frame(2, 20.0), self.connection_url, 'daily_weather_data'), 2)
+        self.assertEqual(save_to_postgres(
+            self.frame(3, 25.0), self.connection_url, 'daily_weather_data'), 1)
+
+        stored = self.read_table()
+        self.assertEqual(stored["temperature_2m_cels"].tolist(),
+                         [20.0, 20.0, 25.0])
+
+    def test_saving_new_rows_bumps_data_version(self):
+        """
+        Only saves that store rows change the data version of the place.
+        """
+        def version():
+            return get_data_versions()["versions"].get(1, 0)
+
+        before = version()
+        save_to_postgres(self.frame(2, 20.0), self.connection_url,
+                         'daily_weather_data')
+        self.assertEqual(version(), before + 1)
+        save_to_postgres(self.frame(2, 20.0), self.connection_url,
+                         'daily_weather_data')
+        self.assertEqual(version(), before + 1)
+
+    def test_update_overwrites_existing_rows(self):
+        """
+        With update=True colliding rows are overwritten.
+        """
+        save_to_postgres(self.frame(2, 20.0), self.connection_url,
+                         'daily_weather_data')
+        save_to_postgres(self.frame(2, 25.0), self.connection_url,
+                         'daily_weather_data', update=True)
+
+        stored = self.read_table()
+        self.assertEqual(stored["temperature_2m_cels"].tolist(), [25.0, 25.0])
+
+    def test_forecasts_are_upserted_by_default(self):
+        """
+        Saves to the UPSERT_TABLES overwrite changed rows, unchanged rows are not counted.
+        """
+        save_to_postgres(self.frame(2, 20.0), self.connection_url,
+                         'forecast_weather_data')
+        changed = self.frame(3, 20.0)
+        changed.loc[1, "temperature_2m_cels"] = 25.0
+
+        self.assertEqual(save_to_postgres(changed, self.connection_url,
+                                          'forecast_weather_data'), 2)
+        self.assertEqual(save_to_postgres(changed, self.connection_url,
+                                          'forecast_weather_data'), 0)
+        stored = pd.read_sql("SELECT * FROM forecast_weather_data ORDER BY date_id",
+                             self.engine)
+        self.assertEqual(stored["temperature_2m_cels"].tolist(), [20.0, 25.0, 20.0])
+
+    @patch('utility.resolve_place_id', return_value=1)
+    def test_forecast_refresh_overwrites_stored_hours(self, _):
+        """
+        Refreshing the forecast window replaces the values of the stored hours.
+        """
+        def refresh(temperature):
+            response = MagicMock()
+            hourly = response.Hourly.return_value
+            hourly.Time.return_value = 1717372800
+            hourly.TimeEnd.return_value = 1717372800 + 3 * 3600
+            hourly.Interval.return_value = 3600
+            hourly.Variables.return_value.ValuesAsNumpy.return_value = [temperature] * 3
+            fetcher = MagicMock()
+            fetcher.fetch_forecast_weather_data.return_value = response
+            return fetch_and_process_multiple(
+                fetcher=fetcher, processor_class=WeatherDataProcessor,
+                fetch_method="fetch_forecast_weather_data",
+                process_method="process_forecast_weather_data",
+                latitude=47.5, longitude=19.0, start_date="2024-06-03",
+                end_date="2024-06-03", timezone="UTC", place_name="Budapest",
+                connection_url=self.connection_url, table_name='forecast_weather_data')
+
+        self.assertEqual(refresh(20.0), 3)
+        self.assertEqual(refresh(25.0), 3)
+
+        stored = pd.read_sql("SELECT * FROM forecast_weather_data", self.engine)
+        self.assertEqual(stored["temperature_2m_cels"].tolist(), [25.0] * 3)
+
+    def test_copy_falls_back_to_insert_on_sqlite(self):
+        """
+        The COPY load method falls back to INSERT ... ON CONFLICT off PostgreSQL.
+        """
+        save_to_postgres(self.frame(2, 20.0), self.connection_url,
+                         'daily_weather_data', load_method='copy')
+        saved_rows = save_to_postgres(self.frame(3, 20.0), self.connection_url,
+                                      'daily_weather_data', load_method='copy',
+                                      chunksize=1)
+
+        self.assertEqual(saved_rows, 1)
+        self.assertEqual(len(self.read_table()), 3)
+
+    def test_watermarks_drive_incremental_start(self):
+        """
+        The incremental start date is the day after the latest stored row.
+        """
+        save_to_postgres(self.frame(3, 20.0), self.connection_url,
+                         'daily_weather_data')
+
+        watermarks = get_watermarks(self.connection_url, 'daily_weather_data',
+                                    [1, 2])
+
+        # The rows end at UTC midnight, the latest one covers 2024-06-04
+        self.assertEqual(list(watermarks), [1])
+        self.assertEqual(incremental_start_date(
+            watermarks[1], "2024-06-03"), "2024-06-05")
+        self.assertEqual(incremental_start_date(None, "2024-06-03"),
+                         "2024-06-03")
+
+    def test_incremental_start_follows_request_timezone(self):
+        """
+        Daily rows fetched in any timezone are not fetched again, nor skipped.
+        """
+        for timezone in ["Europe/Berlin", "UTC", "America/New_York"]:
+            # Open-Meteo starts the daily section at the local midnight of the first day
+            response = MagicMock()
+            daily = response.Daily.return_value
+            daily.Time.return_value = int(pd.Timestamp("2024-06-03", tz=timezone).timestamp())
+            daily.TimeEnd.return_value = daily.Time.return_value + 3 * 86400
+            daily.Interval.return_value = 86400
+            daily.Variables.return_value.ValuesAsNumpy.return_value = [20.0] * 3
+            frame = WeatherDataProcessor.process_many([(1, response)], "process_daily_data")
+            watermark = frame["date_id"].max().tz_localize(None)
+
+            self.assertEqual(incremental_start_date(watermark, "2024-06-03", timezone),
+                             "2024-06-06", timezone)
+
+    def test_unknown_place_is_registered_once(self):
+        """
+        Resolving an unknown place registers it and later calls reuse its id.
+        """
+        place_id = resolve_place_id(self.connection_url, "Szeged", 46.25, 20.15)
+
+        self.assertEqual(resolve_place_id(
+            self.connection_url, "Szeged", 46.25, 20.15), place_id)
+        places = pd.read_sql("SELECT * FROM places_data", self.engine)
+        self.assertEqual(places["place_id"].tolist(), [place_id])
+
+    def test_partitions_are_only_managed_on_postgres(self):
+        """
+        Test that the monthly partition names follow the table and that
+        non PostgreSQL databases are left alone.
+        """
+        self.assertEqual(partition_name("daily_weather_data", pd.Period("2024-06", freq="M")),
+                         "daily_weather_data_p202406")
+        self.assertEqual(ensure_partitions(self.engine, "daily_weather_data",
+                                           self.frame(40, 20.0)["date_id"]), 0)
+
+
+@unittest.skipUnless(TEST_DATABASE_URL, "TEST_DATABASE_URL is not set")
+class TestPostgresPartitions(unittest.TestCase):
+    """
+    Integration tests of the partition DDL, run against the PostgreSQL database
+    of TEST_DATABASE_URL in a schema of their own.
+    """
+
+    schema = "partition_tests"
+
+    def setUp(self):
+        with create_engine(TEST_DATABASE_URL).begin() as connection:
+            connection.execute(text(f"DROP SCHEMA IF EXISTS {self.schema} CASCADE"))
+            connection.execute(text(f"CREATE SCHEMA {self.schema}"))
+        self.connection_url = make_url(TEST_DATABASE_URL).update_query_dict(
+            {"options": f"-csearch_path={self.schema}"}).render_as_string(hide_password=False)
+        self.engine = get_engine(self.connection_url)
+
+    def tearDown(self):
+        dispose_engines()
+        engine = create_engine(TEST_DATABASE_URL)
+        with engine.begin() as connection:
+            connection.execute(text(f"DROP SCHEMA {self.schema} CASCADE"))
+        engine.dispose()
+
+    def facts(self, table_name, partitioned=True):
+        """
+        Fact table like the ones of the DB service.
+        """
+        return Table(
+            table_name, MetaData(),
+            Column("place_id", Integer, nullable=False),
+            Column("date_id", DateTime, nullable=False),
+            Column("temperature_2m_cels", Float),
+            Column("rain_mm", Float),
+            Column("wind_speed_kmh", Float),
+            Index(f"uq_{table_name}_place_id_date", "place_id", "date_id", unique=True),
+            **({"postgresql_partition_by": "RANGE (date_id)"} if partitioned else {}))
+
+    def insert_days(self, table_name, start, periods):
+        with self.engine.begin() as connection:
+            connection.execute(text(f"""
+                INSERT INTO {table_name} (place_id, date_id, temperature_2m_cels)
+                SELECT 1, day, 20.0 FROM generate_series(
+                    CAST(:start AS timestamp), CAST(:start AS timestamp)
+                    + (:periods - 1) * INTERVAL '1 day', INTERVAL '1 day') AS day
+            """), {"start": start, "periods": periods})
+
+    def count(self, table_name):
+        with self.engine.connect() as connection:
+            return connection.execute(text(f'SELECT COUNT(*) FROM "{table_name}"')).scalar()
+
+    def partitions(self, table_name):
+        with self.engine.connect() as connection:
+            return existing_partitions(connection, table_name)
+
+    def test_migration_moves_the_rows_into_monthly_partitions(self):
+        """
+        An unpartitioned table is replaced by a partitioned one holding all of
+        its rows, with partitions for the months before the first month too.
+        """
+        self.facts("daily_weather_data", partitioned=False).create(self.engine)
+        self.insert_days("daily_weather_data", "2024-05-20", 30)
+
+        copied = migrate_to_partitions(
+            self.engine, self.facts("daily_weather_data"),
+            pd.Period("2024-06", freq="M"), pd.Period("2024-07", freq="M"))
+
+        self.assertEqual(copied, 30)
+        self.assertEqual(self.count("daily_weather_data"), 30)
+        self.assertEqual(self.count("daily_weather_data_p202405"), 12)
+        self.assertEqual(self.count("daily_weather_data_default"), 0)
+        self.assertEqual(self.partitions("daily_weather_data"), {
+            "daily_weather_data_p202405", "daily_weather_data_p202406",
+            "daily_weather_data_p202407", "daily_weather_data_default"})
+        with self.engine.connect() as connection:
+            self.assertIsNone(connection.execute(text(
+                "SELECT to_regclass('daily_weather_data_unpartitioned')")).scalar())
+
+    def test_migration_resumes_from_the_leftover_table(self):
+        """
+        Rows left in the renamed table by an interrupted migration are copied over.
+        """
+        table = self.facts("daily_weather_data")
+        table.create(self.engine)
+        self.facts("daily_weather_data_unpartitioned", partitioned=False).create(self.engine)
+        self.insert_days("daily_weather_data_unpartitioned", "2024-06-01", 5)
+
+        copied = migrate_to_partitions(self.engine, table, pd.Period("2024-06", freq="M"),
+                                       pd.Period("2024-06", freq="M"))
+
+        self.assertEqual(copied, 5)
+        self.assertEqual(self.count("daily_weather_data_p202406"), 5)
+
+    def test_write_attaches_the_month_caught_by_the_default_partition(self):
+        """
+        Rows of a month without a partition land in the default partition, the
+        first write of the month moves them into the partition it creates.
+        """
+        self.facts("forecast_weather_data").create(self.engine)
+        with self.engine.begin() as connection:
+            create_partitions(connection, "forecast_weather_data",
+                              [pd.Period("2024-06", freq="M")], default=True)
+        self.insert_days("forecast_weather_data", "2024-07-01", 3)
+        self.assertEqual(self.count("forecast_weather_data_default"), 3)
+
+        frame = pd.DataFrame({
+            "place_id": 1,
+            "date_id": pd.date_range("2024-07-04", periods=2, freq="D", tz="UTC"),
+            "temperature_2m_cels": 21.0, "rain_mm": 0.0, "wind_speed_kmh": 3.0})
+        with patch("data_access.partitions._known_partitions", set()):
+            saved = save_to_postgres(frame, self.connection_url, "forecast_weather_data")
+
+        self.assertEqual(saved, 2)
+        self.assertEqual(self.count("forecast_weather_data_default"), 0)
+        self.assertEqual(self.count("forecast_weather_data_p202407"), 5)
+
+    def test_retention_drops_the_old_partitions(self):
+        """
+        Partitions before the first kept month are dropped with their rows,
+        the default partition is kept.
+        """
+        self.facts("air_quality_data").create(self.engine)
+        with self.engine.begin() as connection:
+            create_partitions(connection, "air_quality_data",
+                              pd.period_range("2024-05", "2024-07", freq="M"), default=True)
+        self.insert_days("air_quality_data", "2024-05-30", 5)
+
+        with self.engine.begin() as connection:
+            dropped = drop_partitions_before(connection, "air_quality_data",
+                                             pd.Period("2024-06", freq="M"))
+
+        self.assertEqual(dropped, 1)
+        self.assertEqual(self.count("air_quality_data"), 3)
+        self.assertEqual(self.partitions("air_quality_data"), {
+            "air_quality_data_p202406", "air_quality_data_p202407",
+            "air_quality_data_default"})
+
+
+class TestParquetStorage(unittest.TestCase):
+    """
+    Unit tests for the ParquetStorage backend, on a temporary directory.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.storage = ParquetStorage(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def frame(self, place_id, start, periods, rain):
+        return pd.DataFrame({
+            "place_id": place_id,
+            "date_id": pd.date_range(start, periods=periods, freq="D", tz="UTC"),
+            "temperature_2m_cels": 20.0,
+            "rain_mm": rain,
+        })
+
+    def test_save_skips_stored_rows(self):
+        """
+        Rows already stored in a partition are not saved again.
+        """
+        self.assertEqual(self.storage.save(
+            self.frame(1, "2024-06-29", 3, 1.0), 'daily_weather_data'), 3)
+        self.assertEqual(self.storage.save(
+            self.frame(1, "2024-06-29", 4, 2.0), 'daily_weather_data'), 1)
+
+        stored = self.storage.read('daily_weather_data')
+        self.assertEqual(stored["rain_mm"].tolist(), [1.0, 1.0, 1.0, 2.0])
+        self.assertTrue(os.path.isdir(os.path.join(
+            self.tmp_dir.name, 'daily_weather_data', 'place_id=1', 'month=2024-07')))
+
+    def test_save_overwrites_changed_forecasts(self):
+        """
+        Rows of the UPSERT_TABLES are overwritten, only changed rows count as saved.
+        """
+        self.storage.save(self.frame(1, "2024-06-29", 3, 1.0), 'forecast_weather_data')
+        changed = self.frame(1, "2024-06-29", 3, 1.0)
+        changed.loc[2, "rain_mm"] = 5.0
+
+        self.assertEqual(self.storage.save(changed, 'forecast_weather_data'), 1)
+        self.assertEqual(self.storage.save(changed, 'forecast_weather_data'), 0)
+        stored = self.storage.read('forecast_weather_data')
+        self.assertEqual(stored["rain_mm"].tolist(), [1.0, 1.0, 5.0])
+
+    def test_read_filters_places_dates_and_columns(self):
+        """
+        Reads only return the requested places, dates and columns.
+        """
+        self.storage.save(self.frame(1, "2024-06-29", 5, 1.0), 'daily_weather_data')
+        self.storage.save(self.frame(2, "2024-06-29", 5, 2.0), 'daily_weather_data')
+
+        result = self.storage.read('daily_weather_data', place_ids=[2],
+                                   columns=['rain_mm'],
+                                   start_date="2024-06-30", end_date="2024-07-02")
+
+        self.assertEqual(list(result.columns), ['place_id', 'date_id', 'rain_mm'])
+        self.assertEqual(result["place_id"].tolist(), [2, 2])
+        self.assertEqual(result["date_id"].tolist(),
+                         [pd.Timestamp("2024-06-30"), pd.Timestamp("2024-07-01")])
+        self.assertEqual(self.storage.watermarks('daily_weather_data', [1, 3]),
+                         {1: pd.Timestamp("2024-07-03")})
+
+    def test_tracked_places_come_from_the_datasets(self):
+        """
+        The places refreshed by the scheduler are the ones stored in the
+        datasets, and every save that changed rows is reported.
+        """
+        on_saved = MagicMock()
+        storage = ParquetStorage(self.tmp_dir.name, on_saved=on_saved)
+        storage.save(self.frame(2, "2024-06-29", 3, 1.0), 'daily_weather_data')
+        storage.save(self.frame(2, "2024-06-29", 3, 1.0), 'daily_weather_data')
+        self.assertEqual(on_saved.call_count, 1)
+        self.assertEqual(storage.place_ids('daily_weather_data'), {2})
+        self.assertEqual(storage.place_ids('air_quality_data'), set())
+
+        connection_url = f"sqlite:///{os.path.join(self.tmp_dir.name, 'places.db')}"
+        places = pd.DataFrame({"place_id": [1, 2], "place_name": ["A", "B"],
+                               "latitude": [47.0, 46.0], "longitude": [19.0, 18.0]})
+        places.to_sql("places_data", create_engine(connection_url), index=False)
+        with patch('data_access.storage.get_storage', return_value=storage):
+            self.assertEqual(get_tracked_places(connection_url), [(2, 46.0, 18.0)])
+        dispose_engines()
+
+    def test_backends_implement_the_whole_interface(self):
+        """
+        A backend missing one of the StorageBackend methods cannot be created.
+        """
+        class ReadOnlyStorage(StorageBackend):
+            def read(self, table_name, place_ids=None, columns=None,
+                     start_date=None, end_date=None):
+                return pd.DataFrame()
+
+        with self.assertRaises(TypeError):
+            ReadOnlyStorage()
+
+
+class TestEngineRegistry(unittest.TestCase):
+    """
+    Unit tests for the shared engine registry.
+    """
+
+    def tearDown(self):
+        dispose_engines()
+
+    def test_engine_is_shared_per_url(self):
+        """
+        The same URL always returns the same pooled engine.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            connection_url = "sqlite:///" + os.path.join(tmp_dir, "pool.db")
+            engine = get_engine(connection_url)
+
+            self.assertIs(get_engine(connection_url), engine)
+            with engine.connect():
+                stats = pool_stats()[connection_url]
+                self.assertEqual(stats["checked_out"], 1)
+            dispose_engines()
+
+
+class TestIngestJobManager(unittest.TestCase):
+    """
+    Unit tests for the IngestJobManager class.
+    """
+
+    @patch('jobs.WeatherDataFetcher')
+    @patch('jobs.fetch_and_process_multiple')
+    def test_jobs_for_same_place_are_coalesced(self, mock_fetch_and_process, _):
+        """
+        A second job for a place in flight returns the running job.
+        """
+        # Arrange
+        release = threading.Event()
+        mock_fetch_and_process.side_effect = lambda **kwargs: release.wait(5) and 10
+        manager = IngestJobManager("sqlite://", max_workers=1)
+
+        # Act
+        first, first_created = manager.submit(47.5, 19.0, "Budapest")
+        second, second_created = manager.submit(47.5, 19.0, "Budapest")
+        release.set()
+        manager.executor.shutdown(wait=True)
+
+        # Assert
+        self.assertTrue(first_created)
+        self.assertFalse(second_created)
+        self.assertEqual(first["job_id"], second["job_id"])
+        job = manager.get(first["job_id"])
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["steps_done"], job["steps_total"])
+        self.assertEqual(job["rows_saved"], 10 * job["steps_total"])
+
+
+class TestSingleFlight(unittest.TestCase):
+    """
+    Unit tests for the coalescing of identical fetch-process-save calls.
+    """
+
+    @patch('utility._fetch_and_process_multiple')
+    def test_concurrent_identical_calls_share_one_run(self, mock_run):
+        """
+        A call for a place and date range in flight is joined, not repeated.
+        """
+        # Arrange
+        started = threading.Event()
+        release = threading.Event()
+        mock_run.side_effect = lambda *args: started.set() or release.wait(5) and 7
+        arguments = dict(fetcher=None, processor_class=None,
+                         fetch_method="fetch_daily_weather_data",
+                         process_method="process_daily_data",
+                         latitude=47.5, longitude=19.0, start_date="2024-06-03",
+                         end_date="2024-06-10", timezone="Europe/Berlin",
+                         place_name="Budapest", connection_url="sqlite://",
+                         table_name="daily_weather_data")
+        results = []
+
+        def call():
+            results.append(fetch_and_process_multiple(**arguments))
+
+        # Act
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        threads[0].start()
+        started.wait(5)
+        coalesced = ingest_flights.coalesced
+        for thread in threads[1:]:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while ingest_flights.coalesced < coalesced + 2:
+            if time.monotonic() > deadline:
+                release.set()
+                self.fail("The concurrent calls did not join the call in flight")
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        # Assert
+        self.assertEqual(mock_run.call_count, 1)
+        self.assertEqual(results, [7, 7, 7])
+        self.assertEqual(ingest_flights.stats()["in_flight"], 0)
+
+
+class TestRefreshScheduler(unittest.TestCase):
+    """
+    Unit tests for the RefreshScheduler and TokenBucket classes.
+    """
+
+    def test_token_bucket_limits_burst(self):
+        """
+        Tokens beyond the capacity are only handed out after refilling.
+        """
+        bucket = TokenBucket(rate=50, capacity=2)
+        bucket.acquire(2)
+        self.assertLess(bucket.tokens, 1)
+        bucket.acquire()
+        self.assertLess(bucket.tokens, 1)
+
+    def test_fetchers_share_the_process_rate_limiter(self):
+        """
+        Fetchers and the scheduler built without a token bucket share the one
+        of the process.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            fetcher = WeatherDataFetcher(cache_path=os.path.join(directory, "cache"))
+            scheduler = RefreshScheduler("sqlite://", schedules=[])
+
+            self.assertIs(fetcher.rate_limiter, upstream_rate_limiter)
+            self.assertIs(scheduler.rate_limiter, upstream_rate_limiter)
+
+    @patch('scheduler.RefreshScheduler._loop')
+    def test_start_delays_the_first_run(self, _):
+        """
+        The first run of every schedule waits for the start delay.
+        """
+        schedule = RefreshSchedule("forecast", 60, ['forecast_weather_data'])
+        scheduler = RefreshScheduler("sqlite://", schedules=[schedule])
+
+        scheduler.start(delay=600)
+        scheduler.stop(timeout=1)
+
+        self.assertGreater(schedule.next_run, time.monotonic() + 500)
+
+    @patch('scheduler.WeatherDataFetcher')
+    @patch('scheduler.fetch_and_process_many')
+    @patch('scheduler.get_tracked_places')
+    def test_run_refreshes_places_in_chunks(self, mock_places, mock_fetch_many, _):
+        """
+        A run refreshes the schedule's tables for every chunk of places.
+        """
+        # Arrange
+        mock_places.return_value = [(f"place {i}", 47.0, 19.0) for i in range(5)]
+        mock_fetch_many.return_value = 4
+        scheduler = RefreshScheduler("sqlite://", schedules=[], chunk_size=2)
+        schedule = RefreshSchedule("archive", 60, ['daily_weather_data',
+                                                   'air_quality_data'])
+
+        # Act
+        stats = scheduler.run(schedule)
+
+        # Assert
+        self.assertEqual(mock_fetch_many.call_count, 6)  # 3 chunks x 2 tables
+        self.assertEqual(stats["places"], 5)
+        self.assertEqual(stats["rows_processed"], 24)
+        self.assertEqual(stats["failed_steps"], 0)
+        self.assertEqual(list(scheduler.runs), [stats])
+
+
+class TestBenchmark(unittest.TestCase):
+    """
+    Unit tests for the benchmark suite.
+    """
+
+    def test_run_benchmarks_covers_ingest_and_reads(self):
+        """
+        A small run processes, saves and reads back every synthetic row.
+        """
+        results = run_benchmarks(places=2, days=3, repeat=1)
+
+        self.assertEqual(results["process.daily_weather_data"]["rows"], 6)
+        self.assertEqual(results["save.forecast_weather_data"]["rows"], 144)
+        self.assertEqual(results["read.all_places_range"]["rows"], 6)
+        self.assertEqual(results["read.watermarks"]["rows"], 2)
+
+    def test_create_schema_refuses_a_database_with_data(self):
+        """
+        The benchmark never recreates tables of an existing database.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            connection_url = "sqlite:///" + os.path.join(directory, "weather.db")
+            pd.DataFrame({"place_id": [1], "place_name": ["Budapest"]}).to_sql(
+                "places_data", create_engine(connection_url), index=False)
+
+            with self.assertRaises(ValueError):
+                create_schema(connection_url, places=2)
+            self.assertEqual(pd.read_sql("SELECT place_name FROM places_data",
+                                         create_engine(connection_url))["place_name"].tolist(),
+                             ["Budapest"])
+
+    def test_compare_flags_regressions(self):
+        """
+        Cases slower than the baseline by more than the threshold are regressions.
+        """
+        baseline = {"a": {"seconds_median": 1.0}, "b": {"seconds_median": 1.0}}
+        results = {"a": {"seconds_median": 1.1}, "b": {"seconds_median": 1.5},
+                   "c": {"seconds_median": 9.0}}
+
+        comparison = compare(results, baseline, max_regression=0.2)
+
+        self.assertFalse(comparison["a"]["regression"])
+        self.assertTrue(comparison["b"]["regression"])
+        self.assertNotIn("c", comparison)
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Unit tests for the Prometheus metrics.
+    """
+
+    def test_render_text_format(self):
+        """
+        Counters and cumulative histogram buckets are rendered per label set.
+        """
+        registry = MetricsRegistry()
+        counter = registry.register(Counter("rows_total", "Rows.", ["table"]))
+        histogram = registry.register(Histogram(
+            "stage_seconds", "Stages.", ["stage"], buckets=(0.1, 1)))
+
+        counter.inc(3, table="daily")
+        histogram.observe(0.05, stage="fetch")
+        histogram.observe(0.5, stage="fetch")
+        text = registry.render()
+
+        self.assertIn("# TYPE rows_total counter", text)
+        self.assertIn('rows_total{table="daily"} 3.0', text)
+        self.assertIn('stage_seconds_bucket{stage="fetch",le="0.1"} 1.0', text)
+        self.assertIn('stage_seconds_bucket{stage="fetch",le="1.0"} 2.0', text)
+        self.assertIn('stage_seconds_bucket{stage="fetch",le="+Inf"} 2.0', text)
+        self.assertIn('stage_seconds_count{stage="fetch"} 2.0', text)
+
+    def test_upstream_responses_and_retries_are_counted_once(self):
+        """
+        A retried miss and the cache hit repeating it are counted once per
+        request, with the retries of the miss.
+        """
+        url = "https://archive-api.open-meteo.com/v1/metrics_test?latitude=47.5"
+        keys = [("metrics_test", "miss"), ("metrics_test", "hit")]
+        before = [upstream_responses.values.get(key, 0) for key in keys]
+        retries_before = upstream_retries.values.get(("metrics_test",), 0)
+        with tempfile.TemporaryDirectory() as directory:
+            fetcher = WeatherDataFetcher(cache_path=os.path.join(directory, "cache"))
+            fetcher.session.mount("https://", StaticAdapter(retries=2))
+
+            fetcher.session.get(url)
+            fetcher.session.get(url)
+
+        self.assertEqual([upstream_responses.values.get(key, 0) for key in keys],
+                         [before[0] + 1, before[1] + 1])
+        self.assertEqual(upstream_retries.values[("metrics_test",)], retries_before + 2)
+
+    @patch('utility.resolve_place_id', return_value=1)
+    def test_failures_are_counted_per_stage(self, _):
+        """
+        A failing fetch is counted as a failure of the fetch stage.
+        """
+        fetcher = MagicMock()
+        fetcher.fetch_daily_weather_data.side_effect = RuntimeError("upstream down")
+        key = ("metrics_test", "fetch")
+        before = ingest_failures.values.get(key, 0)
+
+        result = fetch_and_process_multiple(
+            fetcher=fetcher, processor_class=WeatherDataProcessor,
+            fetch_method="fetch_daily_weather_data",
+            process_method="process_daily_data", latitude=47.5, longitude=19.0,
+            start_date="2024-06-03", end_date="2024-06-10",
+            timezone="Europe/Berlin", place_name="Budapest",
+            connection_url="sqlite://", table_name="metrics_test")
+
+        self.assertIsNone(result)
+        self.assertEqual(ingest_failures.values[key], before + 1)
+
+    @patch('utility.resolve_place_id', side_effect=RuntimeError("database down"))
+    def test_place_resolution_failures_are_not_watermark_failures(self, _):
+        """
+        A place that cannot be resolved fails the resolve stage, before the
+        watermark lookup starts.
+        """
+        keys = [("metrics_test", "resolve"), ("metrics_test", "watermark")]
+        before = [ingest_failures.values.get(key, 0) for key in keys]
+
+        result = fetch_and_process_multiple(
+            fetcher=MagicMock(), processor_class=WeatherDataProcessor,
+            fetch_method="fetch_daily_weather_data",
+            process_method="process_daily_data", latitude=47.5, longitude=19.0,
+            start_date="2024-06-03", end_date="2024-06-10",
+            timezone="Europe/Berlin", place_name="Budapest",
+            connection_url="sqlite://", table_name="metrics_test", incremental=True)
+
+        self.assertIsNone(result)
+        self.assertEqual([ingest_failures.values.get(key, 0) for key in keys],
+                         [before[0] + 1, before[1]])
+
+
+class TestProfiling(unittest.TestCase):
+    """
+    Unit tests for the opt-in request profiling.
+    """
+
+    def test_only_opted_in_requests_are_profiled(self):
+        """
+        Profiling needs the service switch and the request flag.
+        """
+        self.assertTrue(should_profile(True, enabled=True, sample_rate=1.0))
+        self.assertFalse(should_profile(False, enabled=True, sample_rate=1.0))
+        self.assertFalse(should_profile(True, enabled=False, sample_rate=1.0))
+        self.assertFalse(should_profile(True, enabled=True, sample_rate=0.0))
+
+    def test_store_keeps_a_bounded_ring(self):
+        """
+        Profiles of worker threads are merged and only the newest files are kept.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            store = ProfileStore(directory, max_files=2)
+            profile_ids = []
+            for index in range(3):
+                session = ProfileSession()
+                thread = threading.Thread(target=session.wrap(sum), args=(range(10),))
+                thread.start()
+                thread.join()
+                session.run(sum, range(10))
+                self.assertEqual(len(session.profiles), 2)
+                profile_ids.append(store.save(session, f"request {index}"))
+                os.utime(store.path(profile_ids[-1]), (index, index))
+
+            stored = [profile["profile_id"] for profile in store.list()]
+
+            self.assertEqual(stored, profile_ids[:0:-1])
+            self.assertIsNone(store.path(profile_ids[0]))
+            self.assertIsNone(store.path("../secret"))
 
 
 if __name__ == "__main__":
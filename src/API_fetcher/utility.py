@@ -1,11 +1,98 @@
-from data_access.data_write import save_to_postgres
+import datetime
+import pandas as pd
+from data_access.data_read import get_place_ids
+from data_access.data_write import register_place
+from data_access.storage import get_storage
+from metrics import ingest_failures, ingest_stage, rows_fetched, rows_inserted
+from single_flight import SingleFlight
+from common.schema import HISTORY_START_DATE
+
+# Concurrent identical fetch-process-save calls of this process share one run
+ingest_flights = SingleFlight()
+
+
+def build_fetch_process_pairs(today: datetime.date = None):
+    """
+    Builds the fetch/process/save steps of a full refresh relative to today.
+
+    Parameters:
+        today (datetime.date): Reference day, defaults to the current date.
+
+    Returns:
+        list: (fetch_method, process_method, table_name, start_date, end_date, incremental)
+              tuples. Incremental steps only fetch the days after the stored data,
+              the forecast window is always fetched again because forecasts change.
+              Its saves overwrite the stored hours (see UPSERT_TABLES in data_write).
+    """
+    today = today or datetime.date.today()
+    future_date = today + datetime.timedelta(days=7)
+    past_3_days = today - datetime.timedelta(days=3)
+
+    return [
+        ("fetch_daily_weather_data", "process_daily_data",
+         'daily_weather_data', HISTORY_START_DATE, past_3_days.isoformat(), True),
+        ("fetch_air_quality_data", "process_air_quality_data",
+         'air_quality_data', HISTORY_START_DATE, today.isoformat(), True),
+        ("fetch_forecast_weather_data", "process_forecast_weather_data",
+         'forecast_weather_data', past_3_days.isoformat(), future_date.isoformat(), False),
+    ]
+
+
+def incremental_start_date(watermark, start_date: str, timezone: str = "UTC") -> str:
+    """
+    Moves the start of a fetch to the day after the latest stored data.
+
+    The stored date_ids are naive UTC timestamps of the end of the interval a
+    row covers, e.g. a Europe/Berlin day ends at 22:00 or 23:00 UTC. The day
+    of the watermark is the local day in the request timezone the row ends.
+
+    Parameters:
+        watermark: The latest stored date_id of the place, or None without data.
+        start_date (str): The requested start date in ISO format.
+        timezone (str): The timezone of the fetch, the dates are local days of it.
+
+    Returns:
+        str: The later one of start_date and the day after the watermark.
+    """
+    if watermark is None:
+        return start_date
+    watermark = pd.Timestamp(watermark)
+    if watermark.tzinfo is None:
+        watermark = watermark.tz_localize("UTC")
+    # A row ending at local midnight covers the day before
+    last_day = (watermark.tz_convert(timezone) - pd.Timedelta(seconds=1)).date()
+    next_day = (last_day + datetime.timedelta(days=1)).isoformat()
+    return max(next_day, start_date)
+
+
+def resolve_place_id(connection_url: str, place_name: str,
+                     latitude: float, longitude: float) -> int:
+    """
+    Looks up the place_id of a place, registering the place in places_data
+    with the given coordinates if it is not known yet.
+
+    Parameters:
+        connection_url (str): The database connection URL.
+        place_name (str): The name of the place.
+        latitude (float): The latitude of the place.
+        longitude (float): The longitude of the place.
+
+    Returns:
+        int: The place_id of the place.
+    """
+    place_id = get_place_ids(connection_url, [place_name]).get(place_name)
+    if place_id is None:
+        register_place(connection_url, place_name, latitude, longitude)
+        place_id = get_place_ids(connection_url, [place_name])[place_name]
+    return place_id
 
 
 def fetch_and_process_multiple(fetcher: object, processor_class: object,
                                fetch_method: str, process_method: str,
                                latitude: float, longitude: float, start_date: str,
                                end_date: str, timezone: str, place_name: str,
-                               connection_url: str, table_name: str):
+                               connection_url: str, table_name: str,
+                               incremental: bool = False):
     """
     Fetches data from a specified source, processes it, and saves the processed data to a PostgreSQL database.
 
@@ -25,27 +112,133 @@ def fetch_and_process_multiple(fetcher: object, processor_class: object,
         place_name (str): A human-readable name for the location (e.g., "New York").
         connection_url (str): The database connection URL for saving the processed data.
         table_name (str): The name of the table in the database where the data will be stored.
+        incremental (bool): Only fetch the days after the latest stored data of the place.
 
     Returns:
-        None: The function saves the processed data to the database and does not return anything. 
-              If an error occurs, it prints the error message and returns `None`.
+        int: The number of processed rows saved to the database (0 if the place was up-to-date).
+             If an error occurs, it prints the error message and returns `None`.
+             Callers joining a call already in flight for the same endpoint, place and
+             date range get the result of that call.
     """
+    key = (connection_url, table_name, fetch_method, place_name,
+           str(start_date), str(end_date), timezone)
+    return ingest_flights.do(
+        key, _fetch_and_process_multiple, fetcher, processor_class,
+        fetch_method, process_method, latitude, longitude, start_date,
+        end_date, timezone, place_name, connection_url, table_name, incremental)
 
+
+def _fetch_and_process_multiple(fetcher, processor_class, fetch_method, process_method,
+                                latitude, longitude, start_date, end_date, timezone,
+                                place_name, connection_url, table_name, incremental):
+    # The uncoalesced body of fetch_and_process_multiple
+    state = {"stage": "setup"}
     try:
+        with ingest_stage("resolve", table_name, state):
+            place_id = resolve_place_id(connection_url, place_name, latitude, longitude)
+
+        if incremental:
+            with ingest_stage("watermark", table_name, state):
+                watermark = get_storage(connection_url).watermarks(
+                    table_name, [place_id]).get(place_id)
+            start_date = incremental_start_date(watermark, str(start_date), timezone)
+            if start_date > str(end_date):
+                print(f"Table '{table_name}' is up-to-date for {place_name}.")
+                return 0
+
         # Fetch data using the specified method
-        response = getattr(fetcher, fetch_method)(
-            latitude=latitude,
-            longitude=longitude,
-            start_date=start_date,
-            end_date=end_date,
-            timezone=timezone
-        )
+        with ingest_stage("fetch", table_name, state):
+            response = getattr(fetcher, fetch_method)(
+                latitude=latitude,
+                longitude=longitude,
+                start_date=start_date,
+                end_date=end_date,
+                timezone=timezone
+            )
 
         # Process data using the specified method
-        processor = processor_class(response=response, place_name=place_name)
-        processed_data = getattr(processor, process_method)()
-        save_to_postgres(processed_data, connection_url, table_name)
-        return
+        with ingest_stage("process", table_name, state):
+            processor = processor_class(response=response, place_id=place_id)
+            processed_data = getattr(processor, process_method)()
+        rows_fetched.inc(len(processed_data), table=table_name)
+        with ingest_stage("write", table_name, state):
+            saved_rows = get_storage(connection_url).save(processed_data, table_name)
+        rows_inserted.inc(saved_rows or 0, table=table_name)
+        return len(processed_data)
+    except Exception as e:
+        ingest_failures.inc(table=table_name, stage=state["stage"])
+        print(f"An error occurred: {e}")
+        return None
+
+
+def fetch_and_process_many(fetcher: object, processor_class: object,
+                           fetch_method: str, process_method: str,
+                           locations, start_date: str, end_date: str,
+                           timezone: str, connection_url: str, table_name: str,
+                           incremental: bool = False):
+    """
+    Fetches data for many locations in batched requests, processes every response
+    with its own place_id and saves all of them to a PostgreSQL database in one write.
+
+    Parameters:
+        fetcher (object): The WeatherDataFetcher used to fetch the data.
+        processor_class (class): The class responsible for processing the fetched data.
+        fetch_method (str): The name of the method in the fetcher to fetch data.
+        process_method (str): The name of the method in the processor class to process the data.
+        locations (iterable): (place_id, latitude, longitude) tuples to fetch.
+        start_date (str): The start date for the data fetch in ISO format (e.g., "2024-01-01").
+        end_date (str): The end date for the data fetch in ISO format (e.g., "2024-01-31").
+        timezone (str): The timezone of the locations (e.g., "UTC").
+        connection_url (str): The database connection URL for saving the processed data.
+        table_name (str): The name of the table in the database where the data will be stored.
+        incremental (bool): Only fetch the days after the latest stored data of each place,
+                            places sharing a start date are fetched together.
+
+    Returns:
+        int: The number of processed rows, or `None` if an error occurred.
+    """
+
+    state = {"stage": "setup"}
+    try:
+        locations = list(locations)
+        start_dates = {place_id: str(start_date) for place_id, _, _ in locations}
+        if incremental:
+            with ingest_stage("watermark", table_name, state):
+                watermarks = get_storage(connection_url).watermarks(
+                    table_name, start_dates.keys())
+            start_dates = {place_id: incremental_start_date(
+                watermarks.get(place_id), start, timezone)
+                for place_id, start in start_dates.items()}
+
+        # Group the locations by start date, every group is fetched in batches
+        groups = {}
+        for location in locations:
+            if start_dates[location[0]] <= str(end_date):
+                groups.setdefault(start_dates[location[0]], []).append(location)
+
+        responses = []
+        with ingest_stage("fetch", table_name, state):
+            for group_start_date, group in groups.items():
+                responses.extend(fetcher.fetch_many(
+                    fetch_method=fetch_method,
+                    locations=group,
+                    start_date=group_start_date,
+                    end_date=end_date,
+                    timezone=timezone
+                ))
+
+        if not responses:
+            return 0
+
+        # All responses are processed into one frame in a single allocation
+        with ingest_stage("process", table_name, state):
+            processed_data = processor_class.process_many(responses, process_method)
+        rows_fetched.inc(len(processed_data), table=table_name)
+        with ingest_stage("write", table_name, state):
+            saved_rows = get_storage(connection_url).save(processed_data, table_name)
+        rows_inserted.inc(saved_rows or 0, table=table_name)
+        return len(processed_data)
     except Exception as e:
+        ingest_failures.inc(table=table_name, stage=state["stage"])
         print(f"An error occurred: {e}")
         return None
@@ -1,6 +1,76 @@
-from sqlalchemy import create_engine, Column, Integer, Float, Date, MetaData, Table, String, DateTime, inspect
+from sqlalchemy import create_engine, Column, Integer, Float, Date, MetaData, Table, String, DateTime, Index, ForeignKey, inspect, text
 from sqlalchemy.exc import OperationalError
 import pandas as pd
+import datetime
+import hashlib
+import io
+import os
+from common.partitions import create_partitions, drop_partitions_before, \
+    migrate_to_partitions
+from common.schema import HISTORY_START_DATE, PARTITIONED_TABLES, ROLLUPS
+
+# Columns of places_data loaded from the places sheet
+PLACE_COLUMNS = ['place_name', 'longitude', 'latitude']
+
+# First partitioned month, the month of the first stored day
+PARTITION_START_MONTH = HISTORY_START_DATE[:7]
+# Partitions are created this many months ahead of the current month
+PARTITION_MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', 3))
+# Partitions older than this many months are dropped, kept forever if unset
+PARTITION_RETENTION_MONTHS = os.environ.get('PARTITION_RETENTION_MONTHS')
+
+
+def rollup_table(metadata, name, measures):
+    """
+    Defines a rollup table holding the mean, min and max of every measure
+    per place, granularity and time bucket.
+
+    :param metadata: SQLAlchemy metadata.
+    :param name: Name of the rollup table.
+    :param measures: Measure columns of the source table.
+    :return: SQLAlchemy table.
+    """
+    measure_columns = [Column(f'{measure}_{aggregate}', Float)
+                       for measure in measures
+                       for aggregate in ('mean', 'min', 'max')]
+    return Table(
+        name, metadata,
+        Column('place_id', Integer, ForeignKey('places_data.place_id'),
+               nullable=False),
+        Column('granularity', String, nullable=False),
+        Column('bucket_start', DateTime, nullable=False),
+        Column('sample_count', Integer),
+        *measure_columns,
+        Index(f'uq_{name}_place_id_bucket', 'place_id', 'granularity',
+              'bucket_start', unique=True)
+    )
+
+
+def populate_rollup(engine, source_table):
+    """
+    Fills the rollup table of a source table from all of its stored rows.
+    The API fetcher service keeps it up-to-date incrementally afterwards.
+
+    :param engine: SQLAlchemy engine object.
+    :param source_table: Name of the source table.
+    """
+    rollup_name, measures, granularities = ROLLUPS[source_table]
+    aggregates = ', '.join(f'AVG({measure}), MIN({measure}), MAX({measure})'
+                           for measure in measures)
+    columns = ', '.join(f'{measure}_{aggregate}' for measure in measures
+                        for aggregate in ('mean', 'min', 'max'))
+    with engine.begin() as connection:
+        for granularity in granularities:
+            connection.execute(text(f"""
+                INSERT INTO {rollup_name}
+                    (place_id, granularity, bucket_start, sample_count, {columns})
+                SELECT place_id, '{granularity}', date_trunc('{granularity}', date_id),
+                       COUNT(*), {aggregates}
+                FROM {source_table}
+                GROUP BY place_id, date_trunc('{granularity}', date_id)
+                ON CONFLICT DO NOTHING
+            """))
+    print(f"Rollup table '{rollup_name}' populated.")
 
 
 def initialize_database(connection_url):
@@ -14,41 +84,72 @@ def initialize_database(connection_url):
     # Define the weather_data table schema
     daily_weather_data = Table(
         'daily_weather_data', metadata,
-        Column('place_name', String),
+        Column('place_id', Integer, ForeignKey('places_data.place_id'),
+               nullable=False),
         Column('date_id', DateTime, nullable=False),
         Column('temperature_2m_cels', Float),
         Column('rain_mm', Float),
-        Column('wind_speed_kmh', Float)
+        Column('wind_speed_kmh', Float),
+        # Backs the ON CONFLICT dedup and the per place reads
+        Index('uq_daily_weather_data_place_id_date', 'place_id', 'date_id',
+              unique=True),
+        Index('ix_daily_weather_data_date_id', 'date_id'),
+        postgresql_partition_by='RANGE (date_id)'
     )
 
     air_quality_data = Table(
         'air_quality_data', metadata,
-        Column('place_name', String),
+        Column('place_id', Integer, ForeignKey('places_data.place_id'),
+               nullable=False),
         Column('date_id', DateTime, nullable=False),
         Column('pm10', Float),
         Column('pm2_5', Float),
         Column('carbon_dioxide', Float),
         Column('nitrogen_dioxide', Float),
         Column('sulphur_dioxide', Float),
-        Column('ozone', Float)
+        Column('ozone', Float),
+        # Backs the ON CONFLICT dedup and the per place reads
+        Index('uq_air_quality_data_place_id_date', 'place_id', 'date_id',
+              unique=True),
+        Index('ix_air_quality_data_date_id', 'date_id'),
+        postgresql_partition_by='RANGE (date_id)'
     )
 
     forecast_weather_data = Table(
         'forecast_weather_data', metadata,
-        Column('place_name', String),
+        Column('place_id', Integer, ForeignKey('places_data.place_id'),
+               nullable=False),
         Column('date_id', DateTime, nullable=False),
         Column('temperature_2m_cels', Float),
         Column('rain_mm', Float),
-        Column('wind_speed_kmh', Float)
+        Column('wind_speed_kmh', Float),
+        # Backs the ON CONFLICT dedup and the per place reads
+        Index('uq_forecast_weather_data_place_id_date', 'place_id', 'date_id',
+              unique=True),
+        Index('ix_forecast_weather_data_date_id', 'date_id'),
+        postgresql_partition_by='RANGE (date_id)'
     )
 
     places_data = Table(
         'places_data', metadata,
+        Column('place_id', Integer, primary_key=True, autoincrement=True),
         Column('place_name', String),
         Column('longitude', Float),
         Column('latitude', Float),
+        Index('uq_places_data_place_name', 'place_name', unique=True)
     )
 
+    # Fingerprint of the source files loaded into the database, e.g. the places sheet
+    source_files = Table(
+        'source_files', metadata,
+        Column('name', String, primary_key=True),
+        Column('sha256', String, nullable=False),
+        Column('loaded_at', DateTime)
+    )
+
+    rollup_tables = [rollup_table(metadata, rollup_name, measures)
+                     for rollup_name, measures, _ in ROLLUPS.values()]
+
     try:
         # Create the database engine
         engine = create_engine(connection_url)
@@ -57,10 +158,13 @@ def initialize_database(connection_url):
         inspector = inspect(engine)
 
         # List of tables to check and create
-        tables_to_create = [daily_weather_data,
+        # places_data goes first, the other tables reference it
+        tables_to_create = [places_data,
+                            source_files,
+                            daily_weather_data,
                             air_quality_data,
                             forecast_weather_data,
-                            places_data]
+                            *rollup_tables]
 
         # Loop through each table and check if it exists
         for table in tables_to_create:
@@ -70,65 +174,252 @@ def initialize_database(connection_url):
                 # Create the specific table if it doesn't exist
                 metadata.create_all(engine, tables=[table])
                 print(f"Table '{table.name}' created.")
+                if table.name in PARTITIONED_TABLES and engine.dialect.name == 'postgresql':
+                    with engine.begin() as connection:
+                        create_partitions(connection, table.name, partition_months(),
+                                          default=True)
+                # Rollups added to an existing database start from its stored data
+                source_table = next((source for source, (rollup_name, _, _) in ROLLUPS.items()
+                                     if rollup_name == table.name), None)
+                if source_table is not None and engine.dialect.name == 'postgresql':
+                    populate_rollup(engine, source_table)
             else:
                 print(
-                    f"Table '{table.name}' already exists, no initialization needed.")
+                    f"Table '{table.name}' already exists, checking schema...")
+                if 'place_id' in table.columns and \
+                        table.name not in {rollup_name for rollup_name, _, _ in ROLLUPS.values()}:
+                    migrate_place_ids(engine, table)
+                if table.name in PARTITIONED_TABLES and engine.dialect.name == 'postgresql':
+                    months = partition_months()
+                    migrate_to_partitions(engine, table, months[0], months[-1])
+                migrate_indexes(engine, table)
+
+        # Keep partitions ahead of the incoming data and drop the expired ones
+        if engine.dialect.name == 'postgresql':
+            for table_name in PARTITIONED_TABLES:
+                with engine.begin() as connection:
+                    create_partitions(connection, table_name, partition_months(),
+                                      default=True)
+                    if PARTITION_RETENTION_MONTHS:
+                        drop_partitions_before(
+                            connection, table_name,
+                            pd.Period.now(freq='M') - int(PARTITION_RETENTION_MONTHS))
 
     except OperationalError as e:
         print(f"Error initializing the database: {e}")
 
 
+def remove_duplicates(connection, table, columns):
+    """
+    Deletes all but one row of every group of rows sharing the given columns,
+    so a unique index can be created on them.
+
+    :param connection: SQLAlchemy connection.
+    :param table: SQLAlchemy table.
+    :param columns: Names of the columns that have to be unique.
+    """
+    if connection.dialect.name == 'postgresql':
+        matching = ' AND '.join(f'a."{column}" = b."{column}"' for column in columns)
+        query = f'DELETE FROM "{table.name}" a USING "{table.name}" b ' \
+                f'WHERE a.ctid > b.ctid AND {matching}'
+    else:
+        grouping = ', '.join(f'"{column}"' for column in columns)
+        query = f'DELETE FROM "{table.name}" WHERE rowid NOT IN ' \
+                f'(SELECT MIN(rowid) FROM "{table.name}" GROUP BY {grouping})'
+    deleted = connection.execute(text(query)).rowcount
+    if deleted:
+        print(f"Removed {deleted} duplicate rows from '{table.name}'.")
+
+
+def migrate_place_ids(engine, table):
+    """
+    Moves a table of an existing PostgreSQL database from place_name strings
+    to integer place_ids. places_data gets a serial place_id, the other tables
+    get their place_id from places_data and lose their place_name column.
+
+    :param engine: SQLAlchemy engine object.
+    :param table: SQLAlchemy table.
+    """
+    columns = {column['name'] for column in inspect(engine).get_columns(table.name)}
+    if 'place_id' in columns:
+        return
+
+    with engine.begin() as connection:
+        if table.name == 'places_data':
+            connection.execute(text(
+                'ALTER TABLE places_data ADD COLUMN place_id SERIAL PRIMARY KEY'))
+        else:
+            # Places only known from the stored data are registered without coordinates
+            connection.execute(text(f"""
+                INSERT INTO places_data (place_name)
+                SELECT DISTINCT t.place_name FROM "{table.name}" t
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM places_data p WHERE p.place_name = t.place_name)
+            """))
+            connection.execute(text(
+                f'ALTER TABLE "{table.name}" ADD COLUMN place_id INTEGER'))
+            connection.execute(text(f"""
+                UPDATE "{table.name}" t SET place_id = p.place_id
+                FROM places_data p WHERE p.place_name = t.place_name
+            """))
+            connection.execute(text(
+                f'ALTER TABLE "{table.name}" ALTER COLUMN place_id SET NOT NULL'))
+            connection.execute(text(
+                f'ALTER TABLE "{table.name}" ADD FOREIGN KEY (place_id) '
+                f'REFERENCES places_data (place_id)'))
+            # Dropping the column drops the indexes built on it as well
+            connection.execute(text(
+                f'ALTER TABLE "{table.name}" DROP COLUMN place_name'))
+    print(f"Table '{table.name}' migrated to place_id.")
+
+
+def migrate_indexes(engine, table):
+    """
+    Creates the indexes of a table that are missing from an existing database.
+    Duplicate rows are removed before a unique index is created.
+
+    :param engine: SQLAlchemy engine object.
+    :param table: SQLAlchemy table.
+    """
+    existing_indexes = {index['name']
+                        for index in inspect(engine).get_indexes(table.name)}
+    for index in sorted(table.indexes, key=lambda index: index.name):
+        if index.name in existing_indexes:
+            continue
+        with engine.begin() as connection:
+            if index.unique:
+                remove_duplicates(connection, table,
+                                  [column.name for column in index.columns])
+            index.create(connection)
+        print(f"Index '{index.name}' created on '{table.name}'.")
+
+
+def partition_months():
+    """
+    :return: pandas PeriodIndex of the months from PARTITION_START_MONTH up to
+             PARTITION_MONTHS_AHEAD months after the current one.
+    """
+    return pd.period_range(PARTITION_START_MONTH,
+                           pd.Period.now(freq='M') + PARTITION_MONTHS_AHEAD, freq='M')
+
+
 def dms_to_dd(dms):
     """
     Converts degree minute second (dms) to decimal degree (dd).
 
-    :param dms: degree minute second in a string format.
+    :param dms: Series of "degrees:minutes" strings, the minutes have a decimal fraction.
+    :return: Series of decimal degrees.
     """
-    degrees, minutes = map(float, dms.split(':'))
-    return degrees + (minutes / 60)
+    parts = dms.astype(str).str.split(':', n=1, expand=True).astype(float)
+    return parts[0] + parts[1] / 60
 
 
-def load_places_to_db(excel_path: str, connection_url: str, table_name: str):
+def file_sha256(path):
+    """
+    :param path: Path of a file.
+    :return: Hex SHA-256 digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_places(excel_path: str):
     """
-    Loads the Hungarian places into the PostgreSQL database
+    Reads the places sheet with the coordinates converted to decimal degrees.
+    It is only called when the hash of the sheet changed since the last load.
 
     :param excel_path: path to excel file
-    :param connection_url: Database connection URL.
-    :param table_name: Database table name.
+    :return: DataFrame with place_name, longitude and latitude columns.
     """
-    # Read Excel file
     df = pd.read_excel(excel_path, usecols=[
                        'Helységnév', 'Keleti hosszúság, fok:perc.századperc', 'Északi szélesség, fok:perc.századperc'])
-
-    # Rename columns
     df.columns = ['place_name', 'longitude_dms', 'latitude_dms']
+    return pd.DataFrame({
+        'place_name': df['place_name'].astype(str),
+        'longitude': dms_to_dd(df['longitude_dms']),
+        'latitude': dms_to_dd(df['latitude_dms']),
+    })
+
+
+def insert_new_places(engine, table_name, df):
+    """
+    Inserts the places in bulk, places already stored (by place_name) are skipped.
+    On PostgreSQL the rows are streamed with COPY into a temporary table and
+    merged with a single INSERT ... ON CONFLICT DO NOTHING.
 
-    # Convert DMS to DD
-    df['longitude'] = df['longitude_dms'].apply(dms_to_dd)
-    df['latitude'] = df['latitude_dms'].apply(dms_to_dd)
+    :param engine: SQLAlchemy engine object.
+    :param table_name: Database table name.
+    :param df: DataFrame with place_name, longitude and latitude columns.
+    :return: Number of inserted places.
+    """
+    df = df.drop_duplicates(subset=['place_name'])[PLACE_COLUMNS]
+    columns = ', '.join(PLACE_COLUMNS)
+    with engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text(
+                'CREATE TEMP TABLE staging_places '
+                '(place_name TEXT, longitude FLOAT8, latitude FLOAT8) ON COMMIT DROP'))
+            buffer = io.StringIO()
+            df.to_csv(buffer, index=False, header=False)
+            buffer.seek(0)
+            with connection.connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f'COPY staging_places ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+            result = connection.execute(text(f"""
+                INSERT INTO {table_name} ({columns})
+                SELECT {columns} FROM staging_places
+                ON CONFLICT (place_name) DO NOTHING
+            """))
+        else:
+            result = connection.execute(text(f"""
+                INSERT INTO {table_name} ({columns})
+                VALUES (:place_name, :longitude, :latitude)
+                ON CONFLICT (place_name) DO NOTHING
+            """), df.to_dict('records'))
+        return result.rowcount
 
-    # Drop the original DMS columns
-    df = df.drop(['longitude_dms', 'latitude_dms'], axis=1)
 
-    # Connect to the database
+def load_places_to_db(excel_path: str, connection_url: str, table_name: str):
+    """
+    Loads the Hungarian places into the PostgreSQL database. Nothing is read
+    or parsed when the database already holds the places of this exact file,
+    an emptied places table is loaded again.
+
+    :param excel_path: path to excel file
+    :param connection_url: Database connection URL.
+    :param table_name: Database table name.
+    """
+    source_hash = file_sha256(excel_path)
+    source_name = os.path.basename(excel_path)
     engine = create_engine(connection_url)
 
-    # Fetch existing data from the database
-    existing_data_df = pd.read_sql_table(
-        table_name, con=engine, columns=['place_name'])
-
-    # Identify new records using a left merge (pandas equivalent of a SQL left outer join)
-    new_records_df = pd.merge(
-        df, existing_data_df, on='place_name', how='left', indicator=True)
-    new_records_df = new_records_df[new_records_df['_merge']
-                                    == 'left_only']
-    new_records_df = new_records_df.drop('_merge', axis=1)
-
-    # Insert new records in bulk into the database
-    if not new_records_df.empty:
-        new_records_df.to_sql(table_name, con=engine,
-                              if_exists='append', index=False)
-        print("New places loaded into the database successfully.")
+    with engine.connect() as connection:
+        loaded_hash = connection.execute(
+            text('SELECT sha256 FROM source_files WHERE name = :name'),
+            {'name': source_name}).scalar()
+        has_places = connection.execute(
+            text(f'SELECT EXISTS (SELECT 1 FROM {table_name})')).scalar()
+    if loaded_hash == source_hash and has_places:
+        print("Places are up-to-date, skipping the places load.")
+        return
+
+    df = read_places(excel_path)
+    inserted = insert_new_places(engine, table_name, df)
+
+    with engine.begin() as connection:
+        connection.execute(text('DELETE FROM source_files WHERE name = :name'),
+                           {'name': source_name})
+        connection.execute(
+            text('INSERT INTO source_files (name, sha256, loaded_at) '
+                 'VALUES (:name, :sha256, :loaded_at)'),
+            {'name': source_name, 'sha256': source_hash,
+             'loaded_at': datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)})
+
+    if inserted:
+        print(f"{inserted} new places loaded into the database successfully.")
     else:
         print("No new places to load into the database.")
 
@@ -1,3 +1,88 @@
+import functools
+import logging
 from dash import Dash
+from flask import abort, jsonify, request, send_file
+from common.engine import pool_stats
+from data_access.query_cache import query_cache
+from common.profiling import PROFILE_FLAG, PROFILE_HEADER, ProfileSession, \
+    is_requested, profile_store, should_profile
+
+# Shared modules (e.g. common.profiling) log through the root logger
+logging.basicConfig(level=logging.INFO)
 
 app = Dash(__name__, suppress_callback_exceptions=True)
+
+
+@app.server.route("/db/pool")
+def database_pool_stats():
+    """
+    Reports the connection pool usage of the shared database engines.
+    """
+    return jsonify(pool_stats())
+
+
+@app.server.route("/cache/stats")
+def query_cache_stats():
+    """
+    Reports the size and hit/miss counters of the query result cache.
+    """
+    return jsonify(query_cache.stats())
+
+
+@app.server.after_request
+def remember_profile_flag(response):
+    """
+    Opening a page with ?profile=1 sets a profile cookie, so the callback
+    requests the page sends afterwards are profiled too (?profile=0 clears it).
+    """
+    flag = request.args.get(PROFILE_FLAG)
+    if flag is not None:
+        if is_requested(flag):
+            response.set_cookie(PROFILE_FLAG, "1", max_age=3600)
+        else:
+            response.delete_cookie(PROFILE_FLAG)
+    return response
+
+
+def profiled(name):
+    """
+    Decorator profiling a Dash callback when the request opted in through the
+    X-Profile header, the profile query flag or the profile cookie.
+    Goes below the @app.callback decorator.
+    :param name: Name of the stored profiles.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            requested = any(is_requested(value) for value in (
+                request.headers.get(PROFILE_HEADER),
+                request.args.get(PROFILE_FLAG),
+                request.cookies.get(PROFILE_FLAG)))
+            if not should_profile(requested):
+                return function(*args, **kwargs)
+            session = ProfileSession()
+            try:
+                return session.run(function, *args, **kwargs)
+            finally:
+                profile_store.save(session, name)
+        return wrapper
+    return decorator
+
+
+@app.server.route("/profiles")
+def list_profiles():
+    """
+    Lists the stored callback profiles, newest first.
+    """
+    return jsonify(profile_store.list())
+
+
+@app.server.route("/profiles/<profile_id>")
+def download_profile(profile_id):
+    """
+    Downloads a stored profile in pstats format.
+    """
+    path = profile_store.path(profile_id)
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype="application/octet-stream", as_attachment=True)
@@ -1,15 +1,17 @@
 from dash.dependencies import Input, Output, State
 from dash import dcc
 import dash
-import plotly.express as px
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
 import os
 from data_access import data_read
+from data_access.downsampling import downsample_series, DEFAULT_MAX_POINTS
+from data_access.query_cache import query_cache, data_versions
+from data_access.place_index import place_index, normalize
 import sys
 import dash_bootstrap_components as dbc
 from dash import dcc, html
-from app_init import app
+from app_init import app, profiled
 import requests
 
 app_layout = html.Div([
@@ -41,6 +43,8 @@ app_layout = html.Div([
                    }),
     ]),
     html.Div([], id="weather-output"),
+    dcc.Store(id="ingest-job"),
+    dcc.Interval(id="ingest-job-poller", interval=1000, disabled=True),
     html.Div([], style={'height': '50px'})
 ])
 
@@ -49,6 +53,7 @@ app_layout = html.Div([
     Output("place-selector", "options"),
     [Input("weather-output", "children")]
 )
+@profiled("refresh_place_dropdown")
 def refresh_place_dropdown(n_clicks):
     """
     Updates the dropdown options for place selection.
@@ -62,29 +67,74 @@ def refresh_place_dropdown(n_clicks):
     return [{"label": place, "value": place} for place in place_names]
 
 
+def visible_x_range(relayout_data):
+    """
+    Reads the visible x axis range from a graph's relayoutData.
+
+    :param relayout_data: The relayoutData of the graph.
+    :return: (start, end) of a zoomed window, (None, None) when the axis was reset
+             and None if the event did not change the x axis.
+    """
+    relayout_data = relayout_data or {}
+    if "xaxis.range[0]" in relayout_data and "xaxis.range[1]" in relayout_data:
+        return relayout_data["xaxis.range[0]"], relayout_data["xaxis.range[1]"]
+    if "xaxis.range" in relayout_data:
+        return tuple(relayout_data["xaxis.range"])
+    if relayout_data.get("xaxis.autorange"):
+        return None, None
+    return None
+
+
+def requested_window(graph_id, relayout_data):
+    """
+    Decides which date window a graph callback has to read.
+
+    :param graph_id: Id of the graph whose relayoutData is an input.
+    :param relayout_data: The relayoutData of the graph.
+    :return: (start, end) to read, None if the graph does not need updating.
+    """
+    if dash.callback_context.triggered_id != graph_id:
+        # A new place was selected, read its whole history
+        return None, None
+    return visible_x_range(relayout_data)
+
+
 @app.callback(
     Output("time-series-plot", "figure"),
-    Input("place-selector", "value"),
+    [Input("place-selector", "value"),
+     Input("time-series-plot", "relayoutData")],
     prevent_initial_call=True
 )
-def update_weather_graph(selected_place):
+@profiled("update_weather_graph")
+def update_weather_graph(selected_place, relayout_data=None):
     """
-    Updates the weather graph based on the selected place.
+    Updates the weather graph based on the selected place. The series are
+    downsampled to the graph width, zooming reads the visible window again
+    at a higher resolution.
 
     :param selected_place: The selected place name.
+    :param relayout_data: Zoom and pan events of the graph.
     :return: A line plot showing weather data over time.
     """
+    window = requested_window("time-series-plot", relayout_data)
+    if window is None or selected_place is None:
+        return dash.no_update
+
     connection_url = os.environ['DB_URL']
-    df = data_read.read_weather_data(connection_url, place_name=selected_place)
-    fig = px.line(
-        df,
-        x="date_id",
-        y="value",
-        color="measure",
-        title=f"Weather Data Over Time for {selected_place}"
-    )
+    series = data_read.read_weather_data(
+        connection_url, place_name=selected_place,
+        start_date=window[0], end_date=window[1])
+
+    fig = go.Figure([
+        go.Scatter(x=x, y=y, name=measure, mode="lines")
+        for measure, (x, y) in downsample_series(series, DEFAULT_MAX_POINTS).items()
+    ])
     fig.update_layout(
-        plot_bgcolor='white'
+        title=f"Weather Data Over Time for {selected_place}",
+        legend_title_text="measure",
+        plot_bgcolor='white',
+        # Keeps the zoom when the figure is replaced with a finer one
+        uirevision=selected_place
     )
 
     fig.update_xaxes(
@@ -107,44 +157,42 @@ def update_weather_graph(selected_place):
 
 @app.callback(
     Output("air-pollution-plot", "figure"),
-    Input("place-selector", "value"),
+    [Input("place-selector", "value"),
+     Input("air-pollution-plot", "relayoutData")],
     prevent_initial_call=True
 )
-def update_air_pollution_graph(selected_place):
+@profiled("update_air_pollution_graph")
+def update_air_pollution_graph(selected_place, relayout_data=None):
     """
-    Updates the air pollution graph for the selected place.
+    Updates the air pollution graph for the selected place, downsampled
+    like the weather graph.
 
     :param selected_place: The selected place name.
+    :param relayout_data: Zoom and pan events of the graph.
     :return: A line plot with secondary y-axis showing air pollution data.
     """
+    window = requested_window("air-pollution-plot", relayout_data)
+    if window is None or selected_place is None:
+        return dash.no_update
+
     connection_url = os.environ['DB_URL']
-    df = data_read.read_air_pollution_data(
-        connection_url, place_name=selected_place)
+    series = data_read.read_air_pollution_data(
+        connection_url, place_name=selected_place,
+        start_date=window[0], end_date=window[1])
 
     # Creating the figure with secondary y-axis
     fig = make_subplots(specs=[[{"secondary_y": True}]])
 
-    # Adding data for each measure
-    for measure in df['measure'].unique():
-        subset = df[df['measure'] == measure]
-        if measure == "carbon_dioxide":
-            fig.add_trace(
-                go.Scatter(
-                    x=subset["date_id"],
-                    y=subset["value"],
-                    name=measure
-                ),
-                secondary_y=True
-            )
-        else:
-            fig.add_trace(
-                go.Scatter(
-                    x=subset["date_id"],
-                    y=subset["value"],
-                    name=measure
-                ),
-                secondary_y=False
-            )
+    # Adding data for each measure, carbon dioxide goes on the secondary axis
+    for measure, (x, y) in downsample_series(series, DEFAULT_MAX_POINTS).items():
+        fig.add_trace(
+            go.Scatter(
+                x=x,
+                y=y,
+                name=measure
+            ),
+            secondary_y=measure == "carbon_dioxide"
+        )
 
     # Updating layout
     fig.update_layout(
@@ -152,7 +200,8 @@ def update_air_pollution_graph(selected_place):
         xaxis_title="Date",
         yaxis_title="Primary Measures (μg/m^3)",
         yaxis2_title="Carbon Dioxide (ppm)",
-        plot_bgcolor='white'
+        plot_bgcolor='white',
+        uirevision=selected_place
     )
 
     fig.update_xaxes(
@@ -173,59 +222,121 @@ def update_air_pollution_graph(selected_place):
 
 
 @app.callback(
-    Output("weather-output", "children"),
+    [Output("weather-output", "children"),
+     Output("ingest-job", "data"),
+     Output("ingest-job-poller", "disabled")],
     [Input("fetch-weather-btn", "n_clicks")],
     [State("place-name-selector", "value")]
 )
+@profiled("fetch_weather")
 def fetch_weather(n_clicks, selected_place_name):
     """
-    Fetches weather data for the selected place and displays it.
+    Submits an ingest job for the selected place to the API fetcher service.
 
     :param n_clicks: Number of times the 'Fetch Weather' button has been clicked.
     :param selected_place_name: The name of the selected place.
-    :return: A message indicating success or failure of the data fetch operation.
+    :return: A status message, the submitted job and whether the job polling is disabled.
     """
     if not n_clicks:
-        return "Select a place and click 'Fetch Weather'."
+        return "Select a place and click 'Fetch Weather'.", None, True
     if selected_place_name is None:
-        return "Please select a place."
+        return "Please select a place.", None, True
 
     connection_url = os.environ['DB_URL']
-    api_url = os.environ['API_FETCHER_URL'] + '/weather'
+    api_url = os.environ['API_FETCHER_URL'] + '/jobs'
     coords = data_read.get_coordinates_for_place_name(
         connection_url, selected_place_name)
     if coords.empty:
-        return "Coordinates not found for the selected place."
+        return "Coordinates not found for the selected place.", None, True
 
     lat, lon = float(coords['latitude'].values[0]), float(
         coords['longitude'].values[0])
 
     try:
         # Use the service name defined in docker-compose.yml for inter-container communication
-        response = requests.get(
-            api_url, params={'lat': lat,
-                             'lon': lon,
-                             "place_name": selected_place_name})
+        response = requests.post(
+            api_url, json={'lat': lat,
+                           'lon': lon,
+                           "place_name": selected_place_name},
+            timeout=10)
         response.raise_for_status()  # Raise an error for bad status codes
-        data = response.json()
-        return f"Weather Data: {data}"
+        job = response.json()
+        return f"Fetching weather data for {selected_place_name}...", job, False
     except requests.RequestException as e:
-        return f"Error fetching weather data: {str(e)}"
+        return f"Error fetching weather data: {str(e)}", None, True
+
+
+@app.callback(
+    [Output("weather-output", "children", allow_duplicate=True),
+     Output("ingest-job-poller", "disabled", allow_duplicate=True)],
+    [Input("ingest-job-poller", "n_intervals")],
+    [State("ingest-job", "data"),
+     State("weather-output", "children")],
+    prevent_initial_call=True
+)
+@profiled("poll_ingest_job")
+def poll_ingest_job(n_intervals, job, current_message):
+    """
+    Polls the status of the submitted ingest job until it finishes.
+
+    :param n_intervals: Number of times the poller fired.
+    :param job: The job returned on submission.
+    :param current_message: The message currently displayed.
+    :return: The job progress message and whether the polling is disabled.
+    """
+    if not job:
+        return dash.no_update, True
+
+    api_url = os.environ['API_FETCHER_URL'] + '/jobs/' + job['job_id']
+    try:
+        response = requests.get(api_url, timeout=10)
+        response.raise_for_status()
+        status = response.json()
+    except requests.RequestException as e:
+        return f"Error fetching weather data: {str(e)}", True
+
+    if status['status'] in ('done', 'failed'):
+        # The cached graphs of the place are stale now
+        query_cache.invalidate(status['place_name'])
+        data_versions.expire()
+        place_index.mark_stale()
+    if status['status'] == 'done':
+        return (f"Weather data for {status['place_name']} successfully saved "
+                f"({status['rows_saved']} rows)."), True
+    if status['status'] == 'failed':
+        return (f"Error fetching weather data for {status['place_name']}: "
+                f"failed steps {', '.join(status['failed_steps'])}."), True
+
+    message = (f"Fetching weather data for {status['place_name']}... "
+               f"{status['steps_done']}/{status['steps_total']} steps")
+    # Unchanged messages are not sent, the place list refreshes on every change
+    if message == current_message:
+        return dash.no_update, False
+    return message, False
 
 
 @app.callback(
     Output("place-name-selector", "options"),
     [Input("place-name-selector", "search_value")],
+    [State("place-name-selector", "value")],
     prevent_initial_call=False  # Prevents callback from running on app load
 )
-def populate_place_name_selector(search_value):
+@profiled("populate_place_name_selector")
+def populate_place_name_selector(search_value, selected_place_name=None):
     """
-    Populates the place name selector with options fetched from the database.
+    Populates the place name selector with the best matches of the search
+    from the in-memory place index.
 
     :param search_value: The current search value entered in the selector.
+    :param selected_place_name: The currently selected place, kept in the options.
     :return: A list of dictionaries containing label-value pairs for dropdown options.
     """
     connection_url = os.environ['DB_URL']
-    # Fetch unique place names from the database
-    place_names = data_read.get_unique_place_names(connection_url)
-    return [{"label": place_name, "value": place_name} for place_name in place_names]
+    place_names = place_index.search_places(connection_url, search_value)
+    if selected_place_name and selected_place_name not in place_names:
+        place_names = [selected_place_name] + place_names
+    # The dropdown filters the options on the client as well, the search text is
+    # added so accent insensitive and fuzzy matches are not hidden by it
+    return [{"label": place_name, "value": place_name,
+             "search": f"{place_name} {normalize(place_name)} {search_value or ''}"}
+            for place_name in place_names]
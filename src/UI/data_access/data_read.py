@@ -1,80 +1,260 @@
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import bindparam, text
+from common.schema import ROLLUPS, TABLE_MEASURES
+from common.storage import PARQUET_ROOT, STORAGE_BACKEND, ParquetStorage
+from data_access.downsampling import DEFAULT_MAX_POINTS
+from common.engine import get_engine
+from data_access.query_cache import cached_query
 
+# place_name -> place_id per database, ids never change once issued
+_place_ids = {}
 
-def read_weather_data(connection_url, place_name):
+# The time series are read from the Parquet datasets the API fetcher writes
+# when it stores them there. The rollups are only kept in PostgreSQL.
+parquet_storage = ParquetStorage(PARQUET_ROOT) if STORAGE_BACKEND == 'parquet' else None
+
+
+def get_place_id(connection_url, place_name):
     """
-    Reads historical and forecast weather data from the PostgreSQL db.
+    Resolves a place_name to its place_id, through a process wide cache.
 
     :param connection_url: Database URL (SQLAlchemy format).
     :param place_name: Name of the citry/villige we want to query.
-    :return: Pandas dataframe with the results.
+    :return: The place_id, None for unknown places.
+    """
+    cache = _place_ids.setdefault(connection_url, {})
+    if place_name not in cache:
+        query = text("SELECT place_id FROM places_data WHERE place_name = :place_name")
+        with get_engine(connection_url).connect() as connection:
+            place_id = connection.execute(
+                query, {'place_name': place_name}).scalar()
+        if place_id is None:
+            return None
+        cache[place_name] = place_id
+    return cache[place_name]
+
+
+GRANULARITY_DAYS = {'day': 1, 'week': 7, 'month': 30}
+# Source table -> (rollup table, granularities from finest to coarsest)
+ROLLUP_TABLES = {
+    table_name: (rollup_name, sorted(granularities, key=GRANULARITY_DAYS.get))
+    for table_name, (rollup_name, _, granularities) in ROLLUPS.items()
+}
+
+
+def read_extent(connection_url, table_name, place_name,
+                start_date=None, end_date=None):
     """
-    engine = create_engine(connection_url)
-
-    query = f"""
-        select
-        a.place_name,
-        a.date_id,
-        'past' as data_version,
-        t.*
-        from
-            daily_weather_data as a
-        cross join lateral (
-        values  (a.temperature_2m_cels, 'tempreture_2m_Cels'),
-                (a.rain_mm, 'rain_mm'),
-                (a.wind_speed_kmh, 'wind_speed_kmh')
-                )
-                        as t (Value,
-            measure)
-        where
-            a.place_name = '{place_name}'
-
-                UNION
-                
-                select a.place_name, a.date_id, 'fc' as data_version, t.*
-                from forecast_weather_data as a
-                cross join lateral (
-                values  (a.temperature_2m_cels, 'tempreture_2m_Cels'),
-                        (a.rain_mm, 'rain_mm'),
-                        (a.wind_speed_kmh, 'wind_speed_kmh')
-            )
-                    as t (Value, measure)
-        where a.place_name='{place_name}'
-            order by 1,2
-    """
-    return pd.read_sql(query, engine)
-
-
-def read_air_pollution_data(connection_url, place_name):
-    """
-    Reads air_pollution data from the PostgreSQL db.
+    Reads how many rows of a place a table holds in a range and their span.
 
     :param connection_url: Database URL (SQLAlchemy format).
+    :param table_name: Name of the time-series table.
     :param place_name: Name of the citry/villige we want to query.
-    :return: Pandas dataframe with the results.
+    :param start_date: Optional inclusive lower bound of date_id.
+    :param end_date: Optional exclusive upper bound of date_id.
+    :return: (row count, first date_id, last date_id), the dates are None without rows.
     """
+    conditions = ["place_id = :place_id"]
+    params = {'place_id': get_place_id(connection_url, place_name)}
+    if start_date is not None:
+        conditions.append("date_id >= :start_date")
+        params['start_date'] = pd.Timestamp(start_date).to_pydatetime()
+    if end_date is not None:
+        conditions.append("date_id < :end_date")
+        params['end_date'] = pd.Timestamp(end_date).to_pydatetime()
+
+    query = text(f"""
+        SELECT COUNT(*), MIN(date_id), MAX(date_id)
+        FROM {table_name}
+        WHERE {' AND '.join(conditions)}
+    """)
+    with get_engine(connection_url).connect() as connection:
+        return tuple(connection.execute(query, params).one())
 
-    engine = create_engine(connection_url)
 
-    query = f"""
-       select 
-       a.place_name, 
-       a.date_id, t.*
-       from air_quality_data as a
-        cross join lateral
-        (
-        values (a.pm10, 'pm10'),
-                (a.pm2_5, 'pm2_5'),
-                (a.carbon_dioxide , 'carbon_dioxide'),
-                (a.nitrogen_dioxide , 'nitrogen_dioxide'),
-                (a.sulphur_dioxide , 'sulphur_dioxide'),
-                (a.ozone , 'ozone')
-        ) as t (Value, measure)
-        where a.place_name='{place_name}'
-        order by 1,2
+def pick_granularity(table_name, row_count, first_date, last_date,
+                     max_points=DEFAULT_MAX_POINTS):
+    """
+    Picks the rollup of a table to read from: none while the raw rows fit in
+    max_points, otherwise the finest rollup whose buckets fit in it.
+
+    :param table_name: Name of the time-series table.
+    :param row_count: Number of rows of the place in the requested range.
+    :param first_date: First date_id of the place in the range.
+    :param last_date: Last date_id of the place in the range.
+    :param max_points: Number of points the graph shows.
+    :return: The granularity, None if the raw table has to be read.
     """
-    return pd.read_sql(query, engine)
+    if table_name not in ROLLUP_TABLES or row_count <= max_points:
+        return None
+    days = (pd.Timestamp(last_date) - pd.Timestamp(first_date)) / pd.Timedelta(days=1)
+    granularities = ROLLUP_TABLES[table_name][1]
+    for granularity in granularities:
+        if days / GRANULARITY_DAYS[granularity] < max_points:
+            return granularity
+    return granularities[-1]
+
+
+def read_rollup(connection_url, table_name, place_name, granularity,
+                measures=None, start_date=None, end_date=None):
+    """
+    Reads the bucket means of a place from the rollup of a table in wide format.
+
+    :param connection_url: Database URL (SQLAlchemy format).
+    :param table_name: Name of the source time-series table.
+    :param place_name: Name of the citry/villige we want to query.
+    :param granularity: 'day', 'week' or 'month'.
+    :param measures: Measure columns to read, defaults to all of the table.
+    :param start_date: Optional inclusive lower bound of the bucket start.
+    :param end_date: Optional exclusive upper bound of the bucket start.
+    :return: Dictionary of NumPy arrays like read_series, date_id is the bucket start.
+    """
+    measures = list(measures or TABLE_MEASURES[table_name])
+    unknown = set(measures) - set(TABLE_MEASURES[table_name])
+    if unknown:
+        raise ValueError(f"Unknown measures for {table_name}: {sorted(unknown)}")
+
+    conditions = ["place_id = :place_id", "granularity = :granularity"]
+    params = {'place_id': get_place_id(connection_url, place_name),
+              'granularity': granularity}
+    if start_date is not None:
+        conditions.append("bucket_start >= :start_date")
+        params['start_date'] = pd.Timestamp(start_date).to_pydatetime()
+    if end_date is not None:
+        conditions.append("bucket_start < :end_date")
+        params['end_date'] = pd.Timestamp(end_date).to_pydatetime()
+
+    query = text(f"""
+        SELECT bucket_start, {', '.join(f'{measure}_mean' for measure in measures)}
+        FROM {ROLLUP_TABLES[table_name][0]}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY bucket_start
+    """)
+    with get_engine(connection_url).connect() as connection:
+        frame = pd.read_sql(query, connection, params=params)
+    return _wide_arrays(frame, measures)
+
+
+def read_table(connection_url, table_name, place_name, measures=None,
+               start_date=None, end_date=None):
+    """
+    Reads a place's time series from the raw table while its rows in the range
+    fit in a graph, from the finest rollup that fits otherwise. The Parquet
+    backend has no rollups and is always read raw.
+
+    :param connection_url: Database URL (SQLAlchemy format).
+    :param table_name: Name of the time-series table.
+    :param place_name: Name of the citry/villige we want to query.
+    :param measures: Measure columns to read, defaults to all of the table.
+    :param start_date: Optional inclusive lower bound of date_id.
+    :param end_date: Optional exclusive upper bound of date_id.
+    :return: Dictionary of NumPy arrays like read_series.
+    """
+    granularity = None
+    if table_name in ROLLUP_TABLES and parquet_storage is None:
+        granularity = pick_granularity(table_name, *read_extent(
+            connection_url, table_name, place_name, start_date, end_date))
+    if granularity is None:
+        return read_series(connection_url, table_name, place_name,
+                           measures, start_date, end_date)
+    return read_rollup(connection_url, table_name, place_name, granularity,
+                       measures, start_date, end_date)
+
+
+def _wide_arrays(frame, measures):
+    """
+    Turns a frame of a date column followed by the measure columns into a
+    dictionary of NumPy arrays, converted a column at a time.
+    """
+    series = {'date_id': pd.to_datetime(frame.iloc[:, 0]).to_numpy(dtype='datetime64[ns]')}
+    for measure, column in zip(measures, frame.columns[1:]):
+        # None (NULL) becomes NaN in a float array
+        series[measure] = frame[column].to_numpy(dtype='float64', na_value=np.nan)
+    return series
+
+
+def read_series(connection_url, table_name, place_name, measures=None,
+                start_date=None, end_date=None):
+    """
+    Reads the time series of a place from one table in wide format.
+
+    :param connection_url: Database URL (SQLAlchemy format).
+    :param table_name: Name of the time-series table.
+    :param place_name: Name of the citry/villige we want to query.
+    :param measures: Measure columns to read, defaults to all of the table.
+    :param start_date: Optional inclusive lower bound of date_id.
+    :param end_date: Optional exclusive upper bound of date_id.
+    :return: Dictionary of NumPy arrays, 'date_id' (datetime64) and one float array per measure.
+    """
+    measures = list(measures or TABLE_MEASURES[table_name])
+    unknown = set(measures) - set(TABLE_MEASURES[table_name])
+    if unknown:
+        raise ValueError(f"Unknown measures for {table_name}: {sorted(unknown)}")
+
+    place_id = get_place_id(connection_url, place_name)
+    if parquet_storage is not None:
+        frame = parquet_storage.read(table_name, [] if place_id is None else [place_id],
+                                     measures, start_date, end_date)
+        return _wide_arrays(frame[['date_id', *measures]], measures)
+
+    conditions = ["place_id = :place_id"]
+    params = {'place_id': place_id}
+    if start_date is not None:
+        conditions.append("date_id >= :start_date")
+        params['start_date'] = pd.Timestamp(start_date).to_pydatetime()
+    if end_date is not None:
+        conditions.append("date_id < :end_date")
+        params['end_date'] = pd.Timestamp(end_date).to_pydatetime()
+
+    query = text(f"""
+        SELECT date_id, {', '.join(measures)}
+        FROM {table_name}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY date_id
+    """)
+    with get_engine(connection_url).connect() as connection:
+        frame = pd.read_sql(query, connection, params=params)
+    return _wide_arrays(frame, measures)
+
+
+@cached_query(get_place_id)
+def read_weather_data(connection_url, place_name, measures=None,
+                      start_date=None, end_date=None):
+    """
+    Reads historical and forecast weather data of a place, merged in time order.
+    Long historical ranges are read from the rollup, the forecast is always raw.
+
+    :param connection_url: Database URL (SQLAlchemy format).
+    :param place_name: Name of the citry/villige we want to query.
+    :param measures: Measure columns to read, defaults to all weather measures.
+    :param start_date: Optional inclusive lower bound of date_id.
+    :param end_date: Optional exclusive upper bound of date_id.
+    :return: Dictionary of NumPy arrays like read_series.
+    """
+    past, forecast = [read_table(connection_url, table_name, place_name,
+                                  measures, start_date, end_date)
+                      for table_name in ('daily_weather_data', 'forecast_weather_data')]
+    order = np.argsort(np.concatenate([past['date_id'], forecast['date_id']]),
+                       kind='stable')
+    return {key: np.concatenate([past[key], forecast[key]])[order] for key in past}
+
+
+@cached_query(get_place_id)
+def read_air_pollution_data(connection_url, place_name, measures=None,
+                            start_date=None, end_date=None):
+    """
+    Reads air_pollution data of a place, long ranges are read from the rollup.
+
+    :param connection_url: Database URL (SQLAlchemy format).
+    :param place_name: Name of the citry/villige we want to query.
+    :param measures: Measure columns to read, defaults to all air quality measures.
+    :param start_date: Optional inclusive lower bound of date_id.
+    :param end_date: Optional exclusive upper bound of date_id.
+    :return: Dictionary of NumPy arrays like read_series.
+    """
+    return read_table(connection_url, 'air_quality_data', place_name,
+                       measures, start_date, end_date)
 
 
 def get_unique_place_names_with_data(connection_url):
@@ -85,9 +265,22 @@ def get_unique_place_names_with_data(connection_url):
     :return: Pandas dataframe with the results.
     """
 
-    engine = create_engine(connection_url)
-    query = """SELECT DISTINCT place_name FROM daily_weather_data
-                ORDER BY place_name"""
+    engine = get_engine(connection_url)
+    if parquet_storage is not None:
+        place_ids = [int(place_id) for place_id in
+                     parquet_storage.place_ids('daily_weather_data')]
+        if not place_ids:
+            return np.array([], dtype=object)
+        query = text("""SELECT place_name FROM places_data
+                        WHERE place_id IN :place_ids
+                        ORDER BY place_name""").bindparams(
+            bindparam('place_ids', expanding=True))
+        df = pd.read_sql(query, engine, params={'place_ids': place_ids})
+        return df['place_name'].values
+
+    query = """SELECT p.place_name FROM places_data AS p
+                WHERE p.place_id IN (SELECT DISTINCT place_id FROM daily_weather_data)
+                ORDER BY p.place_name"""
     df = pd.read_sql(query, engine)
 
     return df['place_name'].values
@@ -101,7 +294,7 @@ def get_unique_place_names(connection_url):
     :return: Pandas dataframe with the results.
     """
 
-    engine = create_engine(connection_url)
+    engine = get_engine(connection_url)
     query = """SELECT DISTINCT place_name FROM places_data
                     ORDER BY place_name"""
 
@@ -119,7 +312,7 @@ def get_coordinates_for_place_name(connection_url, place_name):
     :return: Pandas dataframe with the results.
     """
 
-    engine = create_engine(connection_url)
-    query = f"SELECT latitude, longitude FROM places_data WHERE place_name = '{place_name}'"
+    engine = get_engine(connection_url)
+    query = text("SELECT latitude, longitude FROM places_data WHERE place_name = :place_name")
 
-    return pd.read_sql(query, engine)
+    return pd.read_sql(query, engine, params={'place_name': place_name})
@@ -0,0 +1,61 @@
+import numpy as np
+
+# Points kept per trace, roughly the pixel width of a graph
+DEFAULT_MAX_POINTS = 1000
+
+
+def lttb(x, y, threshold):
+    """
+    Downsamples a series with the Largest-Triangle-Three-Buckets algorithm,
+    which keeps the visual shape (peaks and dips) of the series.
+
+    :param x: NumPy array of x values (numbers or datetime64), sorted ascending.
+    :param y: NumPy array of y values without NaNs.
+    :param threshold: Number of points to keep.
+    :return: Indices of the kept points.
+    """
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+
+    x_values = x.astype('int64').astype('float64') \
+        if np.issubdtype(x.dtype, np.datetime64) else x.astype('float64')
+    # The first and last points are always kept, the rest is split into buckets
+    edges = np.linspace(1, length - 1, threshold - 1).astype(int)
+    indices = np.empty(threshold, dtype=int)
+    indices[0] = 0
+    indices[-1] = length - 1
+
+    selected = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else length
+        # Average of the next bucket is the third corner of the triangle
+        average_x = x_values[end:next_end].mean()
+        average_y = y[end:next_end].mean()
+        areas = np.abs(
+            (x_values[selected] - average_x) * (y[start:end] - y[selected]) -
+            (x_values[selected] - x_values[start:end]) * (average_y - y[selected]))
+        selected = start + int(np.argmax(areas))
+        indices[bucket + 1] = selected
+    return indices
+
+
+def downsample_series(series, max_points=DEFAULT_MAX_POINTS):
+    """
+    Downsamples every measure of a wide series independently.
+
+    :param series: Dictionary of NumPy arrays as returned by data_read.read_series.
+    :param max_points: Maximum number of points kept per measure.
+    :return: Dictionary of measure -> (x, y) NumPy arrays.
+    """
+    dates = series['date_id']
+    downsampled = {}
+    for measure, values in series.items():
+        if measure == 'date_id':
+            continue
+        valid = ~np.isnan(values)
+        x, y = dates[valid], values[valid]
+        indices = lttb(x, y, max_points)
+        downsampled[measure] = (x[indices], y[indices])
+    return downsampled
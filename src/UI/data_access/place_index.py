@@ -0,0 +1,134 @@
+import bisect
+import os
+import threading
+import time
+import unicodedata
+from collections import Counter
+from data_access import data_read
+
+# Number of places offered for a search
+DEFAULT_TOP_K = 20
+# Seconds after which the place names are read again
+PLACE_INDEX_TTL_SECONDS = float(os.environ.get('PLACE_INDEX_TTL_SECONDS', 3600))
+
+
+def normalize(text):
+    """
+    Lower cases a name and strips its accents ("Székesfehérvár" -> "szekesfehervar").
+
+    :param text: Text to normalize.
+    :return: Normalized text.
+    """
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(char for char in decomposed
+                   if not unicodedata.combining(char)).casefold()
+
+
+def trigrams(text):
+    """
+    :param text: Normalized text.
+    :return: Set of the character trigrams of the padded text.
+    """
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PlaceIndex:
+    """
+    In-memory search index of the place names, matching accent insensitive
+    prefixes first, then substrings and finally similar names by trigrams.
+    """
+
+    def __init__(self, place_names=()):
+        """
+        :param place_names: Place names to index.
+        """
+        self.build(place_names)
+
+    def build(self, place_names):
+        """
+        Replaces the indexed place names.
+
+        :param place_names: Place names to index.
+        """
+        entries = sorted((normalize(name), name) for name in set(place_names))
+        trigram_index = {}
+        for position, (normalized, _) in enumerate(entries):
+            for trigram in trigrams(normalized):
+                trigram_index.setdefault(trigram, []).append(position)
+        # Swapped in one assignment, searches running meanwhile see a whole index
+        self.entries, self.keys, self.trigram_index = \
+            entries, [normalized for normalized, _ in entries], trigram_index
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, query, top_k=DEFAULT_TOP_K):
+        """
+        :param query: Text typed by the user.
+        :param top_k: Maximum number of names returned.
+        :return: List of matching place names, best matches first.
+        """
+        entries, keys, trigram_index = self.entries, self.keys, self.trigram_index
+        query = normalize(query or '').strip()
+        if not query:
+            return [name for _, name in entries[:top_k]]
+
+        # Prefix matches are a contiguous range of the sorted keys
+        start = bisect.bisect_left(keys, query)
+        matches = []
+        for position in range(start, len(keys)):
+            if not keys[position].startswith(query) or len(matches) == top_k:
+                break
+            matches.append(position)
+        if len(matches) < top_k:
+            seen = set(matches)
+            matches.extend(position for position, key in enumerate(keys)
+                           if query in key and position not in seen)
+        if len(matches) < top_k and len(query) >= 3:
+            seen = set(matches)
+            shared = Counter(position for trigram in trigrams(query)
+                             for position in trigram_index.get(trigram, ()))
+            similar = [position for position, _ in shared.most_common()
+                       if position not in seen]
+            matches.extend(similar[:top_k - len(matches)])
+        return [entries[position][1] for position in matches[:top_k]]
+
+
+class RefreshingPlaceIndex(PlaceIndex):
+    """
+    PlaceIndex of the places_data table, read once and again after a time
+    to live or when marked stale.
+    """
+
+    def __init__(self, ttl_seconds: float = PLACE_INDEX_TTL_SECONDS):
+        """
+        :param ttl_seconds: Seconds after which the place names are read again.
+        """
+        super().__init__()
+        self.ttl_seconds = ttl_seconds
+        self.expires = 0
+        self.lock = threading.Lock()
+
+    def mark_stale(self):
+        """
+        Makes the next search read the place names again.
+        """
+        self.expires = 0
+
+    def search_places(self, connection_url, query, top_k=DEFAULT_TOP_K):
+        """
+        :param connection_url: Database URL (SQLAlchemy format).
+        :param query: Text typed by the user.
+        :param top_k: Maximum number of names returned.
+        :return: List of matching place names, best matches first.
+        """
+        if time.monotonic() >= self.expires:
+            with self.lock:
+                if time.monotonic() >= self.expires:
+                    self.build(data_read.get_unique_place_names(connection_url))
+                    self.expires = time.monotonic() + self.ttl_seconds
+        return self.search(query, top_k)
+
+
+place_index = RefreshingPlaceIndex()
@@ -0,0 +1,174 @@
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+import requests
+
+# Cache sizing, results are dictionaries of NumPy arrays of one place
+CACHE_MAX_ENTRIES = int(os.environ.get('QUERY_CACHE_MAX_ENTRIES', 256))
+CACHE_TTL_SECONDS = float(os.environ.get('QUERY_CACHE_TTL_SECONDS', 3600))
+# How long the data versions reported by the API fetcher are reused
+VERSION_TTL_SECONDS = float(os.environ.get('DATA_VERSION_TTL_SECONDS', 5))
+# Time to live of results read while the data versions are unknown
+UNVERSIONED_TTL_SECONDS = float(os.environ.get('QUERY_CACHE_UNVERSIONED_TTL_SECONDS', 5))
+
+
+class QueryCache:
+    """
+    Thread safe LRU cache with a time to live for query results of places.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = CACHE_TTL_SECONDS):
+        """
+        :param max_entries: Number of results kept, the least recently used go first.
+        :param ttl_seconds: Seconds a result is served after it was stored.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        :param key: Cache key, its first element is the place name.
+        :return: The cached value, None on a miss.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, ttl_seconds: float = None):
+        """
+        :param key: Cache key, its first element is the place name.
+        :param value: Result to cache.
+        :param ttl_seconds: Seconds the result is served, defaults to the cache's time to live.
+        """
+        ttl_seconds = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl_seconds, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, place_name):
+        """
+        Drops every cached result of a place.
+        :param place_name: Name of the place.
+        """
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == place_name]:
+                del self.entries[key]
+
+    def stats(self):
+        """
+        :return: Dictionary of the cache size and hit/miss counters.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else None,
+            }
+
+
+class DataVersions:
+    """
+    Per place data versions reported by the API fetcher service, which bumps
+    them whenever it saves new rows of a place.
+    """
+
+    def __init__(self, ttl_seconds: float = VERSION_TTL_SECONDS):
+        """
+        :param ttl_seconds: Seconds the fetched versions are reused.
+        """
+        self.ttl_seconds = ttl_seconds
+        self.versions = None
+        self.expires = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def fetch():
+        """
+        :return: The versions reported by the API fetcher, None if it is unreachable.
+        """
+        try:
+            response = requests.get(
+                os.environ['API_FETCHER_URL'] + '/data-versions', timeout=2)
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, KeyError, ValueError):
+            return None
+
+    def get(self, place_id):
+        """
+        :param place_id: Id of the place.
+        :return: Hashable version of the place's data, None if the fetcher is unreachable.
+        """
+        with self.lock:
+            refresh = time.monotonic() >= self.expires
+            if refresh:
+                # One caller fetches, the others go on with the versions they have
+                self.expires = time.monotonic() + self.ttl_seconds
+            versions = self.versions
+        if refresh:
+            versions = self.fetch()
+            with self.lock:
+                self.versions = versions
+        if versions is None:
+            return None
+        return (versions['boot_id'], versions['versions'].get(str(place_id), 0))
+
+    def expire(self):
+        """
+        Forces the next lookup to fetch the versions again.
+        """
+        with self.lock:
+            self.expires = 0
+
+
+query_cache = QueryCache()
+data_versions = DataVersions()
+
+
+def cached_query(place_id_lookup):
+    """
+    Caches the results of a read function whose first two arguments are the
+    connection URL and the place name. The key contains the place's data version,
+    results read while the version is unknown are only kept for a few seconds.
+
+    :param place_id_lookup: Function resolving (connection_url, place_name) to a place_id.
+    :return: Decorator.
+    """
+    def decorator(read_function):
+        @functools.wraps(read_function)
+        def wrapper(connection_url, place_name, *args, **kwargs):
+            version = data_versions.get(place_id_lookup(connection_url, place_name))
+            key = (place_name, read_function.__name__, connection_url, args,
+                   tuple(sorted((name, tuple(value) if isinstance(value, list) else value)
+                                for name, value in kwargs.items())),
+                   version)
+            result = query_cache.get(key)
+            if result is None:
+                result = read_function(connection_url, place_name, *args, **kwargs)
+                query_cache.put(key, result,
+                                UNVERSIONED_TTL_SECONDS if version is None else None)
+            return result
+        return wrapper
+    return decorator
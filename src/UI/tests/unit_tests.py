@@ -0,0 +1,329 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from common.engine import dispose_engines, get_engine
+from data_access import data_read
+from data_access.downsampling import downsample_series, lttb
+from data_access.place_index import PlaceIndex, normalize
+from data_access.query_cache import DataVersions, QueryCache, cached_query, \
+    UNVERSIONED_TTL_SECONDS
+
+
+class TestDownsampling(unittest.TestCase):
+    """
+    Unit tests for the Largest-Triangle-Three-Buckets downsampling.
+    """
+
+    def test_lttb_keeps_threshold_points_in_order(self):
+        """
+        The first and last points are kept and exactly threshold indices are
+        returned in increasing order.
+        """
+        x = np.arange(1000)
+        y = np.sin(x / 20)
+
+        indices = lttb(x, y, 50)
+
+        self.assertEqual(len(indices), 50)
+        self.assertEqual(indices[0], 0)
+        self.assertEqual(indices[-1], 999)
+        self.assertTrue(np.all(np.diff(indices) > 0))
+
+    def test_lttb_keeps_peaks_and_dips(self):
+        """
+        A single spike and a single dip of a flat series survive downsampling.
+        """
+        x = np.arange(500)
+        y = np.zeros(500)
+        y[123] = 50
+        y[321] = -50
+
+        indices = lttb(x, y, 20)
+
+        self.assertIn(123, indices)
+        self.assertIn(321, indices)
+
+    def test_lttb_supports_datetime_x(self):
+        """
+        datetime64 x values are downsampled like numbers.
+        """
+        x = np.arange('2024-06-03', '2025-06-03', dtype='datetime64[D]').astype('datetime64[ns]')
+        y = np.cos(np.arange(len(x)) / 10)
+
+        indices = lttb(x, y, 100)
+
+        self.assertEqual(len(indices), 100)
+        self.assertEqual(indices[-1], len(x) - 1)
+
+    def test_lttb_returns_short_series_whole(self):
+        """
+        Series of at most threshold points, or thresholds below 3, are kept whole.
+        """
+        x = np.arange(10)
+        y = np.arange(10, dtype='float64')
+
+        np.testing.assert_array_equal(lttb(x, y, 10), np.arange(10))
+        np.testing.assert_array_equal(lttb(x, y, 50), np.arange(10))
+        np.testing.assert_array_equal(lttb(x, y, 2), np.arange(10))
+        np.testing.assert_array_equal(lttb(x[:0], y[:0], 10), np.arange(0))
+
+    def test_downsample_series_skips_missing_values(self):
+        """
+        Every measure is downsampled on its own, without its NaN values.
+        """
+        dates = np.arange('2024-06-03', '2024-06-13', dtype='datetime64[D]').astype('datetime64[ns]')
+        rain = np.arange(10, dtype='float64')
+        rain[[2, 5]] = np.nan
+        series = {'date_id': dates, 'rain_mm': rain, 'wind_speed_kmh': np.ones(10)}
+
+        downsampled = downsample_series(series, max_points=5)
+
+        x, y = downsampled['rain_mm']
+        self.assertEqual(len(x), 5)
+        self.assertFalse(np.isnan(y).any())
+        self.assertEqual(x[0], dates[0])
+        self.assertEqual(x[-1], dates[-1])
+        self.assertEqual(len(downsampled['wind_speed_kmh'][0]), 5)
+
+
+class TestPlaceIndex(unittest.TestCase):
+    """
+    Unit tests for the PlaceIndex search.
+    """
+
+    def setUp(self):
+        self.index = PlaceIndex([
+            "Budapest", "Debrecen", "Eger", "Egerszalók", "Hódmezővásárhely",
+            "Nagyszékely", "Pécs", "Szeged", "Székesfehérvár", "Vásárosnamény"])
+
+    def test_normalize_strips_accents_and_case(self):
+        """
+        Names are compared lower cased and without their accents.
+        """
+        self.assertEqual(normalize("Hódmezővásárhely"), "hodmezovasarhely")
+
+    def test_search_matches_prefixes_accent_insensitively(self):
+        """
+        Prefixes typed without accents or in another case match first.
+        """
+        self.assertEqual(self.index.search("SZEKE")[0], "Székesfehérvár")
+        self.assertEqual(self.index.search("pec"), ["Pécs"])
+
+    def test_search_ranks_prefixes_before_substrings(self):
+        """
+        Names starting with the query come before names containing it.
+        """
+        results = self.index.search("vasar")
+
+        self.assertEqual(results[:2], ["Vásárosnamény", "Hódmezővásárhely"])
+
+    def test_search_ranks_substrings_before_similar_names(self):
+        """
+        Substring matches come before the names found by trigrams.
+        """
+        results = self.index.search("szek")
+
+        self.assertEqual(results[:2], ["Székesfehérvár", "Nagyszékely"])
+
+    def test_search_finds_misspelled_names_by_trigrams(self):
+        """
+        A misspelled name still finds the place sharing most of its trigrams.
+        """
+        self.assertEqual(self.index.search("Debrecn")[0], "Debrecen")
+        self.assertEqual(self.index.search("Budapset")[0], "Budapest")
+
+    def test_search_limits_the_results(self):
+        """
+        At most top_k names are returned, the best ones first.
+        """
+        self.assertEqual(self.index.search("ege", top_k=2), ["Eger", "Egerszalók"])
+        self.assertEqual(len(self.index.search("", top_k=3)), 3)
+        self.assertEqual(len(self.index.search("")), 10)
+
+    def test_search_without_matches(self):
+        """
+        Short queries without a prefix or substring match return nothing.
+        """
+        self.assertEqual(self.index.search("xq"), [])
+
+
+class TestQueryCache(unittest.TestCase):
+    """
+    Unit tests for the QueryCache class and the cached_query decorator.
+    """
+
+    def test_evicts_least_recently_used(self):
+        """
+        Above max_entries the least recently used result is dropped.
+        """
+        cache = QueryCache(max_entries=2)
+        cache.put(("Eger", "a"), 1)
+        cache.put(("Pécs", "a"), 2)
+        cache.get(("Eger", "a"))
+        cache.put(("Szeged", "a"), 3)
+
+        self.assertIsNone(cache.get(("Pécs", "a")))
+        self.assertEqual(cache.get(("Eger", "a")), 1)
+        self.assertEqual(cache.get(("Szeged", "a")), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    @patch('data_access.query_cache.time.monotonic')
+    def test_expires_after_the_time_to_live(self, monotonic):
+        """
+        Results are served until their time to live passes.
+        """
+        monotonic.return_value = 100
+        cache = QueryCache(ttl_seconds=60)
+        cache.put(("Eger", "a"), 1)
+        cache.put(("Eger", "b"), 2, ttl_seconds=5)
+
+        monotonic.return_value = 110
+        self.assertEqual(cache.get(("Eger", "a")), 1)
+        self.assertIsNone(cache.get(("Eger", "b")))
+
+        monotonic.return_value = 161
+        self.assertIsNone(cache.get(("Eger", "a")))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_cached_query_misses_after_the_data_version_changes(self):
+        """
+        A new data version of the place makes the next read go to the database.
+        """
+        versions = DataVersions(ttl_seconds=0)
+        versions.fetch = MagicMock(side_effect=[
+            {'boot_id': 'boot', 'versions': {'7': 1}},
+            {'boot_id': 'boot', 'versions': {'7': 1}},
+            {'boot_id': 'boot', 'versions': {'7': 2}},
+        ])
+        read = MagicMock(side_effect=["first", "second"])
+        read.__name__ = "read"
+        cached_read = cached_query(lambda connection_url, place_name: 7)(read)
+
+        with patch('data_access.query_cache.query_cache', QueryCache()), \
+                patch('data_access.query_cache.data_versions', versions):
+            self.assertEqual(cached_read("sqlite://", "Eger"), "first")
+            self.assertEqual(cached_read("sqlite://", "Eger"), "first")
+            self.assertEqual(cached_read("sqlite://", "Eger"), "second")
+
+        self.assertEqual(read.call_count, 2)
+
+    @patch('data_access.query_cache.time.monotonic')
+    def test_cached_query_keeps_unversioned_results_briefly(self, monotonic):
+        """
+        Results read while the API fetcher is unreachable expire quickly.
+        """
+        monotonic.return_value = 100
+        versions = DataVersions()
+        versions.fetch = MagicMock(return_value=None)
+        read = MagicMock(side_effect=["first", "second"])
+        read.__name__ = "read"
+        cached_read = cached_query(lambda connection_url, place_name: 7)(read)
+
+        with patch('data_access.query_cache.query_cache', QueryCache()), \
+                patch('data_access.query_cache.data_versions', versions):
+            self.assertEqual(cached_read("sqlite://", "Eger"), "first")
+            monotonic.return_value = 100 + UNVERSIONED_TTL_SECONDS + 1
+            versions.expire()
+            self.assertEqual(cached_read("sqlite://", "Eger"), "second")
+
+
+class TestRollupReads(unittest.TestCase):
+    """
+    Unit tests for the choice between the raw tables and their rollups,
+    against a temporary SQLite database.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.connection_url = f"sqlite:///{os.path.join(self.directory.name, 'ui.db')}"
+        with get_engine(self.connection_url).begin() as connection:
+            connection.execute(text(
+                "CREATE TABLE places_data (place_id INTEGER, place_name TEXT)"))
+            connection.execute(text(
+                "INSERT INTO places_data VALUES (1, 'Eger'), (2, 'Pécs')"))
+            connection.execute(text("""
+                CREATE TABLE daily_weather_data (place_id INTEGER, date_id TIMESTAMP,
+                    temperature_2m_cels FLOAT, rain_mm FLOAT, wind_speed_kmh FLOAT)"""))
+            connection.execute(text("""
+                CREATE TABLE daily_weather_rollup (place_id INTEGER, granularity TEXT,
+                    bucket_start TIMESTAMP, temperature_2m_cels_mean FLOAT,
+                    rain_mm_mean FLOAT, wind_speed_kmh_mean FLOAT)"""))
+            # Eger has 5 days of rows, Pécs more days than a graph shows
+            days = pd.date_range('2024-06-03', periods=1100, freq='D')
+            connection.execute(text("""
+                INSERT INTO daily_weather_data VALUES (:place_id, :date_id, :value, NULL, 1.0)
+            """), [{'place_id': place_id, 'date_id': day.to_pydatetime(), 'value': float(i)}
+                   for place_id, count in ((1, 5), (2, 1100))
+                   for i, day in enumerate(days[:count])])
+            connection.execute(text("""
+                INSERT INTO daily_weather_rollup VALUES (:place_id, 'week', :bucket_start,
+                                                         -1.0, 0.5, 1.0)
+            """), [{'place_id': place_id, 'bucket_start': week.to_pydatetime()}
+                   for place_id in (1, 2)
+                   for week in pd.date_range('2024-06-03', periods=158, freq='W-MON')])
+
+    def tearDown(self):
+        dispose_engines()
+        self.directory.cleanup()
+
+    def test_pick_granularity_per_extent(self):
+        """
+        The raw table is read while its rows fit, otherwise the finest rollup
+        whose buckets fit and the coarsest one beyond that.
+        """
+        pick = data_read.pick_granularity
+        self.assertIsNone(pick('daily_weather_data', 1000, '2021-01-01', '2023-09-27'))
+        self.assertIsNone(pick('forecast_weather_data', 5000, '2024-06-03', '2024-12-01'))
+        self.assertEqual(pick('air_quality_data', 2000, '2024-06-03', '2024-08-26'), 'day')
+        self.assertEqual(pick('daily_weather_data', 1100, '2021-06-03', '2024-06-06'), 'week')
+        self.assertEqual(pick('air_quality_data', 48000, '2019-01-01', '2024-06-03'), 'week')
+        self.assertEqual(pick('daily_weather_data', 8000, '2000-01-01', '2021-11-25'), 'month')
+        self.assertEqual(pick('daily_weather_data', 40000, '1900-01-01', '2009-07-03'), 'month')
+        self.assertEqual(pick('daily_weather_data', 20, '2024-06-03', '2024-06-23',
+                              max_points=10), 'week')
+
+    def test_read_table_falls_back_to_the_raw_rows(self):
+        """
+        A place whose rows fit the graph is read from the raw table.
+        """
+        series = data_read.read_table(self.connection_url, 'daily_weather_data', 'Eger')
+
+        np.testing.assert_array_equal(series['temperature_2m_cels'], [0, 1, 2, 3, 4])
+        self.assertTrue(np.isnan(series['rain_mm']).all())
+        self.assertEqual(series['date_id'].dtype, np.dtype('datetime64[ns]'))
+        self.assertEqual(series['date_id'][0], np.datetime64('2024-06-03'))
+
+    def test_read_table_reads_the_rollup_of_long_ranges(self):
+        """
+        A place with more rows than the graph shows is read from the weekly rollup.
+        """
+        series = data_read.read_table(self.connection_url, 'daily_weather_data', 'Pécs')
+
+        self.assertEqual(len(series['date_id']), 158)
+        self.assertTrue((series['temperature_2m_cels'] == -1).all())
+
+    def test_read_table_filters_the_range(self):
+        """
+        The date range limits the rows counted for the choice and the rows read.
+        """
+        series = data_read.read_table(self.connection_url, 'daily_weather_data', 'Pécs',
+                                      ['temperature_2m_cels'], '2024-07-01', '2024-07-11')
+
+        self.assertEqual(list(series), ['date_id', 'temperature_2m_cels'])
+        np.testing.assert_array_equal(series['temperature_2m_cels'], np.arange(28, 38))
+
+    def test_read_rollup_rejects_unknown_measures(self):
+        """
+        Only the measures of the table can be read.
+        """
+        with self.assertRaises(ValueError):
+            data_read.read_rollup(self.connection_url, 'daily_weather_data', 'Eger',
+                                  'week', ['pm10'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import threading
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+# Pool settings, shared by every engine of the process
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(connection_url):
+    """
+    Returns the process wide pooled engine for a connection URL,
+    creating it on first use.
+    :param connection_url: Database URL (SQLAlchemy format).
+    :return: SQLAlchemy engine object.
+    """
+    engine = _engines.get(connection_url)
+    if engine is not None:
+        return engine
+
+    with _engines_lock:
+        if connection_url not in _engines:
+            pool_options = {'pool_pre_ping': POOL_PRE_PING,
+                            'pool_recycle': POOL_RECYCLE}
+            # In-memory SQLite uses a single connection pool without sizing
+            if make_url(connection_url).database not in (None, '', ':memory:'):
+                pool_options.update(pool_size=POOL_SIZE,
+                                    max_overflow=MAX_OVERFLOW)
+            _engines[connection_url] = create_engine(
+                connection_url, **pool_options)
+        return _engines[connection_url]
+
+
+def pool_stats():
+    """
+    Reports the connection pool usage of every registered engine.
+    :return: Dictionary keyed by the password masked URL of each engine.
+    """
+    stats = {}
+    for connection_url, engine in list(_engines.items()):
+        pool = engine.pool
+        counters = {}
+        for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+            # Not every pool class keeps every counter
+            counter = getattr(pool, name, None)
+            counters[name] = counter() if callable(counter) else None
+        stats[make_url(connection_url).render_as_string(hide_password=True)] = {
+            'pool': type(pool).__name__,
+            'size': counters['size'],
+            'checked_in': counters['checkedin'],
+            'checked_out': counters['checkedout'],
+            'overflow': counters['overflow'],
+        }
+    return stats
+
+
+def dispose_engines():
+    """
+    Closes the pooled connections of every registered engine and forgets them.
+    """
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
@@ -0,0 +1,186 @@
+import pandas as pd
+from sqlalchemy import text
+
+# The fact tables are range partitioned by month of date_id on PostgreSQL. The
+# DB service creates the partitions up to a few months ahead, the API fetcher
+# service creates the missing ones before it writes. Rows outside every monthly
+# partition land in the <table>_default partition.
+
+
+def partition_name(table_name, month):
+    """
+    :param table_name: Name of the partitioned table.
+    :param month: pandas Period of the month.
+    :return: Name of the partition of the month, e.g. daily_weather_data_p202406.
+    """
+    return f"{table_name}_p{month.strftime('%Y%m')}"
+
+
+def is_partitioned(connection, table_name):
+    """
+    :param connection: SQLAlchemy connection to a PostgreSQL database.
+    :param table_name: Name of the table.
+    :return: Whether the table is a partitioned table.
+    """
+    return connection.execute(text("""
+        SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table_name)
+    """), {'table_name': table_name}).scalar() is not None
+
+
+def existing_partitions(connection, table_name):
+    """
+    :param connection: SQLAlchemy connection to a PostgreSQL database.
+    :param table_name: Name of the partitioned table.
+    :return: Set of the names of the attached partitions.
+    """
+    return set(connection.execute(text("""
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass(:table_name)
+    """), {'table_name': table_name}).scalars())
+
+
+def create_partition(connection, table_name, month, existing=None):
+    """
+    Creates the partition of a month. Rows of the month caught by the default
+    partition are moved into it before it is attached.
+
+    :param connection: SQLAlchemy connection in a transaction.
+    :param table_name: Name of the partitioned table.
+    :param month: pandas Period of the month.
+    :param existing: Names of the attached partitions, read from the database if None.
+    """
+    if existing is None:
+        existing = existing_partitions(connection, table_name)
+    name = partition_name(table_name, month)
+    start = month.start_time.strftime('%Y-%m-%d')
+    end = (month + 1).start_time.strftime('%Y-%m-%d')
+    connection.execute(text(
+        f'CREATE TABLE IF NOT EXISTS "{name}" (LIKE "{table_name}" INCLUDING DEFAULTS)'))
+    if f'{table_name}_default' in existing:
+        connection.execute(text(f"""
+            WITH moved AS (
+                DELETE FROM "{table_name}_default"
+                WHERE date_id >= '{start}' AND date_id < '{end}'
+                RETURNING *)
+            INSERT INTO "{name}" SELECT * FROM moved
+        """))
+    connection.execute(text(
+        f'ALTER TABLE "{table_name}" ATTACH PARTITION "{name}" '
+        f"FOR VALUES FROM ('{start}') TO ('{end}')"))
+    print(f"Partition '{name}' created.")
+
+
+def create_partitions(connection, table_name, months, default=False):
+    """
+    Creates the missing monthly partitions of a table. Callers creating
+    partitions of the same table at the same time take turns.
+
+    :param connection: SQLAlchemy connection in a transaction.
+    :param table_name: Name of the partitioned table.
+    :param months: pandas Periods of the months.
+    :param default: Create the default partition as well if it is missing.
+    :return: Number of partitions created, None if the table is not partitioned.
+    """
+    connection.execute(text("SELECT pg_advisory_xact_lock(hashtext(:table_name))"),
+                       {'table_name': table_name})
+    if not is_partitioned(connection, table_name):
+        return None
+    existing = existing_partitions(connection, table_name)
+    created = 0
+    for month in months:
+        if partition_name(table_name, month) not in existing:
+            create_partition(connection, table_name, month, existing)
+            created += 1
+    if default and f'{table_name}_default' not in existing:
+        connection.execute(text(
+            f'CREATE TABLE "{table_name}_default" PARTITION OF "{table_name}" DEFAULT'))
+        print(f"Partition '{table_name}_default' created.")
+        created += 1
+    return created
+
+
+def migrate_to_partitions(engine, table, first_month, last_month):
+    """
+    Moves a fact table of an existing PostgreSQL database into a table range
+    partitioned by month, in one transaction: the old table is renamed, the
+    partitioned table created with partitions for all of its months and the
+    rows copied over. Rows left behind in <table>_unpartitioned by an
+    interrupted migration are copied over as well.
+
+    :param engine: SQLAlchemy engine object.
+    :param table: SQLAlchemy table, defined with postgresql_partition_by.
+    :param first_month: pandas Period of the first month to create a partition for.
+    :param last_month: pandas Period of the last month to create a partition for.
+    :return: Number of rows copied.
+    """
+    old_name = f'{table.name}_unpartitioned'
+    columns = ', '.join(f'"{column.name}"' for column in table.columns)
+    with engine.begin() as connection:
+        connection.execute(text("SELECT pg_advisory_xact_lock(hashtext(:table_name))"),
+                           {'table_name': table.name})
+        leftover = connection.execute(text("SELECT to_regclass(:name)"),
+                                      {'name': old_name}).scalar() is not None
+        if is_partitioned(connection, table.name):
+            if not leftover:
+                return 0
+        else:
+            connection.execute(text(f'ALTER TABLE "{table.name}" RENAME TO "{old_name}"'))
+            # The index names are reused by the partitioned table
+            for index in table.indexes:
+                connection.execute(text(f'DROP INDEX IF EXISTS "{index.name}"'))
+            table.create(connection)
+
+        first_date = connection.execute(
+            text(f'SELECT MIN(date_id) FROM "{old_name}"')).scalar()
+        if first_date is not None:
+            first_month = min(first_month, pd.Period(first_date, freq='M'))
+        create_partitions(connection, table.name,
+                          pd.period_range(first_month, last_month, freq='M'), default=True)
+        copied = connection.execute(text(f"""
+            INSERT INTO "{table.name}" ({columns})
+            SELECT {columns} FROM "{old_name}"
+            ON CONFLICT DO NOTHING
+        """)).rowcount
+        connection.execute(text(f'DROP TABLE "{old_name}"'))
+    print(f"Table '{table.name}' migrated to monthly partitions, {copied} rows copied.")
+    return copied
+
+
+def detach_partition(connection, table_name, month, drop=False):
+    """
+    Detaches the partition of a month from its table, a catalog change that
+    does not touch the rows. The detached table can be archived or dropped.
+
+    :param connection: SQLAlchemy connection in a transaction.
+    :param table_name: Name of the partitioned table.
+    :param month: pandas Period of the month.
+    :param drop: Drop the detached table as well.
+    """
+    name = partition_name(table_name, month)
+    connection.execute(text(f'ALTER TABLE "{table_name}" DETACH PARTITION "{name}"'))
+    if drop:
+        connection.execute(text(f'DROP TABLE "{name}"'))
+    print(f"Partition '{name}' {'dropped' if drop else 'detached'}.")
+
+
+def drop_partitions_before(connection, table_name, month):
+    """
+    Drops the partitions of the months before the given one, retention
+    without a DELETE scanning the table.
+
+    :param connection: SQLAlchemy connection in a transaction.
+    :param table_name: Name of the partitioned table.
+    :param month: pandas Period of the first month to keep.
+    :return: Number of dropped partitions.
+    """
+    dropped = 0
+    for name in sorted(existing_partitions(connection, table_name)):
+        suffix = name[len(table_name) + 2:]
+        if not name.startswith(f'{table_name}_p') or not suffix.isdigit():
+            continue  # the default partition
+        partition_month = pd.Period(f'{suffix[:4]}-{suffix[4:]}', freq='M')
+        if partition_month < month:
+            detach_partition(connection, table_name, partition_month, drop=True)
+            dropped += 1
+    return dropped
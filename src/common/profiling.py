@@ -0,0 +1,157 @@
+import cProfile
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+
+# Profiling is opt-in per request (X-Profile header or profile query flag) and
+# only honoured when enabled for the service. PROFILE_SAMPLE_RATE is the share
+# of the opted-in requests that are actually profiled.
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 1.0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+# Number of profiles kept on disk, the oldest ones are deleted first
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 50))
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_FLAG = "profile"
+PROFILE_SUFFIX = ".prof"
+
+logger = logging.getLogger(__name__)
+
+
+def is_requested(value):
+    """
+    :param value: Value of the profile header, query flag or cookie, None if missing.
+    :return: Whether the value asks for a profile.
+    """
+    return value is not None and str(value).lower() in ("1", "true", "yes")
+
+
+def should_profile(requested: bool, enabled: bool = None, sample_rate: float = None):
+    """
+    Decide whether to profile a request.
+    :param requested: Whether the request opted in.
+    :param enabled: Whether profiling is enabled, defaults to PROFILING_ENABLED.
+    :param sample_rate: Share of opted-in requests to profile, defaults to PROFILE_SAMPLE_RATE.
+    :return: True if the request is to be profiled.
+    """
+    enabled = PROFILING_ENABLED if enabled is None else enabled
+    sample_rate = PROFILE_SAMPLE_RATE if sample_rate is None else sample_rate
+    return enabled and requested and random.random() < sample_rate
+
+
+class ProfileSession:
+    """
+    Collects the cProfile profiles of one request. cProfile only sees the
+    thread it was enabled in, so work handed to other threads is profiled with
+    wrap and merged into the same stats.
+    """
+
+    def __init__(self):
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    def run(self, function, *args, **kwargs):
+        """
+        Call a function under a new profiler of the current thread.
+        :return: The result of the function.
+        """
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function, *args, **kwargs)
+        finally:
+            with self.lock:
+                self.profiles.append(profile)
+
+    def wrap(self, function):
+        """
+        :param function: Function to be called later, e.g. on a worker thread.
+        :return: Function profiling every call into this session.
+        """
+        def profiled(*args, **kwargs):
+            return self.run(function, *args, **kwargs)
+        return profiled
+
+    def stats(self):
+        """
+        :return: pstats.Stats of every collected profile, None without profiles.
+        """
+        with self.lock:
+            profiles = list(self.profiles)
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+
+class ProfileStore:
+    """
+    Bounded ring of profile files on disk, in pstats format
+    (open with `python -m pstats <file>` or snakeviz).
+    """
+
+    def __init__(self, directory: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES):
+        """
+        :param directory: Directory of the profile files.
+        :param max_files: Number of profiles kept.
+        """
+        self.directory = directory
+        self.max_files = max_files
+        self.lock = threading.Lock()
+
+    def save(self, session: ProfileSession, name: str):
+        """
+        Write the profile of a request and delete the oldest profiles above max_files.
+        :param session: Profiles of the request.
+        :param name: Short description of the request, e.g. the callback name.
+        :return: Id of the saved profile, None if the session has no profile.
+        """
+        stats = session.stats()
+        if stats is None:
+            return None
+        label = re.sub(r"[^A-Za-z0-9_-]+", "_", name)[:60]
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{label}-{uuid.uuid4().hex[:8]}"
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            stats.dump_stats(os.path.join(self.directory, profile_id + PROFILE_SUFFIX))
+            for old_profile in self.list()[self.max_files:]:
+                os.remove(self.path(old_profile["profile_id"]))
+        logger.info("Saved profile %s", profile_id)
+        return profile_id
+
+    def list(self):
+        """
+        :return: Id, size and modification time of the stored profiles, newest first.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(PROFILE_SUFFIX):
+                continue
+            stat = os.stat(os.path.join(self.directory, file_name))
+            profiles.append({"profile_id": file_name[:-len(PROFILE_SUFFIX)],
+                             "bytes": stat.st_size, "modified": stat.st_mtime})
+        return sorted(profiles, key=lambda profile: (profile["modified"],
+                                                     profile["profile_id"]),
+                      reverse=True)
+
+    def path(self, profile_id: str):
+        """
+        :param profile_id: Id returned by save.
+        :return: Path of the profile file, None for unknown ids.
+        """
+        if not re.fullmatch(r"[A-Za-z0-9_-]+", profile_id):
+            return None
+        path = os.path.join(self.directory, profile_id + PROFILE_SUFFIX)
+        return path if os.path.isfile(path) else None
+
+
+profile_store = ProfileStore()
@@ -0,0 +1,30 @@
+# Definitions of the stored tables shared by the DB, API fetcher and UI services
+
+# First day of the stored history
+HISTORY_START_DATE = '2024-06-03'
+
+# Measure columns of the time-series tables
+TABLE_MEASURES = {
+    'daily_weather_data': ['temperature_2m_cels', 'rain_mm', 'wind_speed_kmh'],
+    'forecast_weather_data': ['temperature_2m_cels', 'rain_mm', 'wind_speed_kmh'],
+    'air_quality_data': ['pm10', 'pm2_5', 'carbon_dioxide',
+                         'nitrogen_dioxide', 'sulphur_dioxide', 'ozone'],
+}
+
+# Source table -> (rollup table, measure columns, granularities of date_trunc).
+# The forecasts span a few days and are always read raw, so they have no rollup.
+ROLLUPS = {
+    'daily_weather_data': ('daily_weather_rollup',
+                           TABLE_MEASURES['daily_weather_data'],
+                           ['week', 'month']),
+    'air_quality_data': ('air_quality_rollup',
+                         TABLE_MEASURES['air_quality_data'],
+                         ['day', 'week', 'month']),
+}
+
+# Fact tables range partitioned by month of date_id on PostgreSQL
+PARTITIONED_TABLES = ['daily_weather_data', 'air_quality_data', 'forecast_weather_data']
+
+# Tables whose stored rows change upstream: forecasts are recomputed every hour,
+# so their saves overwrite the stored rows. The other tables keep them.
+UPSERT_TABLES = {'forecast_weather_data'}
@@ -0,0 +1,200 @@
+import os
+import threading
+import uuid
+from abc import ABC, abstractmethod
+import pandas as pd
+from common.schema import UPSERT_TABLES
+
+# Backend used for the time-series tables: 'postgres' or 'parquet'
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'postgres')
+# Root directory of the Parquet datasets, shared by the API fetcher and the UI
+PARQUET_ROOT = os.environ.get('PARQUET_ROOT', 'parquet_data')
+
+
+class StorageBackend(ABC):
+    """
+    Interface of the stores the time-series tables can be saved to and read from.
+    Every table is keyed on (place_id, date_id).
+    """
+
+    @abstractmethod
+    def save(self, dataframe, table_name, update=None):
+        """
+        Save a DataFrame, rows whose key is already stored are skipped or,
+        for the UPSERT_TABLES, overwritten.
+        :param dataframe: DataFrame with place_id, date_id and measure columns.
+        :param table_name: Name of the table.
+        :param update: Overwrite already stored rows instead of skipping them,
+                       defaults to whether the table is one of UPSERT_TABLES.
+        :return: Number of rows saved.
+        """
+
+    @abstractmethod
+    def read(self, table_name, place_ids=None, columns=None,
+             start_date=None, end_date=None):
+        """
+        Read rows of a table ordered by place_id and date_id.
+        :param table_name: Name of the table.
+        :param place_ids: Optional ids of the places to read.
+        :param columns: Optional measure columns to read, place_id and date_id are always read.
+        :param start_date: Optional inclusive lower bound of date_id.
+        :param end_date: Optional exclusive upper bound of date_id.
+        :return: Pandas DataFrame.
+        """
+
+    @abstractmethod
+    def watermarks(self, table_name, place_ids):
+        """
+        Read the latest stored date_id of every place.
+        :param table_name: Name of the table.
+        :param place_ids: Ids of the places to look up.
+        :return: Dictionary of place_id -> latest date_id, places without data are missing.
+        """
+
+    @abstractmethod
+    def place_ids(self, table_name):
+        """
+        Read the ids of the places a table holds rows of.
+        :param table_name: Name of the table.
+        :return: Set of place_ids.
+        """
+
+
+class ParquetStorage(StorageBackend):
+    """
+    Stores every table as a Parquet dataset on local disk, hive partitioned by
+    place and month (<root>/<table>/place_id=<id>/month=<YYYY-MM>/data.parquet).
+    Reads memory map the files and push the column selection and the place and
+    date filters down to the dataset scan.
+    """
+
+    def __init__(self, root, on_saved=None):
+        """
+        :param root: Directory of the datasets.
+        :param on_saved: Optional function called with the place_ids whose rows changed.
+        """
+        import pyarrow  # noqa: F401, fails early if the optional dependency is missing
+
+        self.root = root
+        self.on_saved = on_saved
+        self.lock = threading.Lock()
+
+    def _partition_path(self, table_name, place_id, month):
+        return os.path.join(self.root, table_name, f"place_id={place_id}",
+                            f"month={month}", "data.parquet")
+
+    def save(self, dataframe, table_name, update=None):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if dataframe.empty:
+            return 0
+        if update is None:
+            update = table_name in UPSERT_TABLES
+
+        # Stored like in PostgreSQL, as naive UTC timestamps
+        dataframe = dataframe.assign(date_id=pd.to_datetime(
+            dataframe['date_id'], utc=True).dt.tz_localize(None))
+        months = dataframe['date_id'].dt.strftime('%Y-%m')
+
+        saved_rows = 0
+        # Partitions are rewritten as a whole, one writer at a time
+        with self.lock:
+            for (place_id, month), partition in dataframe.groupby(
+                    [dataframe['place_id'], months], sort=False):
+                path = self._partition_path(table_name, place_id, month)
+                rows = partition.drop(columns=['place_id'])
+                changed_rows = len(rows)
+                if os.path.exists(path):
+                    stored = pq.read_table(path, memory_map=True).to_pandas()
+                    # New rows, and with update the rows whose values changed
+                    compared = stored if update else stored[['date_id']]
+                    changed_rows = int((rows.merge(
+                        compared, how='left', on=list(compared.columns),
+                        indicator=True)['_merge'] == 'left_only').sum())
+                    if not changed_rows:
+                        continue
+                    rows = pd.concat([stored, rows], ignore_index=True)
+                    rows = rows.drop_duplicates(
+                        subset=['date_id'], keep='last' if update else 'first')
+                rows = rows.sort_values('date_id')
+                saved_rows += changed_rows
+
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Written next to the partition and renamed, readers never see half a file
+                temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+                pq.write_table(pa.Table.from_pandas(rows, preserve_index=False),
+                               temporary_path)
+                os.replace(temporary_path, path)
+
+        if saved_rows and self.on_saved is not None:
+            self.on_saved(dataframe['place_id'].unique())
+        print(f"{saved_rows} rows successfully saved to dataset '{table_name}'.")
+        return saved_rows
+
+    def _dataset(self, table_name):
+        import pyarrow.dataset as ds
+        from pyarrow import fs
+
+        path = os.path.join(self.root, table_name)
+        if not os.path.isdir(path):
+            return None
+        return ds.dataset(path, format='parquet', partitioning='hive',
+                          filesystem=fs.LocalFileSystem(use_mmap=True))
+
+    def read(self, table_name, place_ids=None, columns=None,
+             start_date=None, end_date=None):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        dataset = self._dataset(table_name)
+        if dataset is None:
+            return pd.DataFrame(columns=['place_id', 'date_id', *(columns or [])])
+
+        condition = None
+
+        def add(expression):
+            return expression if condition is None else condition & expression
+
+        if place_ids is not None:
+            condition = add(ds.field('place_id').isin([int(place_id) for place_id in place_ids]))
+        # The month filters prune partitions, the date filters the rows in them
+        if start_date is not None:
+            start = pd.Timestamp(start_date).tz_localize(None)
+            condition = add(ds.field('month') >= start.strftime('%Y-%m'))
+            condition = add(ds.field('date_id') >= pa.scalar(start.to_pydatetime(),
+                                                             type=pa.timestamp('us')))
+        if end_date is not None:
+            end = pd.Timestamp(end_date).tz_localize(None)
+            condition = add(ds.field('month') <= end.strftime('%Y-%m'))
+            condition = add(ds.field('date_id') < pa.scalar(end.to_pydatetime(),
+                                                            type=pa.timestamp('us')))
+
+        selected = ['place_id', 'date_id', *(
+            columns if columns is not None else
+            [name for name in dataset.schema.names
+             if name not in ('place_id', 'date_id', 'month')])]
+        frame = dataset.to_table(columns=selected, filter=condition).to_pandas()
+        frame['date_id'] = frame['date_id'].astype('datetime64[ns]')
+        return frame.sort_values(['place_id', 'date_id'], ignore_index=True)
+
+    def watermarks(self, table_name, place_ids):
+        dataset = self._dataset(table_name)
+        place_ids = [int(place_id) for place_id in place_ids]
+        if dataset is None or not place_ids:
+            return {}
+        import pyarrow.dataset as ds
+
+        frame = dataset.to_table(
+            columns=['place_id', 'date_id'],
+            filter=ds.field('place_id').isin(place_ids)).to_pandas()
+        latest = frame.groupby('place_id')['date_id'].max()
+        return {int(place_id): date_id for place_id, date_id in latest.items()}
+
+    def place_ids(self, table_name):
+        # Every place is a partition directory of the dataset
+        path = os.path.join(self.root, table_name)
+        if not os.path.isdir(path):
+            return set()
+        return {int(name.split('=', 1)[1]) for name in os.listdir(path)
+                if name.startswith('place_id=')}